@@ -89,6 +89,22 @@ class IdentificationAdmin(admin.ModelAdmin):
         return "{}".format(obj.observation.status)
 
 
+class ResolvedIdentificationAdmin(admin.ModelAdmin):
+    list_display = ('observation', 'taxon', 'taxon_rank', 'sex', 'stage', 'confidence', 'updated_on',)
+    ordering = ('observation', 'taxon', 'taxon_rank', 'sex', 'stage', 'confidence',)
+    search_fields = ('observation__specimen_label', 'taxon', 'taxon_rank', 'sex', 'stage', 'confidence',)
+    readonly_fields = ('observation', 'identification', 'taxon', 'taxon_rank', 'sex', 'stage', 'confidence',
+                       'updated_on',)
+
+
+class DataCheckViolationAdmin(admin.ModelAdmin):
+    list_display = ('data_check', 'result', 'opened_on', 'closed_on',)
+    ordering = ('data_check', 'result', 'opened_on',)
+    search_fields = ('data_check', 'result',)
+    list_filter = ('data_check',)
+    readonly_fields = ('data_check', 'observation', 'survey', 'result', 'opened_on', 'closed_on',)
+
+
 class TaxonomyClassAdmin(admin.ModelAdmin):
     list_display = ('taxclass',)
     ordering = ('taxclass',)
@@ -186,6 +202,8 @@ admin.site.register(models.Visit, VisitAdmin)
 admin.site.register(models.Observation, ObservationAdmin)
 admin.site.register(models.Photograph, PhotographAdmin)
 admin.site.register(models.Identification, IdentificationAdmin)
+admin.site.register(models.ResolvedIdentification, ResolvedIdentificationAdmin)
+admin.site.register(models.DataCheckViolation, DataCheckViolationAdmin)
 admin.site.register(models.TaxonomyClass, TaxonomyClassAdmin)
 admin.site.register(models.TaxonomyOrder, TaxonomyOrderAdmin)
 admin.site.register(models.TaxonomySuborder, TaxonomySuborderAdmin)
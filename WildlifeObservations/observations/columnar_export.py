@@ -0,0 +1,183 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models, transaction
+
+from .models import Site, TaxonomyClass, TaxonomyFamily, TaxonomyGenus, TaxonomyOrder, TaxonomySpecies, \
+    TaxonomySubfamily, TaxonomySuborder
+
+# Formats of the columnar exports: Parquet files, or Arrow IPC files (also known as Feather version 2). Both can be read
+# by the arrow package of R, with read_parquet() and read_feather() (or read_ipc_file()).
+PARQUET = 'parquet'
+ARROW = 'arrow'
+FORMATS = [PARQUET, ARROW]
+
+# Number of rows of each batch (row group in Parquet files), which are read from the database and written one at a time
+BATCH_SIZE = 10000
+
+
+def import_pyarrow():
+    """Return the pyarrow module, which is only needed for the columnar exports and is not installed by default."""
+
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('The columnar exports need pyarrow, which can be installed with "pip install pyarrow==6.0.1" '
+                          '(see requirements.txt)')
+
+    return pyarrow
+
+
+# Models whose text fields are categories, with a few values that are repeated in many rows of the exports. These fields
+# are dictionary-encoded (factors in R).
+CATEGORY_MODELS = [Site, TaxonomyClass, TaxonomyOrder, TaxonomySuborder, TaxonomyFamily, TaxonomySubfamily,
+                   TaxonomyGenus, TaxonomySpecies]
+
+
+def get_model_field(model, path):
+    """Return the model field of a field path as used in values() (e.g. 'observation__survey__visit__date')."""
+
+    names = path.split('__')
+
+    for name in names[:-1]:
+        model = model._meta.get_field(name).related_model
+
+    field = model._meta.get_field(names[-1])
+
+    if field.is_relation:
+        raise FieldDoesNotExist(f'{path} is a relation: export one of the fields of the related model')
+
+    return field
+
+
+def get_dictionary(field):
+    """Return the list of the values of the dictionary of a text field, or None if the field is not dictionary-encoded.
+
+    Fields with choices are encoded with the values of the choices, so that their levels are the same in every export.
+    Text fields of CATEGORY_MODELS are encoded with all of the values of the field in its table, which are read with
+    one query. Other text fields (specimen labels, notes...) are not encoded.
+    """
+
+    if field.choices:
+        return [value for value, label in field.choices]
+
+    if field.model in CATEGORY_MODELS:
+        return list(field.model.objects.order_by(field.name).values_list(field.name, flat=True).distinct())
+
+    return None
+
+
+def get_arrow_type(pa, field):
+    """Return the Arrow type of the values of a model field."""
+
+    if isinstance(field, (models.CharField, models.TextField)):
+        return pa.string()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.BigIntegerField, models.BigAutoField)):
+        return pa.int64()
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return pa.int32()
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.DateTimeField):  # before DateField, which it is a subclass of
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.TimeField):
+        return pa.time64('us')
+
+    raise TypeError(f'{field} cannot be exported to a columnar file')
+
+
+class ColumnarColumn:
+    """A column of a columnar export: the name, the field path (as in values()), the Arrow type and, for
+    dictionary-encoded columns, the dictionary and the position of each of its values."""
+
+    def __init__(self, pa, model, name, path):
+        field = get_model_field(model, path)
+
+        self.name = name
+        self.path = path
+        self.value_type = get_arrow_type(pa, field)
+
+        dictionary = get_dictionary(field) if self.value_type == pa.string() else None
+
+        if dictionary is None:
+            self.dictionary = None
+            self.arrow_type = self.value_type
+        else:
+            self.dictionary = pa.array(dictionary, type=pa.string())
+            self.positions = {value: position for position, value in enumerate(dictionary)}
+            self.arrow_type = pa.dictionary(pa.int32(), pa.string())
+
+    def to_array(self, pa, values):
+        """Return the Arrow array of the values of a batch."""
+
+        if self.dictionary is None:
+            return pa.array(values, type=self.value_type)
+
+        indices = pa.array([None if value is None else self.positions[value] for value in values], type=pa.int32())
+
+        return pa.DictionaryArray.from_arrays(indices, self.dictionary)
+
+
+def export_columnar(output_path, querysets, columns, file_format=PARQUET, batch_size=BATCH_SIZE):
+    """Export the rows of the querysets (one after the other) to a columnar file.
+
+    columns is a dictionary of the name of each column and its field path, as in values(). The types of the columns are
+    those of the model fields, and null values are kept as nulls. The rows are read from the database and written in
+    batches of batch_size rows, so the memory that is used does not depend on the number of rows.
+
+    Return the number of rows that have been exported.
+    """
+
+    pa = import_pyarrow()
+
+    with transaction.atomic():  # the dictionaries and the rows are read from the same state of the database
+        return write_columnar(pa, output_path, querysets, columns, file_format, batch_size)
+
+
+def write_columnar(pa, output_path, querysets, columns, file_format, batch_size):
+    """Write the columnar file of export_columnar. Return the number of rows."""
+
+    model = querysets[0].model
+    columns = [ColumnarColumn(pa, model, name, path) for name, path in columns.items()]
+    schema = pa.schema([pa.field(column.name, column.arrow_type) for column in columns])
+
+    if file_format == PARQUET:
+        writer = pa.parquet.ParquetWriter(output_path, schema)
+    elif file_format == ARROW:
+        writer = pa.ipc.new_file(output_path, schema)
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
+
+    number_rows = 0
+
+    def write_batch(rows):
+        values = list(zip(*rows))
+        batch = pa.RecordBatch.from_arrays([column.to_array(pa, values[i]) for i, column in enumerate(columns)],
+                                           schema=schema)
+
+        if file_format == PARQUET:
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+
+    with writer:
+        rows = []
+
+        for queryset in querysets:
+            for row in queryset.values_list(*[column.path for column in columns]).iterator(chunk_size=batch_size):
+                rows.append(row)
+
+                if len(rows) == batch_size:
+                    write_batch(rows)
+                    number_rows += len(rows)
+                    rows = []
+
+        if rows:
+            write_batch(rows)
+            number_rows += len(rows)
+
+    return number_rows
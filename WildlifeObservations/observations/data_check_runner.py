@@ -0,0 +1,305 @@
+import time
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .data_integrity_checks import DATA_CHECKS, ERROR, SURVEYS, IdentificationDataChecks, ObservationDataChecks, \
+    SurveyDataChecks
+from .models import DataCheckViolation, DataCheckWatermark, Identification, MeteorologyConditions, Observation, \
+    Survey
+from .utils import IN_QUERY_CHUNK_SIZE, QueryCounter
+
+# Sites that were used to practise the methods. Their observations are not included in the analysis, so some checks
+# ignore them.
+PRACTICE_SITES = ["TAV02", "TAV04", "MOL07", "MOL10", "BOR01"]
+
+
+class DataCheckRun:
+    """One run of the data checks of the registry.
+
+    The results of each check and the data that is shared between checks (see shared()) are calculated once and kept
+    for the rest of the run. The time and the number of queries of each check are recorded; a shared query is counted
+    in the first check that uses it.
+
+    If stream is True, the results of the checks that return a queryset are read from the database while they are
+    printed and are not kept, only their number.
+
+    observations and surveys are querysets of the observations and surveys to check (see the data check classes), or
+    None to check all of them.
+    """
+
+    def __init__(self, practice_sites=PRACTICE_SITES, stream=False, observations=None, surveys=None):
+        self.practice_sites = practice_sites
+        self.stream = stream
+
+        self.identification_checks = IdentificationDataChecks(observations)
+        self.observation_checks = ObservationDataChecks(observations)
+        self.survey_checks = SurveyDataChecks(surveys)
+
+        self.shared_data = {}
+        self.results = {}
+        self.counts = {}
+        self.timings = {}
+        self.query_counts = {}
+
+    def shared(self, name, function):
+        """Return the result of the function, which is only called the first time that it is requested in the run."""
+
+        if name not in self.shared_data:
+            self.shared_data[name] = function()
+
+        return self.shared_data[name]
+
+    def evaluate(self, data_check):
+        """Return list of the results of the data check, which is only evaluated the first time in the run."""
+
+        if data_check.name not in self.results:
+            start = time.perf_counter()
+
+            with QueryCounter() as queries:
+                results = list(data_check.evaluate(self))
+
+            self.record(data_check, start, queries.count, len(results))
+            self.results[data_check.name] = results
+
+        return self.results[data_check.name]
+
+    def stream_data_check(self, data_check):
+        """Evaluate the data check and, if its results are a queryset, print them while they are read. Return False if
+        the results are not a queryset, which are kept to be printed by print_data_check."""
+
+        start = time.perf_counter()
+
+        with QueryCounter() as queries:
+            results = data_check.evaluate(self)
+
+            if isinstance(results, QuerySet):
+                count = 0
+                for result in results.iterator():
+                    print(data_check.format_result(result))
+                    count += 1
+
+                print("\n" + str(count), "results")
+            else:
+                results = list(results)
+                count = len(results)
+                self.results[data_check.name] = results
+
+        self.record(data_check, start, queries.count, count)
+
+        return data_check.name not in self.results
+
+    def record(self, data_check, start, query_count, count):
+        self.timings[data_check.name] = time.perf_counter() - start
+        self.query_counts[data_check.name] = query_count
+        self.counts[data_check.name] = count
+
+    def print_data_check(self, data_check, first=False):
+        """Evaluate the data check and print its title, its number of results and the results."""
+
+        print(("" if first else "\n") + "***** " + data_check.title + " *****")
+
+        if self.stream and self.stream_data_check(data_check):
+            return
+
+        results = self.evaluate(data_check)
+
+        print(len(results), "results:\n")
+        for result in results:
+            print(data_check.format_result(result))
+
+    def errors(self):
+        """Return list of the data checks with severity error that have results."""
+
+        return [data_check for data_check in DATA_CHECKS
+                if data_check.severity == ERROR and self.counts.get(data_check.name)]
+
+
+def get_data_checks(scopes):
+    """Return list of the data checks of the scopes, in the order of the registry."""
+
+    return [data_check for data_check in DATA_CHECKS if data_check.scope in scopes]
+
+
+def print_data_check_timings(run, data_checks):
+    """Print the severity, number of results, time and number of queries of each data check of the run."""
+
+    print("\n***** Data check timings *****")
+
+    for data_check in data_checks:
+        print(f"{data_check.name:<60} {data_check.severity:<8} {run.counts[data_check.name]:>6} results "
+              f"{run.timings[data_check.name]:>8.3f} s {run.query_counts[data_check.name]:>4} queries")
+
+    print(f"{'Total':<69} {sum(run.counts.values()):>6} results {sum(run.timings.values()):>8.3f} s "
+          f"{sum(run.query_counts.values()):>4} queries")
+
+
+def add_data_check_arguments(parser):
+    """Add the arguments of the data check commands to the parser."""
+
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the results of the checks that return many rows from the database while they are '
+                             'printed, and print the number of results at the end')
+    parser.add_argument('--timings', action='store_true',
+                        help='Print the number of results, time and number of queries of each check')
+    parser.add_argument('--fail_on_error', action='store_true',
+                        help='Exit with an error if any check with severity error has results (open violations with '
+                             '--incremental)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only check the data that has changed since the last incremental run, keep the '
+                             'violations in the database and print all of the open violations')
+    parser.add_argument('--rescan', action='store_true',
+                        help='With --incremental, check all of the data again')
+
+
+def raise_errors(errors):
+    if errors:
+        raise CommandError(f"{len(errors)} data checks with severity error have results: "
+                           f"{', '.join(data_check.name for data_check in errors)}")
+
+
+def run_data_checks(scopes, options):
+    """Run and print the data checks of the scopes, with the options of the data check commands (see
+    add_data_check_arguments)."""
+
+    if options['incremental']:
+        run_incremental_data_checks(scopes, options)
+        return
+
+    data_checks = get_data_checks(scopes)
+    run = DataCheckRun(stream=options['stream'])
+
+    for i, data_check in enumerate(data_checks):
+        run.print_data_check(data_check, first=i == 0)
+
+    if options['timings']:
+        print_data_check_timings(run, data_checks)
+
+    if options['fail_on_error']:
+        raise_errors(run.errors())
+
+
+def changed_observations(since):
+    """Return queryset of the observations that have been updated after since, or whose identifications have been
+    created, updated, moved or deleted after since (see signals)."""
+
+    identifications = Identification.objects.filter(updated_on__gt=since).values('observation_id')
+
+    return Observation.objects.filter(Q(updated_on__gt=since) | Q(pk__in=identifications))
+
+
+def changed_surveys(since):
+    """Return queryset of the surveys that have been updated after since, or whose meteorological conditions have been
+    created, updated or deleted after since (see signals)."""
+
+    meteorology_conditions = MeteorologyConditions.objects.filter(updated_on__gt=since).values('survey_id')
+
+    return Survey.objects.filter(Q(updated_on__gt=since) | Q(pk__in=meteorology_conditions))
+
+
+def get_subject_ids(data_check, results, subjects):
+    """Return dictionary of the id of the observation or survey of each subject key (see DataCheck) of the results.
+    subjects is the queryset of the surveys that have been checked, or None."""
+
+    keys = {data_check.subject_key(result) for result in results}
+
+    if data_check.scope == SURVEYS:
+        surveys = Survey.objects.all() if subjects is None else subjects
+
+        return {(site_name, date, method, repeat): survey_id for site_name, date, method, repeat, survey_id in
+                surveys.values_list('visit__site__site_name', 'visit__date', 'method', 'repeat', 'id')
+                if (site_name, date, method, repeat) in keys}
+
+    keys = list(keys)
+    subject_ids = {}
+
+    for i in range(0, len(keys), IN_QUERY_CHUNK_SIZE):
+        subject_ids.update(Observation.objects.filter(specimen_label__in=keys[i:i + IN_QUERY_CHUNK_SIZE]).values_list(
+            'specimen_label', 'id'))
+
+    return subject_ids
+
+
+def update_violations(data_check, results, subjects, now):
+    """Update the open violations of the data check of the subjects that have been checked (a queryset of observations
+    or surveys, or None if all of them have been checked): the violations that are no longer in the results are closed
+    and the new results are added. Return the number of violations that have been added and closed."""
+
+    subject_field = 'survey_id' if data_check.scope == SURVEYS else 'observation_id'
+    subject_ids = get_subject_ids(data_check, results, subjects)
+
+    found = {(subject_ids[data_check.subject_key(result)], data_check.format_result(result)) for result in results}
+
+    open_violations = DataCheckViolation.objects.filter(data_check=data_check.name, closed_on__isnull=True)
+    if subjects is not None:
+        open_violations = open_violations.filter(**{subject_field + '__in': subjects.values('pk')})
+
+    existing = {(subject_id, result): violation_id
+                for violation_id, subject_id, result in open_violations.values_list('id', subject_field, 'result')}
+
+    closed = [violation_id for key, violation_id in existing.items() if key not in found]
+    for i in range(0, len(closed), IN_QUERY_CHUNK_SIZE):
+        DataCheckViolation.objects.filter(id__in=closed[i:i + IN_QUERY_CHUNK_SIZE]).update(closed_on=now)
+
+    opened = [DataCheckViolation(data_check=data_check.name, result=result, opened_on=now, **{subject_field: subject_id})
+              for subject_id, result in sorted(found - existing.keys())]
+    DataCheckViolation.objects.bulk_create(opened, batch_size=IN_QUERY_CHUNK_SIZE)
+
+    return len(opened), len(closed)
+
+
+def run_incremental_data_checks(scopes, options):
+    """Run the data checks of the scopes only for the observations and surveys that have changed since the last
+    incremental run of each scope (all of them the first time or with the rescan option), update the violations in the
+    database and print all of the open violations of each check.
+
+    The watermark of each scope is the time of the start of its run, so changes made while the checks run are checked
+    again in the next run. A result that is repeated (e.g. for two identifications of the same observation) is one
+    violation.
+    """
+
+    first = True
+    errors = []
+
+    for scope in scopes:
+        data_checks = get_data_checks([scope])
+        started_on = timezone.now()
+
+        watermark = DataCheckWatermark.objects.filter(scope=scope).first()
+
+        if watermark is None or options['rescan']:
+            run = DataCheckRun()
+        elif scope == SURVEYS:
+            run = DataCheckRun(surveys=changed_surveys(watermark.checked_until))
+        else:
+            run = DataCheckRun(observations=changed_observations(watermark.checked_until))
+
+        subjects = run.survey_checks.surveys if scope == SURVEYS else run.identification_checks.observations
+
+        with transaction.atomic():
+            for data_check in data_checks:
+                opened, closed = update_violations(data_check, run.evaluate(data_check), subjects, started_on)
+
+                open_violations = DataCheckViolation.objects.filter(data_check=data_check.name,
+                                                                    closed_on__isnull=True).order_by('result', 'id')
+                number_open = open_violations.count()
+
+                print(("" if first else "\n") + "***** " + data_check.title + " *****")
+                print(number_open, f"results ({opened} new, {closed} closed):\n")
+                for violation in open_violations.values_list('result', flat=True).iterator():
+                    print(violation)
+
+                first = False
+
+                if data_check.severity == ERROR and number_open:
+                    errors.append(data_check)
+
+            DataCheckWatermark.objects.update_or_create(scope=scope, defaults={'checked_until': started_on})
+
+        if options['timings']:
+            print_data_check_timings(run, data_checks)
+
+    if options['fail_on_error']:
+        raise_errors(errors)
@@ -1,13 +1,71 @@
-from django.db.models import Q, Count
+import itertools
+
+from django.db.models import CharField, Count, Exists, IntegerField, OuterRef, Q, Value
+from django.db.models.functions import Coalesce
 
 from .models import Identification, Observation, Survey, MeteorologyConditions, Site
 
+# Taxonomic levels of an identification, from the lowest to the highest
+TAXONOMY_FIELDS = ['species', 'genus', 'subfamily', 'family', 'suborder']
+
+FINALISED_AND_CONFIRMED = [Identification.Confidence.FINALISED, Identification.Confidence.CONFIRMED]
+
+# Fields that must be the same in the confirmed or finalised identifications of an observation, with the confidences of
+# the identifications that are compared. Finalised identifications are one of several taxa, so their taxonomy can differ.
+CONSISTENCY_RULES = [('sex', FINALISED_AND_CONFIRMED),
+                     ('stage', FINALISED_AND_CONFIRMED),
+                     ('species', [Identification.Confidence.CONFIRMED]),
+                     ('genus', [Identification.Confidence.CONFIRMED]),
+                     ('subfamily', [Identification.Confidence.CONFIRMED]),
+                     ('family', [Identification.Confidence.CONFIRMED]),
+                     ('suborder', [Identification.Confidence.CONFIRMED])]
+
 
 class IdentificationDataChecks:
-    def __init__(self):
-        pass
+    def __init__(self, observations=None):
+        """
+        observations is a queryset of the observations to check (e.g. those that have changed since the last check).
+        All of the observations are checked if it is None.
+        """
+
+        self.observations = observations
+
+    def get_observations(self):
+        """
+        Returns a queryset of the observations that are checked.
+        """
+
+        if self.observations is None:
+            return Observation.objects.all()
+
+        return Observation.objects.filter(pk__in=self.observations.values('pk'))
+
+    def get_identifications(self):
+        """
+        Returns a queryset of the identifications of the observations that are checked.
+        """
+
+        if self.observations is None:
+            return Identification.objects.all()
+
+        return Identification.objects.filter(observation__in=self.observations.values('pk'))
+
+    def get_identifications_missing_values(self):
+        """
+        Returns a list of dictionaries of the identifications that do not have a sex, a stage or a confidence, with the
+        specimen label and site of their observation, in the order that they were entered.
+
+        This reads all of the identifications that are needed by check_identification_has_sex_adults_only,
+        check_identification_has_sex, check_identification_has_stage and check_identification_has_confidence with one
+        query, so that the result can be shared between these checks.
+        """
+
+        return list(self.get_identifications().filter(
+            Q(sex__isnull=True) | Q(stage__isnull=True) | Q(confidence__isnull=True)).order_by('id').values(
+            'observation__specimen_label', 'observation__survey__visit__site__site_name', 'sex', 'stage',
+            'confidence'))
 
-    def check_identification_has_sex_adults_only(self):
+    def check_identification_has_sex_adults_only(self, identifications_missing_values=None):
         """
         Returns list of dictionaries of the identifications that do not have a sex, only for the specimens that have
         been noted as adults.
@@ -16,20 +74,24 @@ class IdentificationDataChecks:
         these identifications should still have sex=UNKNOWN, therefore this query considers all identifications,
         not just the adults.
 
+        The identifications can be given from get_identifications_missing_values, otherwise they are read.
+
         e.g.    [{"specimen_label": TOR08 20211005 H1 C001},
                 {"specimen_label": TAV09 20211006 N1 C008}]
         """
 
-        identifications = Identification.objects.filter(stage=Identification.Stage.ADULT, sex__isnull=True)
+        if identifications_missing_values is None:
+            identifications_missing_values = self.get_identifications_missing_values()
 
         identifications_missing_sex = []
 
-        for identification in identifications:
-            identifications_missing_sex.append({"specimen_label": identification.observation.specimen_label})
+        for identification in identifications_missing_values:
+            if identification['stage'] == Identification.Stage.ADULT and identification['sex'] is None:
+                identifications_missing_sex.append({"specimen_label": identification['observation__specimen_label']})
 
         return identifications_missing_sex
 
-    def check_identification_has_sex(self):
+    def check_identification_has_sex(self, identifications_missing_values=None):
         """
         Returns list of dictionaries of the identifications that do not have a sex.
 
@@ -37,37 +99,45 @@ class IdentificationDataChecks:
         these identifications should still have sex=UNKNOWN, therefore this query considers all identifications,
         not just the adults.
 
+        The identifications can be given from get_identifications_missing_values, otherwise they are read.
+
         e.g.    [{"specimen_label": TOR08 20211005 H1 C001},
                 {"specimen_label": TAV09 20211006 N1 C008}]
         """
 
-        identifications = Identification.objects.filter(sex__isnull=True)
+        if identifications_missing_values is None:
+            identifications_missing_values = self.get_identifications_missing_values()
 
         identifications_missing_sex = []
 
-        for identification in identifications:
-            identifications_missing_sex.append({"specimen_label": identification.observation.specimen_label})
+        for identification in identifications_missing_values:
+            if identification['sex'] is None:
+                identifications_missing_sex.append({"specimen_label": identification['observation__specimen_label']})
 
         return identifications_missing_sex
 
-    def check_identification_has_stage(self):
+    def check_identification_has_stage(self, identifications_missing_values=None):
         """
         Returns list of dictionaries of the identifications that do not have a stage.
 
+        The identifications can be given from get_identifications_missing_values, otherwise they are read.
+
         e.g.    [{"specimen_label": TOR08 20211005 H1 C001},
                 {"specimen_label": TAV09 20211006 N1 C008}]
         """
 
-        identifications = Identification.objects.filter(stage__isnull=True)
+        if identifications_missing_values is None:
+            identifications_missing_values = self.get_identifications_missing_values()
 
         identifications_missing_stage = []
 
-        for identification in identifications:
-            identifications_missing_stage.append({"specimen_label": identification.observation.specimen_label})
+        for identification in identifications_missing_values:
+            if identification['stage'] is None:
+                identifications_missing_stage.append({"specimen_label": identification['observation__specimen_label']})
 
         return identifications_missing_stage
 
-    def check_identification_has_confidence(self, practice_sites):
+    def check_identification_has_confidence(self, practice_sites, identifications_missing_values=None):
         """
         Returns list of dictionaries of the identifications that do not have a confidence.
 
@@ -75,94 +145,115 @@ class IdentificationDataChecks:
                 {"specimen_label": TAV09 20211006 N1 C008}]
 
         Ignore the specimens from practice sites. These will not be included in the analysis.
+
+        The identifications can be given from get_identifications_missing_values, otherwise they are read.
         """
 
-        identifications = Identification.objects.filter(confidence__isnull=True).exclude(
-            observation__survey__visit__site__site_name__in=practice_sites)
+        if identifications_missing_values is None:
+            identifications_missing_values = self.get_identifications_missing_values()
 
         identifications_missing_confidence = []
 
-        for identification in identifications:
-            identifications_missing_confidence.append({"specimen_label": identification.observation.specimen_label})
+        for identification in identifications_missing_values:
+            if identification['confidence'] is None and \
+                    identification['observation__survey__visit__site__site_name'] not in practice_sites:
+                identifications_missing_confidence.append(
+                    {"specimen_label": identification['observation__specimen_label']})
 
         return identifications_missing_confidence
 
     def find_observations_without_identification(self):
         """
-        Returns a set of the observations that do not have any identifications.
+        Returns a queryset of the specimen labels of the observations that do not have any identifications, ordered by
+        specimen label.
+
+        Only these observations are read from the database (using NOT EXISTS), so the queryset can be iterated with
+        iterator() to stream them.
         """
 
-        observations = Observation.objects.all().values_list('specimen_label', flat=True)
-        identifications = Identification.objects.all().values_list('observation__specimen_label', flat=True)
+        identifications = Identification.objects.filter(observation=OuterRef('pk'))
 
-        observations_set = set()
-        for observation in observations:
-            observation: Observation
+        return self.get_observations().filter(~Exists(identifications)).order_by('specimen_label').values_list(
+            'specimen_label', flat=True)
 
-            observations_set.add(observation)
-
-        identifications_set = set()
-        for identification in identifications:
-            identification: Identification
+    def find_observations_without_confirmed_or_finalised_identification(self):
+        """
+        Returns a queryset of the specimen labels of the observations that do not have any identifications that have a
+        confidence that is confirmed or finalised, ordered by specimen label. This query will only consider observations
+        that have at least one identification.
 
-            identifications_set.add(identification)  # creating a set of the identifications, deals with the duplicates
+        Only these observations are read from the database (using NOT EXISTS), so the queryset can be iterated with
+        iterator() to stream them.
+        """
 
-        # get all of the observations that do not have the specimen label in the identifications
-        observations_without_identifications = observations_set - identifications_set
+        identifications = Identification.objects.filter(observation=OuterRef('pk'))
+        finalised_and_confirmed_identifications = identifications.filter(confidence__in=FINALISED_AND_CONFIRMED)
 
-        return observations_without_identifications
+        return self.get_observations().filter(Exists(identifications)).filter(
+            ~Exists(finalised_and_confirmed_identifications)).order_by('specimen_label').values_list('specimen_label',
+                                                                                                     flat=True)
 
-    def add_identifications_to_set(self, set, qs):
-        """
-        Add identifications from a queryset into a set. Return the set.
+    def get_unconfirmed_unfinalised_adults(self, observations_without_confirmation_or_finalisation):
         """
+        Using the set of observations that do not have a confirmed or finalised identification, get only the adults.
 
-        for identification in qs:
-            identification: Identification
+        Return a queryset of these adults.
+        """
 
-            set.add(identification)
+        adults_unconfirmed_unfinalised = Observation.objects.filter(
+            specimen_label__in=observations_without_confirmation_or_finalisation).filter(
+            identification__stage=Identification.Stage.ADULT)
 
-        return set
+        return adults_unconfirmed_unfinalised
 
-    def find_observations_without_confirmed_or_finalised_identification(self):
+    def check_finalised_confirmed_consistency(self):
         """
-        Returns a set of the observations that do not have any identifications that have a confidence
-        that is confirmed or finalised. This query will only consider observations that have at least one
-        identification.
+        Returns a dictionary of sets of the specimen labels of the observations that break each of the rules in
+        CONSISTENCY_RULES, i.e. whose confirmed or finalised identifications do not agree on a field. A non-empty field
+        and null are considered to be inconsistent.
+
+        The dictionary also has the key 'finalised_number', with the observations that only have one finalised
+        identification: specimens with finalised identifications should have two or more.
+
+        All rules are checked at the same time with one grouped query, which only returns the observations that break
+        at least one of them.
+
+        e.g.    {'sex': {"TOR08 20211005 H1 C001"}, 'stage': set(), 'species': set(), 'genus': set(),
+                'subfamily': set(), 'family': set(), 'suborder': set(), 'finalised_number': {"TAV09 20211006 N1 C008"}}
         """
 
-        all_identifications = Identification.objects.all().values_list('observation__specimen_label', flat=True)
-        finalised_and_confirmed_identifications = self.get_all_finalised_and_confirmed_identifications()
+        annotations = {}
+        breaks_a_rule = Q()
 
-        finalised_and_confirmed_identifications_qs = finalised_and_confirmed_identifications.values_list(
-            'observation__specimen_label', flat=True)
+        for rule, confidences in CONSISTENCY_RULES:
+            field = Identification._meta.get_field(rule)
 
-        all_identifications_set = set()
-        finalised_and_confirmed_identifications_set = set()
+            if field.is_relation:
+                value = Coalesce(rule, Value(0), output_field=IntegerField())
+            else:
+                value = Coalesce(rule, Value(''), output_field=CharField())
 
-        all_identifications_set = self.add_identifications_to_set(all_identifications_set, all_identifications)
-        finalised_and_confirmed_identifications_set = self.add_identifications_to_set(
-            finalised_and_confirmed_identifications_set,
-            finalised_and_confirmed_identifications_qs)
+            annotations['distinct_' + rule] = Count(value, distinct=True, filter=Q(confidence__in=confidences))
+            breaks_a_rule |= Q(**{'distinct_' + rule + '__gt': 1})
 
-        observations_without_confirmation_or_finalisation = \
-            all_identifications_set - finalised_and_confirmed_identifications_set  # as this is
-        # reduced to distinct specimen labels, these are equivalent to the observations
+        annotations['number_finalised'] = Count('id', filter=Q(confidence=Identification.Confidence.FINALISED))
+        breaks_a_rule |= Q(number_finalised=1)
 
-        return observations_without_confirmation_or_finalisation
+        observations = self.get_all_finalised_and_confirmed_identifications().order_by().values(
+            'observation__specimen_label').annotate(**annotations).filter(breaks_a_rule)
 
-    def get_unconfirmed_unfinalised_adults(self, observations_without_confirmation_or_finalisation):
-        """
-        Using the set of observations that do not have a confirmed or finalised identification, get only the adults.
+        inconsistent_observations = {rule: set() for rule, confidences in CONSISTENCY_RULES}
+        inconsistent_observations['finalised_number'] = set()
 
-        Return a queryset of these adults.
-        """
+        for observation in observations:
+            for rule, confidences in CONSISTENCY_RULES:
+                if observation['distinct_' + rule] > 1:
+                    inconsistent_observations[rule].add(observation['observation__specimen_label'])
 
-        adults_unconfirmed_unfinalised = Observation.objects.filter(
-            specimen_label__in=observations_without_confirmation_or_finalisation).filter(
-            identification__stage=Identification.Stage.ADULT)
+            if observation['number_finalised'] == 1:
+                inconsistent_observations['finalised_number'].add(observation['observation__specimen_label'])
 
-        return adults_unconfirmed_unfinalised
+        return inconsistent_observations
 
     def check_finalised_confirmed_identifications_sex(self):
         """
@@ -170,19 +261,7 @@ class IdentificationDataChecks:
         or finalised identifications differs.
         """
 
-        finalised_and_confirmed_identifications = self.get_all_finalised_and_confirmed_identifications()
-        finalised_and_confirmed_identifications_qs = finalised_and_confirmed_identifications.values_list(
-            'observation__specimen_label', flat=True)
-
-        finalised_confirmed_identifications_different_sex = set()
-
-        for finalised_confirmed_identification in finalised_and_confirmed_identifications_qs:
-            distinct_sexes = finalised_and_confirmed_identifications.filter(
-                observation__specimen_label=finalised_confirmed_identification).values_list('sex').distinct()
-            if len(distinct_sexes) > 1:
-                finalised_confirmed_identifications_different_sex.add(finalised_confirmed_identification)
-
-        return finalised_confirmed_identifications_different_sex
+        return self.check_finalised_confirmed_consistency()['sex']
 
     def check_finalised_confirmed_identifications_stage(self):
         """
@@ -190,53 +269,29 @@ class IdentificationDataChecks:
         confirmed or finalised identifications differs.
         """
 
-        finalised_and_confirmed_identifications = self.get_all_finalised_and_confirmed_identifications()
-        finalised_and_confirmed_identifications_qs = finalised_and_confirmed_identifications.values_list(
-            'observation__specimen_label', flat=True)
-
-        finalised_and_confirmed_identifications_different_stage = set()
-
-        for finalised_confirmed_identification in finalised_and_confirmed_identifications_qs:
-            distinct_stages = finalised_and_confirmed_identifications.filter(
-                observation__specimen_label=finalised_confirmed_identification).values_list('stage').distinct()
-            if len(distinct_stages) > 1:
-                finalised_and_confirmed_identifications_different_stage.add(finalised_confirmed_identification)
-
-        return finalised_and_confirmed_identifications_different_stage
+        return self.check_finalised_confirmed_consistency()['stage']
 
-    def identification_inconsistency(self, identification1, identification2):
+    def check_finalised_identifications_number(self):
         """
-        Compares two identifications according to the different levels of taxonomy and return those that are
-        inconsistent at the same level. Return dictionary of the inconsistent identifcation with the observation
-        specimen label and the field that is inconsistent.
-
-        A non-empty field and null are considered to be inconsistent for the purposes of this function.
+        Returns a set of the observations that have only one finalised identification. Specimens with finalised
+        identifications should have two or more, as they were identified to one of several taxa.
         """
 
-        inconsistent_identification = {}
-
-        for field in ['species', 'genus', 'subfamily', 'family', 'suborder']:
-            if getattr(identification1, field) != getattr(identification2, field):
-                inconsistent_identification['specimen_label'] = identification1.observation.specimen_label
-                inconsistent_identification['field'] = field
-
-                return inconsistent_identification
-
-        return None
+        return self.check_finalised_confirmed_consistency()['finalised_number']
 
     def get_qs_confirmed_identifications(self):
         """
-        Returns a queryset of all confirmed identifications.
+        Returns a queryset of all confirmed identifications (of the observations that are checked).
         """
-        confirmed_identifications = Identification.objects.filter(confidence=Identification.Confidence.CONFIRMED)
+        confirmed_identifications = self.get_identifications().filter(confidence=Identification.Confidence.CONFIRMED)
 
         return confirmed_identifications
 
     def get_qs_finalised_identifications(self):
         """
-        Returns a queryset of all finalised identifications.
+        Returns a queryset of all finalised identifications (of the observations that are checked).
         """
-        finalised_identifications = Identification.objects.filter(confidence=Identification.Confidence.FINALISED)
+        finalised_identifications = self.get_identifications().filter(confidence=Identification.Confidence.FINALISED)
 
         return finalised_identifications
 
@@ -248,37 +303,31 @@ class IdentificationDataChecks:
 
         return finalised_and_confirmed_identifications
 
-    def get_confirmed_identifications_to_check_taxonomy(self, confirmed_identifications):
-        """
-        Returns a list of querysets that are the identifications for which more than one identification exists, for a
-        particular observation. These are the identifications that need to be compared to check if they have a
-        consistent taxonomy.
+    def check_confirmed_identifications_taxonomy(self):
         """
-        multiple_confirmed_identifications_for_observation = confirmed_identifications.values(
-            'observation__specimen_label').annotate(number_ids=Count('observation__specimen_label')).filter(
-            number_ids__gt=1)
+        Returns a list of dictionaries of the specimen labels which have inconsistent confirmed identifications, with the
+        lowest taxonomic level at which they are inconsistent. All of the confirmed identifications of each observation
+        are compared, however many there are.
 
-        identifications_to_check = []
-        for observation in multiple_confirmed_identifications_for_observation:
-            identifications_to_check.append(confirmed_identifications.filter(
-                observation__specimen_label=observation['observation__specimen_label']))
+        A non-empty field and null are considered to be inconsistent for the purposes of this function.
 
-        return identifications_to_check
+        The taxonomy of all confirmed identifications is read with one query.
 
-    def check_confirmed_identifications_taxonomy(self):
-        """
-        Returns a list of dictionaries of the specimen labels which have inconsistent confirmed identifications.
+        e.g.    [{"specimen_label": TOR08 20211005 H1 C001, "field": "species"},
+                {"specimen_label": TAV09 20211006 N1 C008, "field": "genus"}]
         """
-        confirmed_identifications = self.get_qs_confirmed_identifications()
-
-        identifications_to_check = self.get_confirmed_identifications_to_check_taxonomy(confirmed_identifications)
+        confirmed_identifications = self.get_qs_confirmed_identifications().order_by(
+            'observation__specimen_label').values_list('observation__specimen_label',
+                                                       *[field + '_id' for field in TAXONOMY_FIELDS])
 
         inconsistent_identifications = []
-        for qs_of_identifications in identifications_to_check:
-            inconsistent_identification = self.identification_inconsistency(qs_of_identifications[0],
-                                                                            qs_of_identifications[1])
-            if inconsistent_identification != None:
-                inconsistent_identifications.append(inconsistent_identification)
+        for specimen_label, identifications in itertools.groupby(confirmed_identifications, key=lambda row: row[0]):
+            taxonomies = [identification[1:] for identification in identifications]
+
+            for position, field in enumerate(TAXONOMY_FIELDS):
+                if len({taxonomy[position] for taxonomy in taxonomies}) > 1:
+                    inconsistent_identifications.append({'specimen_label': specimen_label, 'field': field})
+                    break
 
         return inconsistent_identifications
 
@@ -300,59 +349,166 @@ class IdentificationDataChecks:
 
 
 class SurveyDataChecks:
-    def __init__(self):
-        pass
-
-    def find_surveys_without_met_conditions(self):
+    def __init__(self, surveys=None):
         """
-        Returns a set of surveys for which there is no meteorological data.
+        surveys is a queryset of the surveys to check (e.g. those that have changed since the last check). All of the
+        surveys are checked if it is None.
         """
 
-        surveys = Survey.objects.all().values_list('visit__site__site_name', 'visit__date', 'method', 'repeat')
-        met_conditions = MeteorologyConditions.objects.all().values_list('survey__visit__site__site_name',
-                                                                         'survey__visit__date', 'survey__method',
-                                                                         'survey__repeat')
+        self.surveys = surveys
 
-        surveys_set = set()
-
-        for survey in surveys:
-            survey: Survey
+    def get_surveys(self):
+        """
+        Returns a queryset of the surveys that are checked.
+        """
 
-            surveys_set.add(survey)
+        if self.surveys is None:
+            return Survey.objects.all()
 
-        met_conditions_surveys_set = set()
+        return Survey.objects.filter(pk__in=self.surveys.values('pk'))
 
-        for surveyed_met_conditions in met_conditions:
-            surveyed_met_conditions: MeteorologyConditions
+    def find_surveys_without_met_conditions(self):
+        """
+        Returns a queryset of the surveys for which there is no meteorological data, as tuples of the site name, date,
+        method and repeat of the survey.
 
-            met_conditions_surveys_set.add(surveyed_met_conditions)
+        Only these surveys are read from the database (using NOT EXISTS), so the queryset can be iterated with
+        iterator() to stream them.
+        """
 
-        # get all of the surveys that do not have meteorological condition data
-        surveys_without_met_conditions = surveys_set - met_conditions_surveys_set
+        met_conditions = MeteorologyConditions.objects.filter(survey=OuterRef('pk'))
 
-        return surveys_without_met_conditions
+        return self.get_surveys().filter(~Exists(met_conditions)).order_by('visit__site__site_name', 'visit__date',
+                                                                       'method', 'repeat').values_list(
+            'visit__site__site_name', 'visit__date', 'method', 'repeat')
 
 
 class ObservationDataChecks:
-    def __init__(self):
-        pass
-
-    def find_observations_without_suborder(self):
+    def __init__(self, observations=None):
         """
-        Get all observations that do not yet have a suborder. Return a set.
+        observations is a queryset of the observations to check (e.g. those that have changed since the last check).
+        All of the observations are checked if it is None.
         """
-        all_identifications_with_suborder = Identification.objects.filter(suborder__isnull=False).values(
-            'observation__specimen_label')
-        all_observations = Observation.objects.all().values('specimen_label')
 
-        all_identifications_with_suborder_set = set()
-        for identification in all_identifications_with_suborder:
-            all_identifications_with_suborder_set.add(identification['observation__specimen_label'])
+        self.observations = observations
 
-        all_observations_set = set()
-        for observation in all_observations:
-            all_observations_set.add(observation['specimen_label'])
+    def get_observations(self):
+        """
+        Returns a queryset of the observations that are checked.
+        """
+
+        if self.observations is None:
+            return Observation.objects.all()
 
-        observations_without_suborder = all_observations_set - all_identifications_with_suborder_set
+        return Observation.objects.filter(pk__in=self.observations.values('pk'))
 
-        return observations_without_suborder
+    def find_observations_without_suborder(self):
+        """
+        Get all observations that do not yet have a suborder. Return a queryset of their specimen labels, ordered by
+        specimen label.
+
+        Only these observations are read from the database (using NOT EXISTS), so the queryset can be iterated with
+        iterator() to stream them.
+        """
+
+        identifications_with_suborder = Identification.objects.filter(observation=OuterRef('pk'),
+                                                                      suborder__isnull=False)
+
+        return self.get_observations().filter(~Exists(identifications_with_suborder)).order_by(
+            'specimen_label').values_list('specimen_label', flat=True)
+
+
+# Severity of the results of a data check: errors are data that is inconsistent and must be corrected, warnings are
+# data that is missing or should be reviewed.
+ERROR = 'error'
+WARNING = 'warning'
+
+# Scope of a data check: the data that it checks, which is also the name of the data_checks_<scope> command that runs it
+IDENTIFICATIONS = 'identifications'
+OBSERVATIONS = 'observations'
+SURVEYS = 'surveys'
+
+
+class DataCheck:
+    """A data check of the registry (see DATA_CHECKS).
+
+    evaluate is a function that gets the DataCheckRun (see data_check_runner) and returns the results of the check, as
+    a list or as a queryset. Data that is used by several checks is read with run.shared(), so that it is only read
+    once in each run. format_result returns the text that is printed for each result.
+
+    subject_key returns what a result is about, which is used to keep the violations of the incremental data checks:
+    the specimen label of the observation, or the site name, date, method and repeat of the survey for the checks of
+    surveys. By default, it is the result itself.
+    """
+
+    def __init__(self, name, title, severity, scope, evaluate, format_result=str, subject_key=None):
+        self.name = name
+        self.title = title
+        self.severity = severity
+        self.scope = scope
+        self.evaluate = evaluate
+        self.format_result = format_result
+        self.subject_key = subject_key or (lambda result: result)
+
+
+def identifications_missing_values(run):
+    return run.shared('identifications_missing_values',
+                      run.identification_checks.get_identifications_missing_values)
+
+
+def finalised_confirmed_consistency(run):
+    return run.shared('finalised_confirmed_consistency',
+                      run.identification_checks.check_finalised_confirmed_consistency)
+
+
+def observations_without_confirmed_or_finalised_identification(run):
+    return run.shared('observations_without_confirmed_or_finalised_identification',
+                      run.identification_checks.find_observations_without_confirmed_or_finalised_identification)
+
+
+def specimen_label(result):
+    return result['specimen_label']
+
+
+# All of the data checks, in the order that they are printed
+DATA_CHECKS = [
+    DataCheck('identifications_without_sex_adults', 'Identifications without a sex (adults only)', WARNING,
+              IDENTIFICATIONS, lambda run: run.identification_checks.check_identification_has_sex_adults_only(
+                  identifications_missing_values(run)), specimen_label, specimen_label),
+    DataCheck('identifications_without_sex', 'Identifications without a sex (all stages)', WARNING, IDENTIFICATIONS,
+              lambda run: run.identification_checks.check_identification_has_sex(identifications_missing_values(run)),
+              specimen_label, specimen_label),
+    DataCheck('identifications_without_stage', 'Identifications without a stage', WARNING, IDENTIFICATIONS,
+              lambda run: run.identification_checks.check_identification_has_stage(
+                  identifications_missing_values(run)), specimen_label, specimen_label),
+    DataCheck('identifications_without_confidence', 'Identifications without a confidence', WARNING, IDENTIFICATIONS,
+              lambda run: run.identification_checks.check_identification_has_confidence(
+                  run.practice_sites, identifications_missing_values(run)), specimen_label, specimen_label),
+    DataCheck('observations_without_identification', 'Observations without an identification', WARNING,
+              IDENTIFICATIONS, lambda run: run.identification_checks.find_observations_without_identification()),
+    DataCheck('observations_without_confirmed_or_finalised_identification',
+              'Observations without a confirmed or finalised identification', WARNING, IDENTIFICATIONS,
+              observations_without_confirmed_or_finalised_identification),
+    DataCheck('adults_without_confirmed_or_finalised_identification',
+              'Observations without a confirmed or finalised identification (adults only)', WARNING, IDENTIFICATIONS,
+              lambda run: run.identification_checks.get_unconfirmed_unfinalised_adults(
+                  observations_without_confirmed_or_finalised_identification(run)),
+              subject_key=lambda observation: observation.specimen_label),
+    DataCheck('finalised_confirmed_different_sex', 'Finalised/confirmed identifications with different sexes', ERROR,
+              IDENTIFICATIONS, lambda run: finalised_confirmed_consistency(run)['sex']),
+    DataCheck('finalised_confirmed_different_stage', 'Finalised/confirmed identifications with different stages',
+              ERROR, IDENTIFICATIONS, lambda run: finalised_confirmed_consistency(run)['stage']),
+    DataCheck('observations_with_one_finalised_identification', 'Observations with only one finalised identification',
+              WARNING, IDENTIFICATIONS, lambda run: finalised_confirmed_consistency(run)['finalised_number']),
+    DataCheck('confirmed_different_taxonomy', 'Confirmed identifications with different taxonomy', ERROR,
+              IDENTIFICATIONS, lambda run: run.identification_checks.check_confirmed_identifications_taxonomy(),
+              subject_key=specimen_label),
+    DataCheck('observations_with_confirmed_and_finalised_identifications',
+              'Observations with confirmed and finalised identifications', ERROR, IDENTIFICATIONS,
+              lambda run: run.identification_checks.observations_with_confirmed_and_finalised_identifications(),
+              subject_key=lambda result: result[0]),
+    DataCheck('observations_without_suborder', 'Observations without a suborder', WARNING, OBSERVATIONS,
+              lambda run: run.observation_checks.find_observations_without_suborder()),
+    DataCheck('surveys_without_met_conditions', 'Surveys without met data', WARNING, SURVEYS,
+              lambda run: run.survey_checks.find_surveys_without_met_conditions()),
+]
@@ -0,0 +1,305 @@
+import csv
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ExportWatermark
+
+# Number of rows read from the database at a time
+CHUNK_SIZE = 2000
+
+# Column of the delta exports with the operation of each row: the rows of a key are replaced by the upserted rows of
+# the key, or deleted by its tombstone (which only has the values of the key)
+OPERATION = 'operation'
+UPSERT = 'upsert'
+TOMBSTONE = 'delete'
+
+
+class ExportColumn:
+    """A column of an export: its header, the field path of its value (as in values(), e.g.
+    'observation__survey__visit__date') and an optional function that transforms the value before it is written."""
+
+    def __init__(self, header, path, transform=None):
+        self.header = header
+        self.path = path
+        self.transform = transform
+
+
+class ExportSpec:
+    """Declaration of an export: the columns, in order, as a dictionary of the header of each column and its field path,
+    or a tuple of the field path and a transform (see ExportColumn).
+
+    The rows of an export are read with one values() query for each queryset, which joins all of the models of the
+    field paths (related objects that do not exist give None, e.g. surveys without meteorological conditions), so the
+    number of queries does not depend on the number of rows.
+
+    e.g.    ExportSpec({'site_name': 'visit__site__site_name',
+                        'date_cest': 'visit__date',
+                        'wind_start': ('meteorologyconditions__wind_start', str)})
+    """
+
+    def __init__(self, columns):
+        self.columns = []
+
+        for header, column in columns.items():
+            if isinstance(column, tuple):
+                self.columns.append(ExportColumn(header, *column))
+            else:
+                self.columns.append(ExportColumn(header, column))
+
+    @property
+    def headers(self):
+        return [column.header for column in self.columns]
+
+    @property
+    def paths(self):
+        """Return dictionary of the header and the field path of each column."""
+
+        return {column.header: column.path for column in self.columns}
+
+    def rows(self, querysets, chunk_size=CHUNK_SIZE):
+        """Return a generator of the rows (dictionaries of the value of each header) of the querysets, one queryset
+        after the other. The rows are read from the database in chunks of chunk_size."""
+
+        paths = list(dict.fromkeys(column.path for column in self.columns))
+        positions = [paths.index(column.path) for column in self.columns]
+
+        for queryset in querysets:
+            for values in queryset.values_list(*paths).iterator(chunk_size=chunk_size):
+                row = {}
+
+                for column, position in zip(self.columns, positions):
+                    value = values[position]
+
+                    if column.transform is not None:
+                        value = column.transform(value)
+
+                    row[column.header] = value
+
+                yield row
+
+
+def write_rows(csv_writer, spec, querysets):
+    """Write the rows of the querysets of an export to a csv.DictWriter (None is written as an empty field). Return the
+    number of rows."""
+
+    number_rows = 0
+
+    for row in spec.rows(querysets):
+        csv_writer.writerow(row)
+        number_rows += 1
+
+    return number_rows
+
+
+def write_csv(output_file, spec, querysets):
+    """Write the header and the rows of the querysets of an export to a CSV file. Return the number of rows."""
+
+    csv_writer = csv.DictWriter(output_file, spec.headers)
+    csv_writer.writeheader()
+
+    return write_rows(csv_writer, spec, querysets)
+
+
+def key_value(value):
+    """Return a value of a key as it is written in, and read from, a CSV file."""
+
+    return '' if value is None else str(value)
+
+
+class ExportDelta:
+    """Declaration of the delta export of an export spec: the rows that have changed since a time, and tombstones for
+    the rows that are no longer exported.
+
+    The rows of the export are grouped by key (the values of the key headers). The rows of a key belong to one subject:
+    the object at subject_path from the exported objects (e.g. 'observation' for identifications), or the exported
+    object itself. A subject has changed if its updated_on, or that of one of the objects at tracked_paths from it
+    (e.g. 'survey__visit__site'), is after the time. All of the current rows of the changed subjects are exported,
+    so that they replace the rows of their keys in the previous export.
+    """
+
+    def __init__(self, spec, key, subject_path=None, tracked_paths=()):
+        self.spec = spec
+        self.key = key
+        self.subject_path = subject_path
+        self.tracked_paths = tracked_paths
+
+    def get_key(self, row):
+        return tuple(key_value(row[header]) for header in self.key)
+
+    def get_keys(self, querysets):
+        """Return set of the keys of the rows of the querysets, which are read without the other columns."""
+
+        key_spec = ExportSpec({column.header: (column.path, column.transform) for column in self.spec.columns
+                               if column.header in self.key})
+
+        return {self.get_key(row) for row in key_spec.rows(querysets)}
+
+    def get_changed_subjects(self, model, since):
+        """Return queryset of the subjects of the exported model that have changed after since."""
+
+        if self.subject_path is not None:
+            for name in self.subject_path.split('__'):
+                model = model._meta.get_field(name).related_model
+
+        changed = Q(updated_on__gt=since)
+        for path in self.tracked_paths:
+            changed |= Q(**{path + '__updated_on__gt': since})
+
+        return model.objects.filter(changed)
+
+    def get_changed_keys(self, changed_subjects):
+        """Return set of the keys of the changed subjects, whether they are exported or not."""
+
+        prefix = '' if self.subject_path is None else self.subject_path + '__'
+        paths = [self.spec.paths[header][len(prefix):] for header in self.key]
+
+        return {tuple(key_value(value) for value in values) for values in changed_subjects.values_list(*paths)}
+
+
+def write_delta_csv(output_file, delta, querysets, since, previous_keys=None):
+    """
+    Write the rows of the querysets of an export that have changed after since to a CSV file, with the operation of
+    each row (see OPERATION) in the first column, followed by the tombstones of the keys that are no longer exported:
+    those of previous_keys (the keys of the last export), or else those of the changed subjects.
+
+    Return the number of rows, the number of tombstones and the set of the keys of all of the rows of the querysets.
+    """
+
+    keys = delta.get_keys(querysets)
+    changed_subjects = delta.get_changed_subjects(querysets[0].model, since)
+    subject_filter = {('pk' if delta.subject_path is None else delta.subject_path) + '__in': changed_subjects}
+
+    csv_writer = csv.DictWriter(output_file, [OPERATION] + delta.spec.headers)
+    csv_writer.writeheader()
+
+    number_rows = 0
+
+    for row in delta.spec.rows([queryset.filter(**subject_filter) for queryset in querysets]):
+        csv_writer.writerow({OPERATION: UPSERT, **row})
+        number_rows += 1
+
+    if previous_keys is None:
+        previous_keys = delta.get_changed_keys(changed_subjects)
+
+    tombstones = sorted(set(previous_keys) - keys)
+
+    for key in tombstones:
+        csv_writer.writerow({OPERATION: TOMBSTONE, **dict(zip(delta.key, key))})
+
+    return number_rows, len(tombstones), keys
+
+
+def parse_since(value):
+    """Return the aware datetime of a --since argument (ISO 8601, in the current time zone if it does not have one)."""
+
+    since = parse_datetime(value) or parse_datetime(value + 'T00:00')
+
+    if since is None:
+        raise ValueError(f'Invalid time: {value}')
+
+    return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+
+def add_delta_arguments(parser):
+    """Add the arguments of the delta exports to the parser of an export command."""
+
+    parser.add_argument('--since', type=parse_since,
+                        help='Only export the rows that have changed after this time (e.g. 2022-09-01T12:00), and '
+                             'tombstones for the changed rows that are no longer exported')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only export the rows that have changed since the last export with --watermark or '
+                             '--delta, and tombstones for the rows that are no longer exported')
+    parser.add_argument('--watermark', action='store_true',
+                        help='Record the time and the rows of this export, for the next export with --delta')
+
+
+def export_csv_or_delta(output_file, dataset, delta, querysets, practice_sites, options, export_full, stats_file):
+    """
+    Export a dataset with the options of add_delta_arguments: the delta since the time of --since or the watermark of
+    the dataset with --delta (see write_delta_csv), or else all of the rows with export_full(). The watermark is
+    updated with --delta and --watermark. The number of rows and of tombstones of a delta are written to stats_file.
+
+    The rows are read in one transaction, and the watermark is the time of its start, so the rows that change while
+    they are exported are exported again by the next delta.
+    """
+
+    practice_sites = sorted(practice_sites or [])
+
+    with transaction.atomic():
+        exported_until = timezone.now()
+        since = options['since']
+        previous_keys = None
+
+        if options['delta']:
+            watermark = ExportWatermark.objects.filter(dataset=dataset).first()
+
+            if watermark is None:
+                raise CommandError(f'There is no watermark of {dataset}: export all of the rows with --watermark first')
+            if watermark.practice_sites != practice_sites:
+                raise CommandError(f'The watermark of {dataset} excludes the practice sites '
+                                   f'{", ".join(watermark.practice_sites) or "(none)"}: export all of the rows with '
+                                   f'--watermark to change them')
+
+            since = watermark.exported_until
+            previous_keys = [tuple(key) for key in watermark.keys]
+
+        if since is None:
+            export_full()
+            keys = delta.get_keys(querysets) if options['watermark'] else None
+        else:
+            number_rows, number_tombstones, keys = write_delta_csv(output_file, delta, querysets, since, previous_keys)
+            stats_file.write(f'Exported the delta of {dataset} since {since.isoformat()}: {number_rows} rows and '
+                             f'{number_tombstones} tombstones\n')
+
+        if options['delta'] or options['watermark']:
+            ExportWatermark.objects.update_or_create(dataset=dataset, defaults={'practice_sites': practice_sites,
+                                                                                'exported_until': exported_until,
+                                                                                'keys': sorted(keys)})
+
+
+def merge_delta_csv(output_file, key, base_file, delta_files):
+    """
+    Write a CSV file with the rows of a base export (a CSV file of all of the rows) after applying the delta exports
+    (see write_delta_csv), in order: the rows of each key of a delta replace those of the key, or are deleted by its
+    tombstone. The rows of the keys that are replaced keep their place, and those of new keys are added at the end.
+
+    Return the number of rows.
+    """
+
+    base_reader = csv.DictReader(base_file)
+    headers = base_reader.fieldnames
+
+    rows = {}
+    for row in base_reader:
+        rows.setdefault(tuple(row[header] for header in key), []).append(row)
+
+    for delta_file in delta_files:
+        delta_rows = {}
+        tombstones = set()
+
+        for row in csv.DictReader(delta_file):
+            row_key = tuple(row[header] for header in key)
+
+            if row.pop(OPERATION) == TOMBSTONE:
+                tombstones.add(row_key)
+            else:
+                delta_rows.setdefault(row_key, []).append(row)
+
+        for row_key in tombstones:
+            rows.pop(row_key, None)
+
+        rows.update(delta_rows)
+
+    csv_writer = csv.DictWriter(output_file, headers)
+    csv_writer.writeheader()
+
+    number_rows = 0
+    for key_rows in rows.values():
+        csv_writer.writerows(key_rows)
+        number_rows += len(key_rows)
+
+    return number_rows
@@ -0,0 +1,348 @@
+import csv
+import hashlib
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.db import connections, transaction
+
+from .models import ImportCheckpoint, ImportedRow
+from .utils import IN_QUERY_CHUNK_SIZE, get_file_checksum
+
+# Number of rows of each task of the process pool of the validation stage
+CHUNK_SIZE = 2000
+
+
+class RowError:
+    """An error of a row of an import file: its line number (None for errors of the whole file), the column (or field)
+    with the error and the message."""
+
+    def __init__(self, line_number, column, message):
+        self.line_number = line_number
+        self.column = column
+        self.message = message
+
+    def __str__(self):
+        if self.line_number is None:
+            return f"{self.column}: {self.message}"
+
+        return f"Line {self.line_number}: {self.column}: {self.message}"
+
+
+def read_rows(filename):
+    """Parse stage: return list of (line number, row) of the rows of a CSV file, where each row is a dictionary of the
+    value of each column. Line 1 is the header."""
+
+    with open(filename) as csvfile:
+        return list(enumerate(csv.DictReader(csvfile), start=2))
+
+
+def clean_field(errors, model, field_name, value, column=None):
+    """Return the value of a field of a model converted and validated by the field (with its validators, as
+    Model.full_clean() does). If the value is not valid, add (column, message) to the list of errors and return None."""
+
+    try:
+        return model._meta.get_field(field_name).clean(value, None)
+    except ValidationError as error:
+        errors.extend((column or field_name, message) for message in error.messages)
+
+        return None
+
+
+def validate_chunk(validate_row, rows):
+    """Return list of the RowError of the rows, which are validated with validate_row (see run_import)."""
+
+    return [RowError(line_number, column, message)
+            for line_number, row in rows for column, message in validate_row(row)]
+
+
+def validate_rows(rows, validate_row, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Validation stage: return list of the RowError of the rows, in order. validate_row(row) returns a list of (column,
+    message) of the errors of a row, without reading the database.
+
+    With more than one worker, the chunks of chunk_size rows are validated in a pool of processes, which do not use the
+    database connections of this process (they are closed before the pool is started). validate_row has to be a
+    function of a module, so that it can be sent to the processes.
+    """
+
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        results = [validate_chunk(validate_row, chunk) for chunk in chunks]
+    else:
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+            results = list(executor.map(validate_chunk, itertools.repeat(validate_row), chunks))
+
+    return [error for chunk_errors in results for error in chunk_errors]
+
+
+def write_error_report(path, errors):
+    """Write the errors to a CSV file with the line, column and message of each of them."""
+
+    with open(path, 'w', newline='') as report_file:
+        csv_writer = csv.writer(report_file)
+        csv_writer.writerow(['line', 'column', 'message'])
+
+        for error in errors:
+            csv_writer.writerow([error.line_number, error.column, error.message])
+
+
+def raise_errors(filename, errors, error_report):
+    """Raise CommandError with the errors of an import (or the number of errors, if they are written to the
+    error_report file)."""
+
+    if error_report:
+        write_error_report(error_report, errors)
+
+        raise CommandError(f"{len(errors)} errors in {filename}, nothing has been imported: see {error_report}")
+
+    raise CommandError(f"{len(errors)} errors in {filename}, nothing has been imported:\n" +
+                       "\n".join(str(error) for error in errors))
+
+
+def add_import_arguments(parser):
+    """Add the arguments of the import pipeline (see run_import) to the parser of an import command."""
+
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes that validate the rows (for large files)')
+    parser.add_argument('--error_report', type=str,
+                        help='Path of a CSV file to write the errors to, instead of printing them')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Skip the file if it has already been imported, and the rows that have not changed since '
+                             'they were imported; the changed rows update the data that already exists')
+
+
+def get_row_hash(row):
+    """Return the SHA-256 checksum of the values of a row, as a hexadecimal string."""
+
+    return hashlib.sha256(json.dumps(row, sort_keys=True).encode()).hexdigest()
+
+
+def get_changed_rows(command, rows, get_row_key):
+    """Return the rows that have not been imported by the command with the same values (see ImportedRow), and
+    dictionary of the checksum of each of them by its key (get_row_key(row), the natural key of the row)."""
+
+    row_hashes = {get_row_key(row): get_row_hash(row) for line_number, row in rows}
+
+    keys = list(row_hashes)
+    imported_row_hashes = {}
+    for i in range(0, len(keys), IN_QUERY_CHUNK_SIZE):
+        imported_row_hashes.update(ImportedRow.objects.filter(
+            command=command, key__in=keys[i:i + IN_QUERY_CHUNK_SIZE]).values_list('key', 'row_hash'))
+
+    changed_rows = [(line_number, row) for line_number, row in rows
+                    if imported_row_hashes.get(get_row_key(row)) != row_hashes[get_row_key(row)]]
+    changed_row_hashes = {key: row_hash for key, row_hash in row_hashes.items()
+                          if imported_row_hashes.get(key) != row_hash}
+
+    return changed_rows, changed_row_hashes
+
+
+def get_imported_identification_ids(command, keys):
+    """Return dictionary of the id of the identification that has been written from each row of the keys by the
+    command (see ImportedRow), for the rows that have one."""
+
+    keys = list(keys)
+    identification_ids = {}
+
+    for i in range(0, len(keys), IN_QUERY_CHUNK_SIZE):
+        identification_ids.update(ImportedRow.objects.filter(
+            command=command, key__in=keys[i:i + IN_QUERY_CHUNK_SIZE], identification__isnull=False).values_list(
+            'key', 'identification_id'))
+
+    return identification_ids
+
+
+def save_imported_rows(command, row_hashes, identification_ids=None):
+    """Save the checksum of each row that has been imported by the command, by the key of the row, and the id of the
+    identification that has been written from it (identification_ids is a dictionary of them by key, or None)."""
+
+    identification_ids = identification_ids or {}
+
+    keys = list(row_hashes)
+    for i in range(0, len(keys), IN_QUERY_CHUNK_SIZE):
+        ImportedRow.objects.filter(command=command, key__in=keys[i:i + IN_QUERY_CHUNK_SIZE]).delete()
+
+    ImportedRow.objects.bulk_create([ImportedRow(command=command, key=key, row_hash=row_hash,
+                                                 identification_id=identification_ids.get(key))
+                                     for key, row_hash in row_hashes.items()], batch_size=IN_QUERY_CHUNK_SIZE)
+
+
+def upsert(model, objects, key_fields, update_fields):
+    """
+    Create the objects whose natural key (the values of the fields key_fields, e.g. ['visit', 'method', 'repeat']) is
+    not in the database, and update the fields update_fields of the others that have a different value for any of
+    them, with bulk queries. The objects that are the same as in the database are not changed.
+
+    Return dictionary of the id of the object of each key (tuples of the values of key_fields, with the ids of the
+    relations), and the number of objects that have been created and updated.
+    """
+
+    key_attnames = [model._meta.get_field(field_name).attname for field_name in key_fields]
+    fields = [model._meta.get_field(field_name) for field_name in update_fields]
+
+    def get_key(values):
+        return tuple(values[attname] for attname in key_attnames)
+
+    def load_ids_and_values(keys):
+        # the rows are filtered by the first field of the key and the other fields are compared here
+        first_values = list({key[0] for key in keys})
+        existing = {}
+
+        for i in range(0, len(first_values), IN_QUERY_CHUNK_SIZE):
+            for values in model.objects.filter(**{f'{key_attnames[0]}__in': first_values[i:i + IN_QUERY_CHUNK_SIZE]}) \
+                    .values('id', *key_attnames, *[field.attname for field in fields]):
+                if get_key(values) in keys:
+                    existing[get_key(values)] = values
+
+        return existing
+
+    objects_by_key = {get_key(vars(obj)): obj for obj in objects}
+    existing = load_ids_and_values(objects_by_key.keys())
+
+    created = [obj for key, obj in objects_by_key.items() if key not in existing]
+    updated = []
+
+    for key, obj in objects_by_key.items():
+        if key in existing and any(field.to_python(getattr(obj, field.attname)) !=
+                                   field.to_python(existing[key][field.attname]) for field in fields):
+            obj.id = existing[key]['id']
+            updated.append(obj)
+
+    model.objects.bulk_create(created, batch_size=IN_QUERY_CHUNK_SIZE)
+
+    if updated:
+        model.objects.bulk_update(updated, update_fields, batch_size=IN_QUERY_CHUNK_SIZE)
+
+    ids = {key: values['id'] for key, values in existing.items()}
+
+    if created:  # bulk_create does not set the ids of the objects in SQLite
+        ids.update((key, values['id']) for key, values in load_ids_and_values(
+            {get_key(vars(obj)) for obj in created}).items())
+
+    return ids, len(created), len(updated)
+
+
+def prepare_valid_rows(filename, rows, errors, prepare, options):
+    """Return the objects that prepare returns for the rows without errors of the validation stage. Raise CommandError
+    with all of the errors if there are errors in any of the stages (see run_import)."""
+
+    lines_with_errors = {error.line_number for error in errors}
+
+    objects, prepare_errors = prepare([(line_number, row) for line_number, row in rows
+                                       if line_number not in lines_with_errors])
+    errors = errors + prepare_errors
+
+    if errors:
+        errors.sort(key=lambda error: (error.line_number is not None, error.line_number or 0))
+        raise_errors(filename, errors, options['error_report'])
+
+    return objects
+
+
+def run_import(filename, options, validate_row, prepare, write, command=None, get_row_key=None):
+    """
+    Import a CSV file in stages, with the options of add_import_arguments:
+
+    1. parse: read all of the rows of the file (see read_rows)
+    2. validate: check each row on its own, e.g. formats, choices and ranges of values (see validate_rows)
+    3. prepare: prepare(rows) is called with the valid rows and returns the objects to write (in any form that write
+       uses) and a list of RowError of the checks that need the database or several rows, e.g. unknown sites or
+       duplicates
+    4. write: write(objects) writes the objects, e.g. with bulk_create, only if there are no errors in any stage. It
+       can return a dictionary of the id of the identification written from each row by its key, which is saved with
+       the row with --incremental (see save_imported_rows)
+
+    Stages 3 and 4 are one transaction. If there are errors, nothing is written and CommandError is raised with all of
+    them (see raise_errors). Return the objects.
+
+    With options['incremental'], the file is skipped (and None is returned) if it has already been imported by the
+    command. Otherwise, if get_row_key is given, the rows that have not changed since they were imported by the command
+    are skipped (see get_changed_rows): prepare and write have to update the data of the rows that already exist (see
+    upsert). The file and the rows are saved in the transaction of the write stage (unless options['dry_run'] is set, for
+    the commands that can be run without writing).
+    """
+
+    incremental = options['incremental']
+
+    if incremental:
+        file_hash = get_file_checksum(filename)
+
+        if ImportCheckpoint.objects.filter(command=command, file_hash=file_hash, finished=True).exists():
+            print(f"{filename} has not changed since it was imported")
+            return None
+
+    rows = read_rows(filename)
+    last_line = rows[-1][0] if rows else 1
+
+    if incremental and get_row_key is not None:
+        rows, row_hashes = get_changed_rows(command, rows, get_row_key)
+        print(f"{last_line - 1 - len(rows)} rows have not changed since they were imported")
+
+    errors = validate_rows(rows, validate_row, options['workers'])
+
+    with transaction.atomic():
+        objects = prepare_valid_rows(filename, rows, errors, prepare, options)
+
+        identification_ids = write(objects)
+
+        if incremental and not options.get('dry_run'):
+            if get_row_key is not None:
+                save_imported_rows(command, row_hashes, identification_ids)
+
+            ImportCheckpoint.objects.update_or_create(command=command, file_hash=file_hash,
+                                                      defaults={'filename': filename, 'last_line': last_line,
+                                                                'finished': True})
+
+    return objects
+
+
+def run_chunked_import(command, filename, options, validate_row, prepare, write, chunk_size):
+    """
+    Import a CSV file as run_import, but write the objects in chunks of chunk_size rows, each of them in its own
+    transaction, so that the database is only locked while a chunk is written (e.g. the admin can be used between the
+    chunks). prepare has to return one object for each row, in the order of the rows.
+
+    The last line of each chunk is saved in the ImportCheckpoint of the command and the file in the transaction of the
+    chunk. If the import stops (e.g. it is interrupted), it is continued after the last line that has been committed
+    when it is run again with the same file and options['resume']. Return the objects that have been written.
+    """
+
+    file_hash = get_file_checksum(filename)
+    checkpoint = ImportCheckpoint.objects.filter(command=command, file_hash=file_hash).first()
+
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(command=command, file_hash=file_hash, filename=filename)
+    elif checkpoint.finished:
+        raise CommandError(f"{filename} has already been imported (on {checkpoint.updated_on:%Y-%m-%d %H:%M})")
+    elif not options['resume']:
+        raise CommandError(f"{filename} has been imported up to line {checkpoint.last_line}: use --resume to continue "
+                           f"the import")
+    else:
+        print(f"Resuming after line {checkpoint.last_line}")
+
+    rows = [(line_number, row) for line_number, row in read_rows(filename) if line_number > checkpoint.last_line]
+    errors = validate_rows(rows, validate_row, options['workers'])
+
+    objects = prepare_valid_rows(filename, rows, errors, prepare, options)
+
+    for start in range(0, max(len(rows), 1), chunk_size):
+        chunk_rows = rows[start:start + chunk_size]
+
+        with transaction.atomic():
+            write(objects[start:start + chunk_size])
+
+            if chunk_rows:
+                checkpoint.last_line = chunk_rows[-1][0]
+            checkpoint.finished = start + chunk_size >= len(rows)
+            checkpoint.save()
+
+        print(f"Committed up to line {checkpoint.last_line}")
+
+    return objects
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...data_check_runner import add_data_check_arguments, run_data_checks
+from ...data_integrity_checks import IDENTIFICATIONS, OBSERVATIONS, SURVEYS
+
+
+class Command(BaseCommand):
+    help = 'Run all of the data checks of identifications, observations and surveys.'
+
+    def add_arguments(self, parser):
+        add_data_check_arguments(parser)
+
+    def handle(self, *args, **options):
+        run_data_checks([IDENTIFICATIONS, OBSERVATIONS, SURVEYS], options)
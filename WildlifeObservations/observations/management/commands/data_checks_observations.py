@@ -1,18 +1,14 @@
 from django.core.management.base import BaseCommand
 
-from ...data_integrity_checks import ObservationDataChecks
+from ...data_check_runner import add_data_check_arguments, run_data_checks
+from ...data_integrity_checks import OBSERVATIONS
 
 
 class Command(BaseCommand):
     help = 'Check observation data.'
 
     def add_arguments(self, parser):
-        pass
+        add_data_check_arguments(parser)
 
     def handle(self, *args, **options):
-        observation_checks = ObservationDataChecks()
-
-        print("***** Observations without a suborder *****")
-#        print(len(observation_checks.find_observations_without_suborder()), "results:\n")
-        for observation in observation_checks.find_observations_without_suborder():
-            print(observation)
+        run_data_checks([OBSERVATIONS], options)
@@ -1,18 +1,14 @@
 from django.core.management.base import BaseCommand
 
-from ...data_integrity_checks import SurveyDataChecks
+from ...data_check_runner import add_data_check_arguments, run_data_checks
+from ...data_integrity_checks import SURVEYS
 
 
 class Command(BaseCommand):
     help = 'Check survey data.'
 
     def add_arguments(self, parser):
-        pass
+        add_data_check_arguments(parser)
 
     def handle(self, *args, **options):
-        survey_checks = SurveyDataChecks()
-
-        print("***** Surveys without met data *****")
-        print(len(survey_checks.find_surveys_without_met_conditions()), "results:\n")
-        for surveys_without_met_conditions in survey_checks.find_surveys_without_met_conditions():
-            print(surveys_without_met_conditions)
+        run_data_checks([SURVEYS], options)
@@ -0,0 +1,133 @@
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from ...columnar_export import ARROW, PARQUET, export_columnar
+from ...exports import write_csv
+from ...utils import get_file_checksum
+from .export_columnar import get_dataset
+
+CSV = 'csv'
+
+# Datasets of the bundle, with the same data as the export_*_csv commands
+DATASETS = ['observations', 'surveys', 'sites', 'vegetation_surveys']
+
+
+def export_dataset(dataset, output_directory, practice_sites, file_format):
+    """
+    Export a dataset to the file <dataset>.<format> of the output directory.
+
+    Return a dictionary of the file name, number of rows, size, checksum and time of the export, for the manifest.
+    """
+
+    start = time.perf_counter()
+
+    querysets, spec = get_dataset(dataset, practice_sites)
+    file_name = dataset + '.' + file_format
+    path = os.path.join(output_directory, file_name)
+
+    if file_format == CSV:
+        with open(path, 'w') as output_file:
+            number_rows = write_csv(output_file, spec, querysets)
+    else:
+        number_rows = export_columnar(path, querysets, spec.paths, file_format)
+
+    return {'file': file_name,
+            'rows': number_rows,
+            'bytes': os.path.getsize(path),
+            'sha256': get_file_checksum(path),
+            'seconds': round(time.perf_counter() - start, 3)}
+
+
+def export_dataset_in_thread(*args):
+    """Export a dataset (see export_dataset) in a thread of the pool. Django opens a database connection for each
+    thread, which is closed when the export has finished."""
+
+    try:
+        return export_dataset(*args)
+    finally:
+        connections.close_all()
+
+
+def export_bundle(output_directory, practice_sites, file_format, workers=None):
+    """
+    Export all of the datasets to files of the output directory, at the same time (each in a thread with its own
+    database connection), so that the time of the bundle is close to that of the slowest export. With one worker, the
+    datasets are exported one after the other.
+
+    Return the manifest of the bundle: a dictionary with the practice sites, the format and the entry of each file (see
+    export_dataset), in the order of DATASETS. It is also written to manifest.json in the output directory.
+    """
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    if workers is None:
+        workers = len(DATASETS)
+
+    arguments = [(dataset, output_directory, practice_sites, file_format) for dataset in DATASETS]
+
+    if workers <= 1:
+        files = [export_dataset(*dataset_arguments) for dataset_arguments in arguments]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            files = list(executor.map(lambda dataset_arguments: export_dataset_in_thread(*dataset_arguments),
+                                      arguments))
+
+    manifest = {'created_on': timezone.now().isoformat(),
+                'practice_sites': practice_sites,
+                'format': file_format,
+                'files': files}
+
+    with open(os.path.join(output_directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return manifest
+
+
+def write_archive(archive_path, output_directory, manifest):
+    """Write the files of the bundle and its manifest to a compressed ZIP archive."""
+
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for file in manifest['files']:
+            archive.write(os.path.join(output_directory, file['file']), file['file'])
+
+        archive.write(os.path.join(output_directory, 'manifest.json'), 'manifest.json')
+
+
+class Command(BaseCommand):
+    help = 'Export observations, surveys, sites and vegetation surveys to files of a directory, at the same time, with ' \
+           'a manifest of the number of rows and checksum of each file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_directory', type=str, help='Directory of the files, which is created if needed')
+        parser.add_argument('--practice_sites', type=str, nargs="*", default=[],
+                            help='Site names of the practice sites to exclude from the exports')
+        parser.add_argument('--format', choices=[CSV, PARQUET, ARROW], default=CSV,
+                            help='Format of the files (parquet and arrow need pyarrow)')
+        parser.add_argument('--archive', type=str,
+                            help='Path of a ZIP file to write with all of the files and the manifest')
+        parser.add_argument('--workers', type=int,
+                            help='Number of exports that run at the same time (by default all of them)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        try:
+            manifest = export_bundle(options['output_directory'], options['practice_sites'], options['format'],
+                                     options['workers'])
+        except ImportError as error:
+            raise CommandError(error)
+
+        if options['archive']:
+            write_archive(options['archive'], options['output_directory'], manifest)
+
+        for file in manifest['files']:
+            print(f"{file['file']}: {file['rows']} rows in {file['seconds']:.3f} s")
+
+        print(f"Exported {len(manifest['files'])} files in {time.perf_counter() - start:.3f} s")
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...columnar_export import BATCH_SIZE, FORMATS, PARQUET, export_columnar
+from .export_observations_csv import export_observations, get_resolved_confirmed_observations, \
+    get_resolved_finalised_observations
+from .export_site_metadata_csv import export_site, get_sites
+from .export_survey_metadata_csv import export_survey, get_surveys
+from .export_vegetation_surveys_csv import export_vegetation_survey, get_vegetation_surveys
+
+
+def get_dataset(dataset, practice_sites):
+    """
+    Return the querysets and the export spec (see exports.ExportSpec) of a dataset, which are the same as those of the
+    CSV export of the dataset.
+    """
+
+    if dataset == 'observations':
+        return [get_resolved_confirmed_observations(practice_sites),
+                get_resolved_finalised_observations(practice_sites)], export_observations
+    elif dataset == 'surveys':
+        return [get_surveys(practice_sites)], export_survey
+    elif dataset == 'sites':
+        return [get_sites(practice_sites)], export_site
+    elif dataset == 'vegetation_surveys':
+        return [get_vegetation_surveys(practice_sites)], export_vegetation_survey
+    else:
+        assert False
+
+
+class Command(BaseCommand):
+    help = 'Export observations, surveys, sites or vegetation surveys to a typed columnar file (Parquet or Arrow), ' \
+           'e.g. to be read with the arrow package of R. Needs pyarrow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=['observations', 'surveys', 'sites', 'vegetation_surveys'],
+                            help='Data to export, as in the export_*_csv commands')
+        parser.add_argument('output_file', type=str, help='Path to the file')
+        parser.add_argument('--format', choices=FORMATS, default=PARQUET, help='Format of the file')
+        parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                            help='Number of rows that are read and written at a time (rows of each row group of '
+                                 'Parquet files)')
+        parser.add_argument('--practice_sites', type=str, nargs="*", default=[],
+                            help='Site names of the practice sites to exclude from the export')
+
+    def handle(self, *args, **options):
+        querysets, spec = get_dataset(options['dataset'], options['practice_sites'])
+
+        try:
+            number_rows = export_columnar(options['output_file'], querysets, spec.paths, options['format'],
+                                          options['batch_size'])
+        except ImportError as error:
+            raise CommandError(error)
+
+        print(f"Exported {number_rows} rows to {options['output_file']}")
@@ -1,5 +1,6 @@
 import argparse
 import csv
+import functools
 
 from pyproj import Transformer
 from django.core.management.base import BaseCommand
@@ -10,27 +11,29 @@ from . import export_observations_csv
 header_observations = ['species', 'date_cest', 'x', 'y', 'altitude', 'site_name', 'count', 'sex']
 
 
-def convert_latlon_to_utm(latitude, longitude):
+@functools.lru_cache(maxsize=None)
+def get_transformer():
+    """
+    Return the transformer from latitude and longitude (WGS84) to UTM zone 31N coordinates. Creating a transformer is
+    much slower than using it, so it is only created once.
+    """
 
-    # Create a transformer
-    transformer = Transformer.from_crs("epsg:4326", "epsg:32631")
+    return Transformer.from_crs("epsg:4326", "epsg:32631")
+
+
+def convert_latlon_to_utm(latitude, longitude):
 
     # Use the transform function to convert
-    easting, northing = transformer.transform(latitude, longitude)
+    easting, northing = get_transformer().transform(latitude, longitude)
 
     return easting, northing
 
 
-def get_row_for_identification(identification):
+def get_site_midpoint(identification):
     """
-    Get the attributes of each identification.
-
-    Return a dictionary.
+    Return the latitude and longitude of the middle of the transect of the site of a summarised identification.
     """
 
-    row = {}
-
-    # Convert lat lon to UTM coordinates
     latitude = identification['observation__survey__visit__site__latitude_start']\
                       + ((identification['observation__survey__visit__site__latitude_end']
                           - identification['observation__survey__visit__site__latitude_start']) / 2)
@@ -38,7 +41,49 @@ def get_row_for_identification(identification):
                       + ((identification['observation__survey__visit__site__longitude_end']
                           - identification['observation__survey__visit__site__longitude_start']) / 2)
 
-    coords = convert_latlon_to_utm(latitude, longitude)
+    return latitude, longitude
+
+
+def get_sites_utm_coordinates(identifications):
+    """
+    Convert the middle of the transect of each site of the summarised identifications to UTM coordinates. All of the
+    sites are converted with one call of the transformer.
+
+    Return a dictionary of the (easting, northing) of each site name.
+    """
+
+    midpoints = {}
+    for identification in identifications:
+        midpoints[identification['observation__survey__visit__site__site_name']] = get_site_midpoint(identification)
+
+    if len(midpoints) == 0:
+        return {}
+
+    latitudes = [latitude for latitude, longitude in midpoints.values()]
+    longitudes = [longitude for latitude, longitude in midpoints.values()]
+
+    eastings, northings = get_transformer().transform(latitudes, longitudes)
+
+    return dict(zip(midpoints.keys(), zip(eastings, northings)))
+
+
+def get_row_for_identification(identification, sites_utm_coordinates=None):
+    """
+    Get the attributes of each identification. The UTM coordinates of the site can be given from
+    get_sites_utm_coordinates, otherwise they are converted for this identification.
+
+    Return a dictionary.
+    """
+
+    row = {}
+
+    # Convert lat lon to UTM coordinates
+    site_name = identification['observation__survey__visit__site__site_name']
+
+    if sites_utm_coordinates is not None and site_name in sites_utm_coordinates:
+        coords = sites_utm_coordinates[site_name]
+    else:
+        coords = convert_latlon_to_utm(*get_site_midpoint(identification))
 
     row['x'] = '{:06.0f}'.format(coords[0])
     row['y'] = '{:07.0f}'.format(coords[1])
@@ -51,7 +96,7 @@ def get_row_for_identification(identification):
     else:
         row['sex'] = 0
 
-    row['site_name'] = identification['observation__survey__visit__site__site_name']
+    row['site_name'] = site_name
     row['altitude'] = '{:.0f}'.format(identification['observation__survey__visit__site__altitude_start']\
                       + ((identification['observation__survey__visit__site__altitude_end']
                           - identification['observation__survey__visit__site__altitude_start']) / 2))
@@ -110,10 +155,12 @@ def get_observations(practice_sites):
 
     confirmed_identifications = export_observations_csv.get_confirmed_observations(practice_sites)
     confirmed_ids_species = get_identifications_to_species(confirmed_identifications)
-    summarised_ids = summarise_observations(confirmed_ids_species)
+    summarised_ids = list(summarise_observations(confirmed_ids_species))
+
+    sites_utm_coordinates = get_sites_utm_coordinates(summarised_ids)
 
     for summarised_id in summarised_ids:
-        row = get_row_for_identification(summarised_id)
+        row = get_row_for_identification(summarised_id, sites_utm_coordinates)
         selected_identifications.append(row)
 
     print("Number of selected identifications:", len(selected_identifications))
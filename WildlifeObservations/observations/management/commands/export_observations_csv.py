@@ -1,40 +1,32 @@
 import argparse
 import csv
+import time
 
 from django.core.management.base import BaseCommand
 
+from ...exports import ExportDelta, ExportSpec, add_delta_arguments, export_csv_or_delta, write_rows
 from ...models import Identification
-from ...utils import field_or_empty_string
-
-header_observations = ['specimen_label', 'site_name', 'date_cest', 'method', 'method_repeat', 'sex', 'stage',
-                       'id_confidence', 'suborder', 'family', 'subfamily', 'genus', 'species']
-
-
-def get_row_for_identification(identification):
-    row = {}
-
-    row['specimen_label'] = identification.observation.specimen_label
-    print(row['specimen_label'])
-    row['site_name'] = identification.observation.survey.visit.site.site_name
-    row['date_cest'] = identification.observation.survey.visit.date
-    row['method'] = identification.observation.survey.method
-    row['method_repeat'] = identification.observation.survey.repeat
-    row['sex'] = identification.sex  # shouldn't be null
-    row['stage'] = identification.stage  # shouldn't be null
-    row['id_confidence'] = identification.confidence  # shouldn't be null
-    row['suborder'] = identification.suborder.suborder  # shouldn't be null
-    row['family'] = field_or_empty_string(identification.family, 'family')  # can be null if the identification cannot
-    # be determined to this taxonomic level
-    row['subfamily'] = field_or_empty_string(identification.subfamily,
-                                             'subfamily')  # can be null if the identification cannot be determined to
-    # this taxonomic level
-    row['genus'] = field_or_empty_string(identification.genus, 'genus')  # can be null if the identification cannot be
-    # determined to this taxonomic level
-    row['species'] = field_or_empty_string(identification.species,
-                                           'latin_name')  # can be null if the identification cannot be determined to
-    # this taxonomic level
-
-    return row
+from ...utils import QueryCounter
+
+# Columns of the export and the field of the identification (or of its observation) that is exported in each of them
+export_observations = ExportSpec({'specimen_label': 'observation__specimen_label',
+                                  'site_name': 'observation__survey__visit__site__site_name',
+                                  'date_cest': 'observation__survey__visit__date',
+                                  'method': 'observation__survey__method',
+                                  'method_repeat': 'observation__survey__repeat',
+                                  'sex': 'sex',  # shouldn't be null
+                                  'stage': 'stage',  # shouldn't be null
+                                  'id_confidence': 'confidence',  # shouldn't be null
+                                  'suborder': 'suborder__suborder',  # shouldn't be null
+                                  'family': 'family__family',  # the taxonomy can be null if the identification
+                                  'subfamily': 'subfamily__subfamily',  # cannot be determined to this taxonomic level
+                                  'genus': 'genus__genus',
+                                  'species': 'species__latin_name'})
+
+# The rows of each observation are exported again when the observation, its identifications, survey, visit or site
+# change
+delta_observations = ExportDelta(export_observations, ['specimen_label'], 'observation',
+                                 ['identification', 'survey', 'survey__visit', 'survey__visit__site'])
 
 
 def get_confirmed_observations(practice_sites):
@@ -70,7 +62,42 @@ def get_finalised_observations(practice_sites):
     return finalised_identifications
 
 
-def export_csv(output_file, practice_sites):
+def get_resolved_confirmed_observations(practice_sites):
+    """
+    Get one confirmed identification for each observation that has been confirmed, using the resolved identification of
+    each observation.
+
+    Exclude observations from practice sites.
+
+    Return query set of confirmed identifications.
+    """
+
+    confirmed_identifications = Identification.objects.exclude(
+        observation__survey__visit__site__site_name__in=practice_sites).filter(
+        resolvedidentification__confidence=Identification.Confidence.CONFIRMED).order_by('id')
+
+    return confirmed_identifications
+
+
+def get_resolved_finalised_observations(practice_sites):
+    """
+    Get all finalised identifications of the observations that have been finalised but not confirmed, using the
+    resolved identification of each observation.
+
+    Exclude observations from practice sites.
+
+    Return query set of finalised identifications.
+    """
+
+    finalised_identifications = Identification.objects.exclude(
+        observation__survey__visit__site__site_name__in=practice_sites).filter(
+        confidence=Identification.Confidence.FINALISED).filter(
+        observation__resolvedidentification__confidence=Identification.Confidence.FINALISED).order_by('id')
+
+    return finalised_identifications
+
+
+def export_csv(output_file, practice_sites, stats_file):
     """
     Export data from a query into a CSV file which has a specified output file.
 
@@ -93,54 +120,60 @@ def export_csv(output_file, practice_sites):
 
     Observations from 'practice' sites, are excluded from the export. These were sites that were only visited once
     during the surveys and were not appropriate for visiting again.
-    """
 
-    headers = header_observations
+    The numbers of rows, the time and the number of queries are written to stats_file (e.g. stderr), so that they are
+    not mixed with the rows when output_file is stdout.
+    """
 
-    csv_writer = csv.DictWriter(output_file, headers)
+    csv_writer = csv.DictWriter(output_file, export_observations.headers)
     csv_writer.writeheader()
 
     # There must only be one identification exported for each observation, where the observation has a confirmed
     # identification. Note that this can be to any taxonomic level.
+    #
+    # The resolved identification of each observation is its most certain identification, so observations with a
+    # confirmed resolved identification have exactly one identification selected here. Data integrity checks will
+    # ensure that if there is more than one confirmed identification for an observation, then it is for the same taxa.
 
-    confirmed_identifications = get_confirmed_observations(practice_sites)
-
-    # Creating a set of the specimen labels ensures that only one confirmed identification for the same observation
-    # should be exported. Data integrity checks will ensure that if there is more than one confirmed identification
-    # for an observation, then it is for the same taxa. It is then also used as an extra check to make sure that no
-    # finalised identifications can be exported if a confirmed identification for the same observation has been
-    # exported. This case should be accounted for though in the data integrity checks.
+    start = time.perf_counter()
 
-    selected_identification_specimen_label = set()
+    with QueryCounter() as queries:
+        number_confirmed = write_rows(csv_writer, export_observations,
+                                      [get_resolved_confirmed_observations(practice_sites)])
+        stats_file.write(f"Number of specimen labels after confirmed ids: {number_confirmed}\n")
 
-    for confirmed_identification in confirmed_identifications:
-        if confirmed_identification.observation.specimen_label not in selected_identification_specimen_label:
-            row = get_row_for_identification(confirmed_identification)
-            selected_identification_specimen_label.add(confirmed_identification.observation.specimen_label)
+        # There could be more than one finalised identification that should be exported, so allow for more than one
+        # with the same specimen label. Observations with a confirmed identification have a confirmed resolved
+        # identification, so none of their finalised identifications can be exported. This case should be accounted
+        # for though in the data integrity checks.
 
-            csv_writer.writerow(row)
-    print("Number of specimen labels after confirmed ids: ", len(selected_identification_specimen_label))
+        stats_file.write(f"Number of finalised ids: {get_finalised_observations(practice_sites).count()}\n")
 
-    # There could be more than one finalised identification that should be exported, so allow for more than one with
-    # the same specimen label, but check that they are not in the set of observations that have confirmed
-    # identifications.
+        number_finalised = write_rows(csv_writer, export_observations,
+                                      [get_resolved_finalised_observations(practice_sites)])
 
-    finalised_identifications = get_finalised_observations(practice_sites)
-    print("Number of finalised ids:", finalised_identifications.count())
+    seconds = time.perf_counter() - start
+    number_rows = number_confirmed + number_finalised
 
-    for finalised_identification in finalised_identifications:
-        if finalised_identification.observation.specimen_label not in selected_identification_specimen_label:
-            row = get_row_for_identification(finalised_identification)
+    rows_per_second = number_rows / seconds if seconds > 0 else 0
 
-            csv_writer.writerow(row)
+    stats_file.write(f"Exported {number_rows} rows in {seconds:.3f} s ({rows_per_second:.0f} rows/s) with "
+                     f"{queries.count} queries\n")
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('output_file', type=argparse.FileType('w'), help='Path to the file or - for stdout')
-        parser.add_argument('--practice_sites', type=str, nargs="*",
+        parser.add_argument('--practice_sites', type=str, nargs="*", default=[],
                             help='Site names of the practice sites to exclude from the export')
+        add_delta_arguments(parser)
 
     def handle(self, *args, **options):
-        export_csv(options['output_file'], options['practice_sites'])
+        practice_sites = options['practice_sites']
+        querysets = [get_resolved_confirmed_observations(practice_sites),
+                     get_resolved_finalised_observations(practice_sites)]
+
+        export_csv_or_delta(options['output_file'], 'observations', delta_observations, querysets, practice_sites,
+                            options, lambda: export_csv(options['output_file'], practice_sites, self.stderr),
+                            self.stderr)
@@ -1,12 +1,32 @@
 import argparse
-import csv
 
 from django.core.management.base import BaseCommand
 
+from ...exports import ExportDelta, ExportSpec, add_delta_arguments, export_csv_or_delta, write_csv
 from ...models import Site
 
-header_site = ['area', 'site_name', 'elevational_band_m', 'latitude_start_n', 'longitude_start_e', 'elevation_start_m',
-               'latitude_end_n', 'longitude_end_e', 'elevation_end_m', 'transect_length_m']
+# Columns of the export and the field of the site that is exported in each of them
+export_site = ExportSpec({'area': 'area',
+                          'site_name': 'site_name',
+                          'elevational_band_m': 'altitude_band',
+                          'latitude_start_n': 'latitude_start',
+                          'longitude_start_e': 'longitude_start',
+                          'elevation_start_m': 'altitude_start',
+                          'latitude_end_n': 'latitude_end',
+                          'longitude_end_e': 'longitude_end',
+                          'elevation_end_m': 'altitude_end',
+                          'transect_length_m': 'transect_length'})
+
+# The row of each site is exported again when the site changes
+delta_site = ExportDelta(export_site, ['site_name'])
+
+
+def get_sites(practice_sites):
+    """
+    Return query set of the sites to export, excluding the practice sites, ordered by area and altitude band.
+    """
+
+    return Site.objects.exclude(site_name__in=practice_sites).order_by('area', 'altitude_band')
 
 
 def export_csv(output_file, practice_sites):
@@ -17,36 +37,19 @@ def export_csv(output_file, practice_sites):
     of headers.
     """
 
-    headers = header_site
-
-    csv_writer = csv.DictWriter(output_file, headers)
-    csv_writer.writeheader()
-
-    sites = Site.objects.exclude(site_name__in=practice_sites).order_by('area', 'altitude_band')
-
-    for site in sites:
-        row = {}
-
-        row['area'] = site.area
-        row['site_name'] = site.site_name
-        row['elevational_band_m'] = site.altitude_band
-        row['latitude_start_n'] = site.latitude_start
-        row['longitude_start_e'] = site.longitude_start
-        row['elevation_start_m'] = site.altitude_start
-        row['latitude_end_n'] = site.latitude_end
-        row['longitude_end_e'] = site.longitude_end
-        row['elevation_end_m'] = site.altitude_end
-        row['transect_length_m'] = site.transect_length
-
-        csv_writer.writerow(row)
+    write_csv(output_file, export_site, [get_sites(practice_sites)])
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('output_file', type=argparse.FileType('w'), help='Path to the file or - for stdout')
-        parser.add_argument('--practice_sites', type=str, nargs="*",
+        parser.add_argument('--practice_sites', type=str, nargs="*", default=[],
                             help='Site names of the practice sites to exclude from the export')
+        add_delta_arguments(parser)
 
     def handle(self, *args, **options):
-        export_csv(options['output_file'], options['practice_sites'])
\ No newline at end of file
+        practice_sites = options['practice_sites']
+
+        export_csv_or_delta(options['output_file'], 'sites', delta_site, [get_sites(practice_sites)], practice_sites,
+                            options, lambda: export_csv(options['output_file'], practice_sites), self.stderr)
\ No newline at end of file
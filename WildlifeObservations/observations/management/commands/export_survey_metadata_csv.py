@@ -1,12 +1,36 @@
 import argparse
-import csv
 
 from django.core.management.base import BaseCommand
 
+from ...exports import ExportDelta, ExportSpec, add_delta_arguments, export_csv_or_delta, write_csv
 from ...models import Survey
 
-header_survey = ['site_name', 'date_cest', 'start_time_cest', 'end_time_cest', 'method', 'method_repeat',
-                 'cloud_coverage_start', 'wind_start', 'rain_start', 'cloud_coverage_end', 'wind_end', 'rain_end']
+# Columns of the export and the field of the survey that is exported in each of them
+export_survey = ExportSpec({'site_name': 'visit__site__site_name',
+                            'date_cest': 'visit__date',
+                            'start_time_cest': 'start_time',
+                            'end_time_cest': 'end_time',
+                            'method': 'method',
+                            'method_repeat': 'repeat',
+                            'cloud_coverage_start': 'meteorologyconditions__cloud_coverage_start',
+                            'wind_start': 'meteorologyconditions__wind_start',
+                            'rain_start': 'meteorologyconditions__rain_start',
+                            'cloud_coverage_end': 'meteorologyconditions__cloud_coverage_end',
+                            'wind_end': 'meteorologyconditions__wind_end',
+                            'rain_end': 'meteorologyconditions__rain_end'})
+
+# The row of each survey is exported again when the survey, its meteorological conditions, visit or site change
+delta_survey = ExportDelta(export_survey, ['site_name', 'date_cest', 'method', 'method_repeat'], None,
+                           ['meteorologyconditions', 'visit', 'visit__site'])
+
+
+def get_surveys(practice_sites):
+    """
+    Return query set of the surveys to export, excluding those from practice sites, ordered by site, date and start time.
+    """
+
+    return Survey.objects.exclude(visit__site__site_name__in=practice_sites).order_by('visit__site__site_name',
+                                                                                      'visit__date', 'start_time')
 
 
 def export_csv(output_file, practice_sites):
@@ -17,39 +41,20 @@ def export_csv(output_file, practice_sites):
     of headers.
     """
 
-    headers = header_survey
-
-    csv_writer = csv.DictWriter(output_file, headers)
-    csv_writer.writeheader()
-
-    surveys = Survey.objects.exclude(visit__site__site_name__in=practice_sites).order_by('visit__site__site_name',
-                                                                                         'visit__date', 'start_time')
-
-    for survey in surveys:
-        row = {}
-
-        row['site_name'] = survey.visit.site.site_name
-        row['date_cest'] = survey.visit.date
-        row['start_time_cest'] = survey.start_time
-        row['end_time_cest'] = survey.end_time
-        row['method'] = survey.method
-        row['method_repeat'] = survey.repeat
-        row['cloud_coverage_start'] = survey.meteorologyconditions.cloud_coverage_start
-        row['wind_start'] = survey.meteorologyconditions.wind_start
-        row['rain_start'] = survey.meteorologyconditions.rain_start
-        row['cloud_coverage_end'] = survey.meteorologyconditions.cloud_coverage_end
-        row['wind_end'] = survey.meteorologyconditions.wind_end
-        row['rain_end'] = survey.meteorologyconditions.rain_end
-
-        csv_writer.writerow(row)
+    write_csv(output_file, export_survey, [get_surveys(practice_sites)])
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('output_file', type=argparse.FileType('w'), help='Path to the file or - for stdout')
-        parser.add_argument('--practice_sites', type=str, nargs="*",
+        parser.add_argument('--practice_sites', type=str, nargs="*", default=[],
                             help='Site names of the practice sites to exclude from the export')
+        add_delta_arguments(parser)
 
     def handle(self, *args, **options):
-        export_csv(options['output_file'], options['practice_sites'])
+        practice_sites = options['practice_sites']
+
+        export_csv_or_delta(options['output_file'], 'surveys', delta_survey, [get_surveys(practice_sites)],
+                            practice_sites, options, lambda: export_csv(options['output_file'], practice_sites),
+                            self.stderr)
@@ -1,13 +1,37 @@
 import argparse
-import csv
 
 from django.core.management.base import BaseCommand
 
+from ...exports import ExportDelta, ExportSpec, add_delta_arguments, export_csv_or_delta, write_csv
 from ...models import VegetationStructure
 
-header_vegetation_survey = ['site_name', 'date_cest', 'plot_distance_from_start_m', 'percentage_vegetation_cover',
-                            'percentage_bare_ground', 'percentage_rock', 'height_75percent', 'max_height',
-                            'density_01', 'density_02', 'density_03', 'density_04', 'density_05']
+# Columns of the export and the field of the vegetation survey that is exported in each of them
+export_vegetation_survey = ExportSpec({'site_name': 'plot__visit__site__site_name',
+                                       'date_cest': 'plot__visit__date',
+                                       'plot_distance_from_start_m': 'plot__position',
+                                       'percentage_vegetation_cover': 'percentage_vegetation_cover',
+                                       'percentage_bare_ground': 'percentage_bare_ground',
+                                       'percentage_rock': 'percentage_rock',
+                                       'height_75percent': 'height_75percent',
+                                       'max_height': 'max_height',
+                                       'density_01': 'density_01',
+                                       'density_02': 'density_02',
+                                       'density_03': 'density_03',
+                                       'density_04': 'density_04',
+                                       'density_05': 'density_05'})
+
+# The row of each vegetation survey is exported again when the vegetation survey, its plot, visit or site change
+delta_vegetation_survey = ExportDelta(export_vegetation_survey,
+                                      ['site_name', 'date_cest', 'plot_distance_from_start_m'], None,
+                                      ['plot', 'plot__visit', 'plot__visit__site'])
+
+
+def get_vegetation_surveys(practice_sites):
+    """
+    Return query set of the vegetation surveys to export, excluding those from practice sites.
+    """
+
+    return VegetationStructure.objects.exclude(plot__visit__site__site_name__in=practice_sites)
 
 
 def export_csv(output_file, practice_sites):
@@ -18,40 +42,20 @@ def export_csv(output_file, practice_sites):
     of headers.
     """
 
-    headers = header_vegetation_survey
-
-    csv_writer = csv.DictWriter(output_file, headers)
-    csv_writer.writeheader()
-
-    vegetation_surveys = VegetationStructure.objects.exclude(plot__visit__site__site_name__in=practice_sites)
-
-    for vegetation_survey in vegetation_surveys:
-
-        row = {}
-
-        row['site_name'] = vegetation_survey.plot.visit.site.site_name
-        row['date_cest'] = vegetation_survey.plot.visit.date
-        row['plot_distance_from_start_m'] = vegetation_survey.plot.position
-        row['percentage_vegetation_cover'] = vegetation_survey.percentage_vegetation_cover
-        row['percentage_bare_ground'] = vegetation_survey.percentage_bare_ground
-        row['percentage_rock'] = vegetation_survey.percentage_rock
-        row['height_75percent'] = vegetation_survey.height_75percent
-        row['max_height'] = vegetation_survey.max_height
-        row['density_01'] = vegetation_survey.density_01
-        row['density_02'] = vegetation_survey.density_02
-        row['density_03'] = vegetation_survey.density_03
-        row['density_04'] = vegetation_survey.density_04
-        row['density_05'] = vegetation_survey.density_05
-
-        csv_writer.writerow(row)
+    write_csv(output_file, export_vegetation_survey, [get_vegetation_surveys(practice_sites)])
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('output_file', type=argparse.FileType('w'), help='Path to the file or - for stdout')
-        parser.add_argument('--practice_sites', type=str, nargs="*",
+        parser.add_argument('--practice_sites', type=str, nargs="*", default=[],
                             help='Site names of the practice sites to exclude from the export')
+        add_delta_arguments(parser)
 
     def handle(self, *args, **options):
-        export_csv(options['output_file'], options['practice_sites'])
\ No newline at end of file
+        practice_sites = options['practice_sites']
+
+        export_csv_or_delta(options['output_file'], 'vegetation_surveys', delta_vegetation_survey,
+                            [get_vegetation_surveys(practice_sites)], practice_sites, options,
+                            lambda: export_csv(options['output_file'], practice_sites), self.stderr)
\ No newline at end of file
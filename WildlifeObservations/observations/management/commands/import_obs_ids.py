@@ -1,22 +1,50 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from datetime import datetime
 
+from ...import_pipeline import RowError, add_import_arguments, clean_field, get_imported_identification_ids, \
+    run_chunked_import, run_import, upsert
 from ...models import Survey, Observation, IdentificationGuide, Identification, Visit, Site, TaxonomySpecies, \
-    TaxonomyGenus, TaxonomySuborder, TaxonomyFamily
+    TaxonomyGenus, TaxonomySubfamily, TaxonomySuborder, TaxonomyFamily
+from ...utils import IN_QUERY_CHUNK_SIZE
 import csv
 
+# Number of observations (and their identifications) written with each bulk_create in the bulk mode
+BATCH_SIZE = 1000
+
 
 class Command(BaseCommand):
     help = 'Adds observations and identifications'
 
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str)
+        parser.add_argument('--bulk', action='store_true',
+                            help='Validate all of the rows first, read the sites, visits, surveys, taxonomy and guides '
+                                 'once and write the observations and identifications in batches, for large files')
+        parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                            help='Number of observations written at a time with --bulk')
+        parser.add_argument('--chunk_size', type=int,
+                            help='Import as --bulk, but commit the observations in chunks of this number of rows and '
+                                 'save the last line that has been committed, so that the database is not locked for '
+                                 'the whole import and the import can be resumed')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue an import with --chunk_size of the same file after the last line that was '
+                                 'committed')
+        add_import_arguments(parser)
 
-    @transaction.atomic
     def handle(self, *args, **options):
         print(options['filename'])
-        self.import_observation_from_csv(options['filename'])
+
+        if options['incremental'] and (options['chunk_size'] is not None or options['resume']):
+            raise CommandError("--incremental cannot be used with --chunk_size or --resume")
+
+        if options['chunk_size'] is not None or options['resume']:
+            self.import_observations_chunked(options['filename'], options)
+        elif options['bulk'] or options['incremental']:
+            self.import_observations_bulk(options['filename'], options)
+        else:
+            with transaction.atomic():
+                self.import_observation_from_csv(options['filename'])
 
     def import_identification_from_csv(self, row_data, observation):
         identification = Identification()
@@ -32,51 +60,10 @@ class Command(BaseCommand):
         elif row_data['suborder'] != '':
             identification.suborder = TaxonomySuborder.objects.get(suborder=row_data['suborder'])
 
-        identification.identification_notes = row_data['id_notes']
-
-        if row_data['guide'] == 'Sardet et al':
-            identification.identification_guide = IdentificationGuide.objects.get(author='Sardet, Roesti and Braud')
-        elif row_data['guide'] != '':
-            identification.identification_guide = IdentificationGuide.objects.get(author=row_data['guide'])
-
-        if row_data['sex'] == 'female':
-            identification.sex = Identification.Sex.FEMALE
-        elif row_data['sex'] == 'male':
-            identification.sex = Identification.Sex.MALE
-        elif row_data['sex'] == '' and row_data['id_notes'] != '':
-            identification.sex = Identification.Sex.UNKNOWN
-        elif row_data['sex'] == '':
-            identification.sex = None
-
-        if row_data['stage'] == 'adult':
-            identification.stage = Identification.Stage.ADULT
-        elif row_data['stage'] == 'nymph':
-            identification.stage = Identification.Stage.NYMPH
-        elif row_data['stage'] == '' and row_data['id_notes'] != '':
-            identification.stage = Identification.Stage.UNKNOWN
-        elif row_data['stage'] == '':
-            identification.stage = None
-
-        if row_data['sure'] == 'yes':
-            identification.confidence = Identification.Confidence.YES
-        elif row_data['sure'] == 'redo':
-            identification.confidence = Identification.Confidence.REDO
-        elif row_data['sure'] == 'check':
-            identification.confidence = Identification.Confidence.CHECK
-        elif row_data['sure'] == 'not finished':
-            identification.confidence = Identification.Confidence.IN_PROGRESS
-        elif row_data['sure'] == 'review':
-            identification.confidence = Identification.Confidence.REVIEW
-        elif row_data['sure'] == '' and row_data['species'] != '':
-            identification.confidence = Identification.Confidence.REVIEW
-        elif row_data['sure'] == '':
-            identification.confidence = None
-
-        if row_data['id_date'] != '':
-            identification.date_of_identification = datetime.strptime(row_data['id_date'], '%Y-%m-%d').date()
-
-        identification.notebook = row_data['notebook']
-        identification.comments = row_data['comments']
+        if row_data['guide'] != '':
+            identification.identification_guide = IdentificationGuide.objects.get(author=get_guide_author(row_data))
+
+        set_identification_details(identification, row_data)
 
         identification.save()
 
@@ -86,38 +73,446 @@ class Command(BaseCommand):
             reader = csv.DictReader(csvfile)
 
             for row in reader:
-                observation = Observation()
                 print(row)
 
-                survey_details = row['specimen_id'].split(' ')
-                site = survey_details[0]
+                site, visit_date, method, repeat = get_survey_details(row['specimen_id'])
 
-                visit_date = survey_details[1]
-                visit_date_time_obj = datetime.strptime(visit_date, '%Y%m%d').date()
+                visit = Visit.objects.get(site=Site.objects.get(site_name=site), date=visit_date)
+                survey = Survey.objects.get(visit=visit, method=method, repeat=repeat)
 
-                survey_method = survey_details[2][0]
-                if survey_method == 'N':
-                    method = Survey.Method.NET
-                elif survey_method == 'H':
-                    method = Survey.Method.HAND
+                observation = create_observation(row, survey.id)
+                observation.save()
 
-                survey_repeat = survey_details[2][1]
+                identification_data = get_identification_data(row)
+                self.import_identification_from_csv(identification_data, observation)
 
-                visit = Visit.objects.get(site=Site.objects.get(site_name=site), date=visit_date_time_obj)
-                survey = Survey.objects.get(visit=visit, method=method, repeat=survey_repeat)
+    def import_observations_bulk(self, filename, options):
+        """Import the observations and identifications of the file with the import pipeline (see
+        import_pipeline.run_import): the rows are validated (see validate_observation_row), the surveys, taxonomy and
+        guides are read once (see ImportLookups) and the observations and identifications are written with bulk
+        queries, in batches of --batch_size observations. With --incremental, the observations that already exist are
+        updated by specimen label. The identification that has been written from a row before is updated when the row
+        changes (e.g. a corrected species), and the other identifications by the fields of the unique constraint of the
+        identifications."""
 
-                observation.specimen_label = row['specimen_id']
-                observation.survey = survey
+        objects = run_import(filename, options, validate_observation_row,
+                             lambda rows: prepare_observations(rows, options['incremental']),
+                             lambda objects: write_observations(objects, options['batch_size']),
+                             'import_obs_ids', lambda row: row['specimen_id'])
+
+        if objects is not None:
+            print(f"Imported {len(objects)} observations and identifications")
+
+    def import_observations_chunked(self, filename, options):
+        """Import the observations and identifications of the file as import_observations_bulk, but commit them in
+        chunks of --chunk_size rows (see import_pipeline.run_chunked_import). With --resume, the rows up to the last
+        line that has been committed in a previous run are skipped."""
+
+        chunk_size = options['chunk_size'] or BATCH_SIZE
+
+        objects = run_chunked_import('import_obs_ids', filename, options, validate_observation_row,
+                                     prepare_observations,
+                                     lambda objects: write_observations(objects, options['batch_size']), chunk_size)
+
+        print(f"Imported {len(objects)} observations and identifications")
+
+
+# Columns of the file with the details of the identification of each observation, and the optional column of the
+# confidence reason (as written in the Identification model)
+IDENTIFICATION_COLUMNS = ["suborder", "family", "genus", "species", "id_notes", "sure", "sex", "stage", "guide",
+                          "notebook", "id_date", "comments"]
+CONFIDENCE_REASON_COLUMN = "confidence_reason"
+
+# Fields of the observations and identifications that are updated with --incremental. The status of the observations
+# is only set when they are created.
+OBSERVATION_FIELDS = ['survey', 'length_head_abdomen']
+IDENTIFICATION_FIELDS = ['genus', 'subfamily', 'family', 'suborder', 'identification_notes', 'sex', 'stage',
+                         'confidence', 'confidence_reason', 'notebook', 'comments']
+# Fields of the unique constraint of the identifications, which are also updated in the identification that has been
+# written from a row before
+IDENTIFICATION_KEY_FIELDS = ['observation', 'identification_guide', 'species', 'date_of_identification']
+
+# Values of the sure, sex and stage columns (see set_identification_details)
+SURE_VALUES = ['yes', 'redo', 'check', 'not finished', 'review', '']
+SEX_VALUES = ['female', 'male', '']
+STAGE_VALUES = ['adult', 'nymph', '']
 
-                if row['length_mm'] != '':  # if nothing is assigned it is None by default
-                    observation.length_head_abdomen = row['length_mm']
 
-                observation.status = 'Specimen'  # all those imported are specimens rather than observations
+def validate_observation_row(row):
+    """Return list of (column, message) of the errors of a row that can be found without the database: the format of
+    the specimen label (and of the survey in it), the range of the length, the values of the identification columns,
+    the date of the identification and the combination of the confidence and the confidence reason."""
+
+    errors = []
+
+    if clean_field(errors, Observation, 'specimen_label', row['specimen_id'], 'specimen_id') is not None:
+        try:
+            get_survey_details(row['specimen_id'])
+        except ValueError as error:
+            errors.append(('specimen_id', str(error)))
 
-                observation.save()
+    if row['length_mm'] != '':
+        clean_field(errors, Observation, 'length_head_abdomen', row['length_mm'], 'length_mm')
 
-                identification_data = select_columns(row, ["suborder", "family", "genus", "species", "id_notes", "sure", "sex", "stage", "guide", "notebook", "id_date", "comments"])
-                self.import_identification_from_csv(identification_data, observation)
+    for column, values in (('sure', SURE_VALUES), ('sex', SEX_VALUES), ('stage', STAGE_VALUES)):
+        if row[column] not in values:
+            errors.append((column, f'Unknown value "{row[column]}" (it should be one of {", ".join(values[:-1])} or '
+                                   f'empty)'))
+
+    if row['id_date'] != '':
+        try:
+            datetime.strptime(row['id_date'], '%Y-%m-%d')
+        except ValueError as error:
+            errors.append(('id_date', str(error)))
+
+    if errors:
+        return errors
+
+    identification = Identification()
+    set_identification_details(identification, get_identification_data(row))
+
+    if identification.confidence_reason is not None and \
+            clean_field(errors, Identification, 'confidence_reason', identification.confidence_reason,
+                        CONFIDENCE_REASON_COLUMN) is not None and identification.confidence is not None and \
+            identification.confidence_reason not in Identification.CONFIDENCE_REASONS[identification.confidence]:
+        errors.append((CONFIDENCE_REASON_COLUMN, f"{identification.confidence_reason} is not a reason of the "
+                                                 f"confidence {identification.confidence}"))
+
+    return errors
+
+
+def prepare_observations(rows, incremental=False):
+    """Return list of the unsaved (observation, identification) of the rows, and list of the RowError of the rows with
+    a survey, taxon or guide that does not exist, or with a specimen label that is repeated or already exists (unless it
+    is an incremental import, which updates the observations).
+
+    In an incremental import, the identification of a row that has been imported before has the id of the
+    identification that was written from it (see ImportedRow), so that it is updated (see write_observations). It is an
+    error if the row now has the guide, species and date of another identification of the observation."""
+
+    lookups = ImportLookups.load()
+    objects = []
+    errors = []
+
+    for line_number, row in rows:
+        try:
+            observation = create_observation(row, lookups.get_survey_id(row['specimen_id']))
+        except KeyError:
+            errors.append(RowError(line_number, 'specimen_id', 'The survey of the specimen does not exist'))
+            continue
+
+        try:
+            identification = lookups.create_identification(get_identification_data(row))
+        except KeyError as error:
+            errors.append(RowError(line_number, 'species', f'The taxon or guide {error} does not exist'))
+            continue
+
+        objects.append((line_number, observation, identification))
+
+    labels = [observation.specimen_label for line_number, observation, identification in objects]
+    existing_labels = set()
+    for i in range(0, len(labels), IN_QUERY_CHUNK_SIZE):
+        existing_labels.update(Observation.objects.filter(
+            specimen_label__in=labels[i:i + IN_QUERY_CHUNK_SIZE]).values_list('specimen_label', flat=True))
+
+    seen_labels = set()
+    for line_number, observation, identification in objects:
+        if observation.specimen_label in existing_labels and not incremental:
+            errors.append(RowError(line_number, 'specimen_id', 'The observation already exists'))
+        elif observation.specimen_label in seen_labels:
+            errors.append(RowError(line_number, 'specimen_id', 'The observation is repeated in the file'))
+
+        seen_labels.add(observation.specimen_label)
+
+    if incremental:
+        errors.extend(set_imported_identification_ids(objects))
+
+    return [(observation, identification) for line_number, observation, identification in objects], errors
+
+
+def set_imported_identification_ids(objects):
+    """Set the id of the identification that has been written from each row before (see prepare_observations) to the
+    identifications of the (line number, observation, identification). Return list of the RowError of the rows whose
+    identification would have the same guide, species and date as another identification of the observation."""
+
+    labels = [observation.specimen_label for line_number, observation, identification in objects]
+    imported_ids = get_imported_identification_ids('import_obs_ids', labels)
+
+    identification_ids = {}
+    for i in range(0, len(labels), IN_QUERY_CHUNK_SIZE):
+        for identification_id, *key in Identification.objects.filter(
+                observation__specimen_label__in=labels[i:i + IN_QUERY_CHUNK_SIZE]).values_list(
+                'id', 'observation__specimen_label', 'identification_guide_id', 'species_id', 'date_of_identification'):
+            identification_ids[tuple(key)] = identification_id
+
+    errors = []
+
+    for line_number, observation, identification in objects:
+        if observation.specimen_label not in imported_ids:
+            continue
+
+        identification.id = imported_ids[observation.specimen_label]
+
+        key = (observation.specimen_label, identification.identification_guide_id, identification.species_id,
+               identification.date_of_identification)
+        if None not in key and identification_ids.get(key, identification.id) != identification.id:
+            errors.append(RowError(line_number, 'species', 'The observation already has another identification with '
+                                                           'the guide, species and date of the row'))
+
+    return errors
+
+
+def write_observations(objects, batch_size=BATCH_SIZE):
+    """Write the (observation, identification) with bulk queries (see import_pipeline.upsert), in batches of batch_size
+    observations. The observations are created or updated by specimen label. The identifications with an id (see
+    set_imported_identification_ids) are updated, and the others are created or updated by the fields of their unique
+    constraint.
+
+    Return dictionary of the id of the identification of each specimen label."""
+
+    created_observations = updated_observations = created_identifications = updated_identifications = 0
+    identification_ids = {}
+
+    for start in range(0, len(objects), batch_size):
+        batch_observations = [observation for observation, identification in objects[start:start + batch_size]]
+        batch_identifications = [identification for observation, identification in objects[start:start + batch_size]]
+
+        observation_ids, created, updated = upsert(Observation, batch_observations, ['specimen_label'],
+                                                   OBSERVATION_FIELDS)
+        created_observations += created
+        updated_observations += updated
+
+        for observation, identification in zip(batch_observations, batch_identifications):
+            identification.observation_id = observation_ids[(observation.specimen_label,)]
+
+        imported = [identification.id is not None for identification in batch_identifications]
+        imported_identifications = [identification for identification, is_imported
+                                    in zip(batch_identifications, imported) if is_imported]
+        other_identifications = [identification for identification, is_imported
+                                 in zip(batch_identifications, imported) if not is_imported]
+
+        Identification.objects.bulk_update(imported_identifications,
+                                           IDENTIFICATION_KEY_FIELDS[1:] + IDENTIFICATION_FIELDS,
+                                           batch_size=IN_QUERY_CHUNK_SIZE)
+        updated_identifications += len(imported_identifications)
+
+        upserted_ids, created, updated = upsert(Identification, other_identifications, IDENTIFICATION_KEY_FIELDS,
+                                                IDENTIFICATION_FIELDS)
+        created_identifications += created
+        updated_identifications += updated
+
+        for observation, identification, is_imported in zip(batch_observations, batch_identifications, imported):
+            if is_imported:
+                identification_ids[observation.specimen_label] = identification.id
+            else:
+                identification_ids[observation.specimen_label] = upserted_ids[(
+                    identification.observation_id, identification.identification_guide_id, identification.species_id,
+                    identification.date_of_identification)]
+
+    print(f"Observations: {created_observations} created, {updated_observations} updated; identifications: "
+          f"{created_identifications} created, {updated_identifications} updated")
+
+    return identification_ids
+
+
+def get_identification_data(row):
+    """Return dictionary of the identification columns of a row (see IDENTIFICATION_COLUMNS)."""
+
+    columns = IDENTIFICATION_COLUMNS + ([CONFIDENCE_REASON_COLUMN] if CONFIDENCE_REASON_COLUMN in row else [])
+
+    return select_columns(row, columns)
+
+
+class ImportLookups:
+    """The surveys, taxonomy and identification guides that the rows of the file refer to, read once from the database
+    (eight queries) into dictionaries, so that the rows can be imported without reading them again."""
+
+    def __init__(self):
+        self.survey_ids = {}
+        self.species_ids = {}
+        self.genus_ids = {}
+        self.family_ids = {}
+        self.suborder_ids = {}
+        self.guide_ids = {}
+
+        # parent of each taxon, to set the taxonomy of the identifications as Identification.save() does
+        self.species_genus = {}
+        self.genus_subfamily = {}
+        self.subfamily_family = {}
+        self.family_suborder = {}
+
+    @classmethod
+    def load(cls):
+        lookups = cls()
+
+        for site_name, date, method, repeat, survey_id in Survey.objects.values_list(
+                'visit__site__site_name', 'visit__date', 'method', 'repeat', 'id'):
+            lookups.survey_ids[(site_name, date, method, repeat)] = survey_id
+
+        for species_id, latin_name, genus_id in TaxonomySpecies.objects.values_list('id', 'latin_name', 'genus_id'):
+            lookups.species_ids[latin_name] = species_id
+            lookups.species_genus[species_id] = genus_id
+
+        for genus_id, genus, subfamily_id in TaxonomyGenus.objects.values_list('id', 'genus', 'subfamily_id'):
+            lookups.genus_ids[genus] = genus_id
+            lookups.genus_subfamily[genus_id] = subfamily_id
+
+        lookups.subfamily_family = dict(TaxonomySubfamily.objects.values_list('id', 'family_id'))
+
+        for family_id, family, suborder_id in TaxonomyFamily.objects.values_list('id', 'family', 'suborder_id'):
+            lookups.family_ids[family] = family_id
+            lookups.family_suborder[family_id] = suborder_id
+
+        lookups.suborder_ids = {suborder: suborder_id for suborder_id, suborder in
+                                TaxonomySuborder.objects.values_list('id', 'suborder')}
+        lookups.guide_ids = {author: guide_id for guide_id, author in
+                             IdentificationGuide.objects.values_list('id', 'author')}
+
+        return lookups
+
+    def get_survey_id(self, specimen_label):
+        """Return the id of the survey of a specimen label. Raise KeyError if the survey does not exist."""
+
+        site, visit_date, method, repeat = get_survey_details(specimen_label)
+
+        return self.survey_ids[(site, visit_date, method, int(repeat))]
+
+    def create_identification(self, row_data):
+        """Return an unsaved identification of the row, with the same fields as import_identification_from_csv. Raise
+        KeyError if a taxon or the guide does not exist."""
+
+        identification = Identification()
+
+        if row_data['species'] != '':
+            identification.species_id = self.species_ids[row_data['species']]
+        elif row_data['genus'] != '':
+            identification.genus_id = self.genus_ids[row_data['genus']]
+        elif row_data['family'] != '':
+            identification.family_id = self.family_ids[row_data['family']]
+        elif row_data['suborder'] != '':
+            identification.suborder_id = self.suborder_ids[row_data['suborder']]
+
+        # the ancestors of the taxon, as in Identification.save()
+        if identification.species_id is not None:
+            identification.genus_id = self.species_genus[identification.species_id]
+
+        if identification.genus_id is not None:
+            identification.subfamily_id = self.genus_subfamily[identification.genus_id]
+
+        if identification.subfamily_id is not None:
+            identification.family_id = self.subfamily_family[identification.subfamily_id]
+
+        if identification.family_id is not None:
+            identification.suborder_id = self.family_suborder[identification.family_id]
+
+        if row_data['guide'] != '':
+            identification.identification_guide_id = self.guide_ids[get_guide_author(row_data)]
+
+        set_identification_details(identification, row_data)
+
+        return identification
+
+
+def get_survey_details(specimen_label):
+    """Return the site name, visit date, method and repeat (as written in the label) of the survey of a specimen
+    label."""
+
+    survey_details = specimen_label.split(' ')
+    site = survey_details[0]
+
+    visit_date = survey_details[1]
+    visit_date_time_obj = datetime.strptime(visit_date, '%Y%m%d').date()
+
+    survey_method = survey_details[2][0]
+    if survey_method == 'N':
+        method = Survey.Method.NET
+    elif survey_method == 'H':
+        method = Survey.Method.HAND
+    else:
+        raise ValueError(f'Unknown method: {survey_method}')
+
+    survey_repeat = survey_details[2][1]
+
+    return site, visit_date_time_obj, method, survey_repeat
+
+
+def create_observation(row, survey_id):
+    """Return an unsaved observation of the row, of the survey."""
+
+    observation = Observation()
+
+    observation.specimen_label = row['specimen_id']
+    observation.survey_id = survey_id
+
+    if row['length_mm'] != '':  # if nothing is assigned it is None by default
+        observation.length_head_abdomen = row['length_mm']
+
+    observation.status = 'Specimen'  # all those imported are specimens rather than observations
+
+    return observation
+
+
+def get_guide_author(row_data):
+    if row_data['guide'] == 'Sardet et al':
+        return 'Sardet, Roesti and Braud'
+
+    return row_data['guide']
+
+
+def set_identification_details(identification, row_data):
+    """Set the fields of the identification that are not relations from the row."""
+
+    identification.identification_notes = row_data['id_notes']
+
+    if row_data['sex'] == 'female':
+        identification.sex = Identification.Sex.FEMALE
+    elif row_data['sex'] == 'male':
+        identification.sex = Identification.Sex.MALE
+    elif row_data['sex'] == '' and row_data['id_notes'] != '':
+        identification.sex = Identification.Sex.UNKNOWN
+    elif row_data['sex'] == '':
+        identification.sex = None
+
+    if row_data['stage'] == 'adult':
+        identification.stage = Identification.Stage.ADULT
+    elif row_data['stage'] == 'nymph':
+        identification.stage = Identification.Stage.NYMPH
+    elif row_data['stage'] == '' and row_data['id_notes'] != '':
+        identification.stage = Identification.Stage.UNKNOWN
+    elif row_data['stage'] == '':
+        identification.stage = None
+
+    if row_data['sure'] == 'yes':
+        identification.confidence = Identification.Confidence.CONFIRMED  # "Yes" has been replaced by "Confirmed"
+    elif row_data['sure'] == 'redo':
+        identification.confidence = Identification.Confidence.REDO
+    elif row_data['sure'] == 'check':
+        identification.confidence = Identification.Confidence.CHECK
+    elif row_data['sure'] == 'not finished':
+        identification.confidence = Identification.Confidence.IN_PROGRESS
+    elif row_data['sure'] == 'review':
+        identification.confidence = Identification.Confidence.REVIEW
+    elif row_data['sure'] == '' and row_data['species'] != '':
+        identification.confidence = Identification.Confidence.REVIEW
+    elif row_data['sure'] == '':
+        identification.confidence = None
+
+    if row_data['id_date'] != '':
+        identification.date_of_identification = datetime.strptime(row_data['id_date'], '%Y-%m-%d').date()
+
+    identification.confidence_reason = string_or_none(row_data.get(CONFIDENCE_REASON_COLUMN, ''))
+
+    identification.notebook = row_data['notebook']
+    identification.comments = row_data['comments']
+
+
+def string_or_none(string):
+    if string != '':
+        output = string
+    else:
+        output = None
+
+    return output
 
 
 def select_columns(row, list_of_columns) -> dict:
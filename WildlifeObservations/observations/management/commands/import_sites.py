@@ -1,8 +1,31 @@
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
-from django.db import transaction
 
+from ...import_pipeline import RowError, add_import_arguments, run_import, upsert
 from ...models import Site, Source
-import csv
+from ...utils import IN_QUERY_CHUNK_SIZE
+
+# Source of each name used in the file
+SOURCE_NAMES = {'GPS': Source.PositionSource.GPS,
+                'Osmand': Source.PositionSource.OSMAND,
+                'DEM': Source.PositionSource.DEM,
+                'Viking': Source.PositionSource.VIKINGTOPO}
+
+# Fields of the sites with the column of their source in the file
+SOURCE_FIELDS = {'transect_length_source': 'transect_length_source',
+                 'latitude_start_source': 'start_latitude_source',
+                 'longitude_start_source': 'start_longitude_source',
+                 'altitude_start_source': 'start_altitude_source',
+                 'latitude_end_source': 'end_latitude_source',
+                 'longitude_end_source': 'end_longitude_source',
+                 'altitude_end_source': 'end_altitude_source'}
+
+# Fields of the sites that are imported, which are updated with --incremental (see site_from_row)
+SITE_FIELDS = ['area', 'altitude_band', 'transect_length', 'transect_description', 'notes',
+               'latitude_start', 'longitude_start', 'altitude_start',
+               'gps_number_satellites_start', 'gps_accuracy_start', 'gps_aspect_start',
+               'latitude_end', 'longitude_end', 'altitude_end',
+               'gps_number_satellites_end', 'gps_accuracy_end', 'gps_aspect_end'] + list(SOURCE_FIELDS)
 
 
 class Command(BaseCommand):
@@ -10,76 +33,127 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str)
+        add_import_arguments(parser)
 
-    @transaction.atomic
     def handle(self, *args, **options):
         print(options['filename'])
-        self.import_sources()
-        self.import_data_from_csv(options['filename'])
+        self.import_data_from_csv(options['filename'], options)
 
     def import_sources(self):
+        """Return dictionary of the Source of each name of the file, which are created if they do not exist."""
 
-        Source.objects.get_or_create(name=Source.PositionSource.GPS)
-        Source.objects.get_or_create(name=Source.PositionSource.OSMAND)
-        Source.objects.get_or_create(name=Source.PositionSource.DEM)
-        Source.objects.get_or_create(name=Source.PositionSource.VIKINGTOPO)
-
-    def source_string_to_choice(self, source_string):
-        if source_string == 'GPS':
-            name = Source.PositionSource.GPS
-        elif source_string == 'Osmand':
-            name = Source.PositionSource.OSMAND
-        elif source_string == 'DEM':
-            name = Source.PositionSource.DEM
-        elif source_string == 'Viking':
-            name = Source.PositionSource.VIKINGTOPO
-        else:
-            assert False
-
-        return Source.objects.get(name=name)
-
-    def import_data_from_csv(self, filename):
-        with open(filename) as csvfile:
-            reader = csv.DictReader(csvfile)
-
-            for row in reader:
-                site = Site()
-                site.area = row['area']
-                site.site_name = row['sitename']
-                site.altitude_band = row['altitude_band']
-                site.transect_length = row['transect_length']
-                site.transect_description = row['transect_description']
-                site.transect_length_source = self.source_string_to_choice(row['transect_length_source'])
-                site.notes = row['notes']
-
-                site.latitude_start = row['start_latitude']
-                site.longitude_start = row['start_longitude']
-                site.altitude_start = row['start_altitude']
-
-                site.latitude_start_source = self.source_string_to_choice(row['start_latitude_source'])
-                site.longitude_start_source = self.source_string_to_choice(row['start_longitude_source'])
-                site.altitude_start_source = self.source_string_to_choice(row['start_altitude_source'])
-
-                if row['start_number_satellites'] != '':
-                    site.gps_number_satellites_start = row['start_number_satellites']
-                if row['start_gps_accuracy'] != '':
-                    site.gps_accuracy_start = row['start_gps_accuracy']
-                if row['start_orientation'] != '':
-                    site.gps_aspect_start = row['start_orientation']
-
-                site.latitude_end = row['end_latitude']
-                site.longitude_end = row['end_longitude']
-                site.altitude_end = row['end_altitude']
-                
-                site.latitude_end_source = self.source_string_to_choice(row['end_latitude_source'])
-                site.longitude_end_source = self.source_string_to_choice(row['end_longitude_source'])
-                site.altitude_end_source = self.source_string_to_choice(row['end_altitude_source'])
-
-                if row['end_number_satellites'] != '':
-                    site.gps_number_satellites_end = row['end_number_satellites']
-                if row['end_gps_accuracy'] != '':
-                    site.gps_accuracy_end = row['end_gps_accuracy']
-                if row['end_orientation'] != '':
-                    site.gps_aspect_end = row['end_orientation']
-
-                site.save()
\ No newline at end of file
+        return {source_string: Source.objects.get_or_create(name=name)[0] for source_string, name in
+                SOURCE_NAMES.items()}
+
+    def source_string_to_choice(self, source_string, sources):
+        return sources[source_string]
+
+    def prepare_sites(self, rows, incremental=False):
+        """Return list of the unsaved sites of the rows, with their sources, and list of the RowError of the sites that
+        are repeated in the file or already exist (unless it is an incremental import, which updates them)."""
+
+        sources = self.import_sources()
+        sites = []
+        errors = []
+
+        for line_number, row in rows:
+            site = site_from_row(row)
+
+            # converts the values of the fields, which have been validated (see validate_site_row)
+            site.clean_fields(exclude=list(SOURCE_FIELDS))
+
+            for field, column in SOURCE_FIELDS.items():
+                setattr(site, field, self.source_string_to_choice(row[column], sources))
+
+            sites.append((line_number, site))
+
+        site_names = [site.site_name for line_number, site in sites]
+        existing_site_names = set()
+        for i in range(0, len(site_names), IN_QUERY_CHUNK_SIZE):
+            existing_site_names.update(Site.objects.filter(
+                site_name__in=site_names[i:i + IN_QUERY_CHUNK_SIZE]).values_list('site_name', flat=True))
+
+        seen_site_names = set()
+        for line_number, site in sites:
+            if site.site_name in existing_site_names and not incremental:
+                errors.append(RowError(line_number, 'sitename', f"The site {site.site_name} already exists"))
+            elif site.site_name in seen_site_names:
+                errors.append(RowError(line_number, 'sitename', f"The site {site.site_name} is repeated in the file"))
+
+            seen_site_names.add(site.site_name)
+
+        return [site for line_number, site in sites], errors
+
+    def import_data_from_csv(self, filename, options):
+        """Import the sites of the file with the import pipeline (see import_pipeline.run_import): the rows are
+        validated (see validate_site_row) and the sites are written with bulk queries if all of them are valid. With
+        --incremental, the sites that already exist are updated by site name."""
+
+        sites = run_import(filename, options, validate_site_row,
+                           lambda rows: self.prepare_sites(rows, options['incremental']), write_sites,
+                           'import_sites', lambda row: row['sitename'])
+
+        if sites is not None:
+            print(f"Imported {len(sites)} sites")
+
+
+def write_sites(sites):
+    site_ids, created, updated = upsert(Site, sites, ['site_name'], SITE_FIELDS)
+
+    print(f"Sites: {created} created, {updated} updated, {len(sites) - created - updated} unchanged")
+
+
+def site_from_row(row):
+    """Return an unsaved site of the row, without its sources."""
+
+    site = Site()
+    site.area = row['area']
+    site.site_name = row['sitename']
+    site.altitude_band = row['altitude_band']
+    site.transect_length = row['transect_length']
+    site.transect_description = row['transect_description']
+    site.notes = row['notes']
+
+    site.latitude_start = row['start_latitude']
+    site.longitude_start = row['start_longitude']
+    site.altitude_start = row['start_altitude']
+
+    if row['start_number_satellites'] != '':
+        site.gps_number_satellites_start = row['start_number_satellites']
+    if row['start_gps_accuracy'] != '':
+        site.gps_accuracy_start = row['start_gps_accuracy']
+    if row['start_orientation'] != '':
+        site.gps_aspect_start = row['start_orientation']
+
+    site.latitude_end = row['end_latitude']
+    site.longitude_end = row['end_longitude']
+    site.altitude_end = row['end_altitude']
+
+    if row['end_number_satellites'] != '':
+        site.gps_number_satellites_end = row['end_number_satellites']
+    if row['end_gps_accuracy'] != '':
+        site.gps_accuracy_end = row['end_gps_accuracy']
+    if row['end_orientation'] != '':
+        site.gps_aspect_end = row['end_orientation']
+
+    return site
+
+
+def validate_site_row(row):
+    """Return list of (column or field, message) of the errors of a row: unknown sources and the errors of all of the
+    fields of the site (as Model.full_clean(), which converts the values of the fields), except the uniqueness of the
+    site name, which is checked against the database (see Command.prepare_sites)."""
+
+    errors = []
+
+    for column in SOURCE_FIELDS.values():
+        if row[column] not in SOURCE_NAMES:
+            errors.append((column, f'Unknown source: "{row[column]}" (it should be one of {", ".join(SOURCE_NAMES)})'))
+
+    # the sources are Source objects of the database, so they are not validated here
+    try:
+        site_from_row(row).full_clean(exclude=list(SOURCE_FIELDS), validate_unique=False)
+    except ValidationError as error:
+        errors.extend((field, message) for field, messages in error.message_dict.items() for message in messages)
+
+    return errors
@@ -1,85 +1,309 @@
 from django.core.management.base import BaseCommand
-from django.db import transaction
 
-from ...models import TaxonomySpecies, TaxonomyGenus, TaxonomySuborder, TaxonomyFamily, TaxonomyClass, TaxonomyOrder
-import csv
+from ...import_pipeline import RowError, add_import_arguments, run_import
+from ...models import Identification, TaxonomySpecies, TaxonomyGenus, TaxonomySubfamily, TaxonomySuborder, \
+    TaxonomyFamily, TaxonomyClass, TaxonomyOrder
+from ...utils import IN_QUERY_CHUNK_SIZE, QueryCounter
+
+
+class TaxonomyLevel:
+    """A level of the taxonomy that is imported: its column in the file, the model, the field of the name of the
+    taxon, the field of its parent and the path of the name of the parent (as in values()), and the other fields that
+    are imported with the column of each of them."""
+
+    def __init__(self, column, model, name_field, parent_field, parent_name_path, fields=None):
+        self.column = column
+        self.model = model
+        self.name_field = name_field
+        self.parent_field = parent_field
+        self.parent_name_path = parent_name_path
+        self.fields = fields or {}
+
+
+# Levels from the highest to the lowest, so that the parents of each level are written before it. All of the suborders
+# belong to the order Orthoptera.
+TAXONOMY_LEVELS = [TaxonomyLevel('suborder', TaxonomySuborder, 'suborder', 'order', 'order__order'),
+                   TaxonomyLevel('family', TaxonomyFamily, 'family', 'suborder', 'suborder__suborder'),
+                   TaxonomyLevel('subfamily', TaxonomySubfamily, 'subfamily', 'family', 'family__family'),
+                   TaxonomyLevel('genus', TaxonomyGenus, 'genus', 'subfamily', 'subfamily__subfamily'),
+                   TaxonomyLevel('species', TaxonomySpecies, 'latin_name', 'genus', 'genus__genus',
+                                 {'common_name_catalan': 'catalan',
+                                  'common_name_english': 'english',
+                                  'common_name_spanish': 'spanish'})]
+
+ORDER = 'Orthoptera'
 
 
 class Command(BaseCommand):
-    help = 'Adds taxonomy'
+    help = 'Adds or updates the taxonomy from a checklist with the columns suborder, family, subfamily (optional), ' \
+           'genus, species, catalan, english and spanish'
 
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str)
+        parser.add_argument('--dry_run', action='store_true',
+                            help='Print the number of taxa that would be created and updated, without changing the '
+                                 'database')
+        add_import_arguments(parser)
 
-    @transaction.atomic
     def handle(self, *args, **options):
         print(options['filename'])
-        self.import_taxonomy_from_csv(options['filename'])
 
-    def import_species_from_csv(self, row_data, genus):
-        print(row_data)
-        catalan = string_or_none(row_data['catalan'])
-        english = string_or_none(row_data['english'])
-        spanish = string_or_none(row_data['spanish'])
+        with QueryCounter() as queries:
+            self.import_taxonomy_from_csv(options['filename'], options)
 
-        species, created = TaxonomySpecies.objects.get_or_create(genus=genus, latin_name=row_data['species'],
-                                                                 common_name_catalan=catalan,
-                                                                 common_name_english=english,
-                                                                 common_name_spanish=spanish)
+        print(f"{queries.count} queries")
 
-        return species
+    def import_class(self):
+        taxclass, created = TaxonomyClass.objects.get_or_create(taxclass='Insecta')
 
-    def import_genus_from_csv(self, row_data, family):
-        genus, created = TaxonomyGenus.objects.get_or_create(family=family, genus=row_data['genus'])
+        return taxclass
 
-        return genus
+    def import_order(self, taxclass):
+        order, created = TaxonomyOrder.objects.get_or_create(order=ORDER, taxclass=taxclass)
 
-    def import_family_from_csv(self, row_data, suborder):
-        family, created = TaxonomyFamily.objects.get_or_create(suborder=suborder, family=row_data['family'])
+        return order
 
-        return family
+    def import_taxonomy_from_csv(self, filename, options):
+        """Import the taxonomy of the file with the import pipeline (see import_pipeline.run_import): the rows are
+        validated (see validate_taxonomy_row), the taxonomy of the file is compared with the taxonomy of the database
+        (see prepare_taxonomy) and the new and changed taxa of each level are written with bulk queries, unless it is a
+        dry run. The taxa are compared with the database, so the rows are not skipped with --incremental, only the files
+        that have already been imported.
 
-    def import_class(self):
-        taxclass, created = TaxonomyClass.objects.get_or_create(taxclass='Insecta')
+        The taxonomy of the identifications is copied from their taxa (see Identification.save()), so the identifications
+        of the taxa that are moved to another parent are updated in the same transaction (see
+        update_identification_taxonomy)."""
+
+        dry_run = options['dry_run']
+
+        objects = run_import(filename, options, validate_taxonomy_row, prepare_taxonomy,
+                             lambda objects: None if dry_run else self.write_taxonomy(*objects), 'import_taxonomy')
+
+        if objects is None:  # the file has already been imported with --incremental
+            return
+
+        taxonomy, existing_taxonomy, changes = objects
+
+        for level, (created, updated, unchanged, database_only) in zip(TAXONOMY_LEVELS, changes):
+            print(f"{level.column}: {len(created)} {'to create' if dry_run else 'created'}, {len(updated)} "
+                  f"{'to update' if dry_run else 'updated'}, {unchanged} unchanged, {database_only} only in the "
+                  f"database")
+
+    def write_taxonomy(self, taxonomy, existing_taxonomy, changes):
+        parent_ids = {ORDER: self.import_order(self.import_class()).id}
+
+        moved_ids = {}
+
+        for level, (created, updated, unchanged, database_only) in zip(TAXONOMY_LEVELS, changes):
+            parent_ids = write_level(level, taxonomy[level.column], existing_taxonomy[level.column], created, updated,
+                                     parent_ids)
+            moved_ids[level.column] = get_moved_ids(taxonomy[level.column], existing_taxonomy[level.column], updated)
+
+        print(f"Identifications with a moved taxon: {update_identification_taxonomy(moved_ids)} updated")
+
+
+def validate_taxonomy_row(row):
+    """Return list of (column, message) of the errors of a row: a level that is empty when a lower level is not (a row
+    has the taxa of one species, or of one genus, family... if the lower columns are empty). The subfamily is
+    optional."""
+
+    for i, level in enumerate(TAXONOMY_LEVELS):
+        if level.column == 'subfamily' or row[level.column].strip() != '':
+            continue
+
+        if any(row[lower_level.column].strip() for lower_level in TAXONOMY_LEVELS[i + 1:]
+               if lower_level.column in row):
+            return [(level.column, f"{level.column} is missing")]
+
+        break
+
+    return []
+
+
+def prepare_taxonomy(rows):
+    """Return the taxonomy of the rows (see build_taxonomy), the taxonomy of the database (see load_taxonomy) and the
+    changes of each level (see diff_level), and list of the RowError of the taxa with different values in different
+    rows."""
+
+    taxonomy, errors = build_taxonomy(rows)
+
+    existing_taxonomy = load_taxonomy()
+    changes = [diff_level(level, taxonomy[level.column], existing_taxonomy[level.column])
+               for level in TAXONOMY_LEVELS]
+
+    return (taxonomy, existing_taxonomy, changes), errors
+
+
+def build_taxonomy(rows):
+    """
+    Return the taxonomy of the rows in a dictionary of each level (see TAXONOMY_LEVELS) of the taxa of the level: a
+    dictionary of the name of each taxon and its values (the name of its parent with the key 'parent', and the values of
+    the other fields of the level).
+
+    Each row has the taxa of one species (or of one genus, family... if the lower columns are empty). Without a
+    subfamily column, the subfamilies of the genera are not imported.
+
+    Return the taxonomy and a list of the RowError of the taxa with different values in different rows.
+    """
+
+    taxonomy = {level.column: {} for level in TAXONOMY_LEVELS}
+    errors = []
+
+    has_subfamilies = len(rows) > 0 and 'subfamily' in rows[0][1]
+
+    for line_number, row in rows:
+        parent = ORDER
+
+        for level in TAXONOMY_LEVELS:
+            if level.column == 'subfamily' and not has_subfamilies:
+                continue
+
+            name = row[level.column].strip()
+
+            if name == '':
+                if level.column == 'subfamily':  # the genus is not in a subfamily
+                    parent = None
+                    continue
+
+                break
+
+            if parent is None and level.column != 'genus':
+                errors.append(RowError(line_number, level.column, f"{level.column} {name} without a parent"))
+                break
+
+            values = {field: string_or_none(row[column]) for field, column in level.fields.items()}
+
+            if level.column != 'genus' or has_subfamilies:
+                values['parent'] = parent
+
+            if taxonomy[level.column].setdefault(name, values) != values:
+                errors.append(RowError(line_number, level.column, f"{level.column} {name} is {values}, but "
+                                                                  f"{taxonomy[level.column][name]} in a previous row"))
+
+            parent = name
+
+    return taxonomy, errors
+
+
+def load_taxonomy():
+    """Return the taxonomy in the database, as in read_taxonomy, with the id of each taxon with the key 'id' (one query
+    for each level)."""
+
+    taxonomy = {}
+
+    for level in TAXONOMY_LEVELS:
+        fields = list(level.fields)
+        taxa = {}
+
+        for taxon_id, name, parent, *values in level.model.objects.values_list('id', level.name_field,
+                                                                                level.parent_name_path, *fields):
+            taxa[name] = {'id': taxon_id, 'parent': parent, **dict(zip(fields, values))}
+
+        taxonomy[level.column] = taxa
+
+    return taxonomy
+
+
+def diff_level(level, taxa, existing_taxa):
+    """Return the names of the taxa of a level of the file that are not in the database, the names of those that have
+    different values (only the values that are in the file are compared), and the number of taxa that are unchanged and
+    that are only in the database."""
+
+    created = [name for name in taxa if name not in existing_taxa]
+    updated = [name for name, values in taxa.items() if name in existing_taxa and
+               any(existing_taxa[name][key] != value for key, value in values.items())]
+
+    unchanged = len(taxa) - len(created) - len(updated)
+    database_only = len(existing_taxa.keys() - taxa.keys())
+
+    return created, updated, unchanged, database_only
+
+
+def write_level(level, taxa, existing_taxa, created, updated, parent_ids):
+    """Create and update the taxa of a level with bulk queries. parent_ids is a dictionary of the id of each taxon of
+    the parent level by name. Return the dictionary of the ids of the taxa of the level."""
+
+    def get_fields(values):
+        fields = {field: value for field, value in values.items() if field != 'parent'}
+
+        if 'parent' in values:
+            fields[level.parent_field + '_id'] = None if values['parent'] is None else parent_ids[values['parent']]
+
+        return fields
+
+    level.model.objects.bulk_create([level.model(**{level.name_field: name}, **get_fields(taxa[name]))
+                                     for name in created], batch_size=IN_QUERY_CHUNK_SIZE)
+
+    if updated:
+        field_names = [level.parent_field if field == 'parent' else field for field in taxa[updated[0]]]
+
+        level.model.objects.bulk_update([level.model(id=existing_taxa[name]['id'], **get_fields(taxa[name]))
+                                         for name in updated], field_names, batch_size=IN_QUERY_CHUNK_SIZE)
+
+    if created:  # bulk_create does not set the ids of the objects in SQLite
+        return dict(level.model.objects.values_list(level.name_field, 'id'))
+
+    return {name: values['id'] for name, values in existing_taxa.items()}
+
+
+def get_moved_ids(taxa, existing_taxa, updated):
+    """Return list of the ids of the updated taxa of a level that have a different parent in the file."""
+
+    return [existing_taxa[name]['id'] for name in updated
+            if 'parent' in taxa[name] and taxa[name]['parent'] != existing_taxa[name]['parent']]
+
+
+def update_identification_taxonomy(moved_ids):
+    """
+    Set the genus, subfamily, family and suborder of the identifications of the taxa that have been moved to another
+    parent (moved_ids is a dictionary of the ids of the moved taxa of each level, see get_moved_ids) from their lowest
+    taxon, as Identification.save() does. The identifications are written with bulk_update, which also refreshes the
+    resolved identifications of their observations (see IdentificationQuerySet).
+
+    Return the number of identifications that have been updated.
+    """
 
-        taxclass.save()
+    fields = ['species_id', 'genus_id', 'subfamily_id', 'family_id', 'suborder_id']
+    identifications = {}
 
-    def import_order(self):
-        order, created = TaxonomyOrder.objects.get_or_create(order='Orthoptera',
-                                                             taxclass=TaxonomyClass.objects.get(taxclass='Insecta'))
+    for column, taxon_ids in moved_ids.items():
+        for i in range(0, len(taxon_ids), IN_QUERY_CHUNK_SIZE):
+            for values in Identification.objects.filter(
+                    **{f'{column}_id__in': taxon_ids[i:i + IN_QUERY_CHUNK_SIZE]}).values('id', *fields):
+                identifications[values['id']] = values
 
-        order.save()
+    if not identifications:
+        return 0
 
-    def import_taxonomy_from_csv(self, filename):
-        self.import_class()
-        self.import_order()
+    species_genus = dict(TaxonomySpecies.objects.values_list('id', 'genus_id'))
+    genus_subfamily = dict(TaxonomyGenus.objects.values_list('id', 'subfamily_id'))
+    subfamily_family = dict(TaxonomySubfamily.objects.values_list('id', 'family_id'))
+    family_suborder = dict(TaxonomyFamily.objects.values_list('id', 'suborder_id'))
 
-        with open(filename) as csvfile:
-            reader = csv.DictReader(csvfile)
+    updated = []
 
-            for row in reader:
-                suborder, created = TaxonomySuborder.objects.get_or_create(suborder=row['suborder'],
-                                                                           order=TaxonomyOrder.objects.get(
-                                                                               order='Orthoptera'))
-                suborder.save()
+    for values in identifications.values():
+        taxonomy = dict(values)
 
-                family_data = select_columns(row, ["family"])
-                family = self.import_family_from_csv(family_data, suborder)
+        if taxonomy['species_id'] is not None:
+            taxonomy['genus_id'] = species_genus[taxonomy['species_id']]
 
-                genus_data = select_columns(row, ["genus"])
-                genus = self.import_genus_from_csv(genus_data, family)
+        if taxonomy['genus_id'] is not None:
+            taxonomy['subfamily_id'] = genus_subfamily[taxonomy['genus_id']]
 
-                species_data = select_columns(row, ["species", "catalan", "english", "spanish"])
-                self.import_species_from_csv(species_data, genus)
+        if taxonomy['subfamily_id'] is not None:
+            taxonomy['family_id'] = subfamily_family[taxonomy['subfamily_id']]
 
+        if taxonomy['family_id'] is not None:
+            taxonomy['suborder_id'] = family_suborder[taxonomy['family_id']]
 
-def select_columns(row, list_of_columns) -> dict:
-    selected = {}
+        if taxonomy != values:
+            updated.append(Identification(**taxonomy))
 
-    for column_name in list_of_columns:
-        selected[column_name] = row[column_name]
+    Identification.objects.bulk_update(updated, ['genus', 'subfamily', 'family', 'suborder'],
+                                       batch_size=IN_QUERY_CHUNK_SIZE)
 
-    return selected
+    return len(updated)
 
 
 def string_or_none(string):
@@ -88,4 +312,4 @@ def string_or_none(string):
     else:
         output = None
 
-    return output
\ No newline at end of file
+    return output
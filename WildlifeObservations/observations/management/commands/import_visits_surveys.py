@@ -1,8 +1,27 @@
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.utils.dateparse import parse_date, parse_time
 
+from ...import_pipeline import RowError, add_import_arguments, clean_field, run_import, upsert
 from ...models import Visit, Survey, MeteorologyConditions, Site
-import csv
+from ...utils import IN_QUERY_CHUNK_SIZE
+
+METHODS = {'net': Survey.Method.NET,
+           'hand': Survey.Method.HAND}
+
+REPEATS = {'1': Survey.Repeat.ONE,
+           '2': Survey.Repeat.TWO}
+
+# Column of the file of each field of the meteorological conditions that is a number
+MET_CONDITIONS_COLUMNS = {'cloud_coverage_start': 'start_cloud',
+                          'rain_start': 'start_rain',
+                          'wind_start': 'start_wind',
+                          'cloud_coverage_end': 'end_cloud',
+                          'rain_end': 'end_rain',
+                          'wind_end': 'end_wind'}
+
+# Fields of the surveys and meteorological conditions that are imported, which are updated with --incremental
+SURVEY_FIELDS = ['start_time', 'end_time', 'observer']
+MET_CONDITIONS_FIELDS = list(MET_CONDITIONS_COLUMNS) + ['notes']
 
 
 class Command(BaseCommand):
@@ -10,66 +29,234 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str)
+        add_import_arguments(parser)
 
-    @transaction.atomic
     def handle(self, *args, **options):
         print(options['filename'])
-        self.import_visit_from_csv(options['filename'])
+        self.import_visit_from_csv(options['filename'], options)
 
-    def import_met_conditions_from_csv(self, row_data, survey):
+    def import_met_conditions_from_csv(self, row_data, survey_id):
         met_conditions = MeteorologyConditions()
 
-        met_conditions.survey = survey
-        met_conditions.cloud_coverage_start = row_data['start_cloud']
-        met_conditions.rain_start = row_data['start_rain']
-        met_conditions.wind_start = row_data['start_wind']
-        met_conditions.cloud_coverage_end = row_data['end_cloud']
-        met_conditions.rain_end = row_data['end_rain']
-        met_conditions.wind_end = row_data['end_wind']
+        met_conditions.survey_id = survey_id
+        met_conditions.cloud_coverage_start = string_or_none(row_data['start_cloud'])
+        met_conditions.rain_start = string_or_none(row_data['start_rain'])
+        met_conditions.wind_start = string_or_none(row_data['start_wind'])
+        met_conditions.cloud_coverage_end = string_or_none(row_data['end_cloud'])
+        met_conditions.rain_end = string_or_none(row_data['end_rain'])
+        met_conditions.wind_end = string_or_none(row_data['end_wind'])
         met_conditions.notes = row_data['notes']
 
-        met_conditions.save()
-
         return met_conditions
 
-    def import_survey_from_csv(self, row_data, visit):
+    def import_survey_from_csv(self, row_data, visit_id):
+        """Return an unsaved survey of the row. Raise ValueError if the method, repeat or times are not valid."""
+
         survey = Survey()
 
-        survey.visit = visit
-        survey.start_time = row_data['start_time']
-        survey.end_time = row_data['end_time']
-        survey.repeat = row_data['repeat']
+        survey.visit_id = visit_id
+        survey.start_time = parse_time_or_error(row_data['start_time'])
+        survey.end_time = parse_time_or_error(row_data['end_time'])
         survey.observer = 'Jen Thomas' # all of the surveys were done by the same person in this case
 
-        if row_data['method'] == 'net':
-            survey.method = Survey.Method.NET
-        elif row_data['method'] == 'hand':
-            survey.method = Survey.Method.HAND
+        if row_data['method'] not in METHODS:
+            raise ValueError(f"unknown method {row_data['method']}")
+        survey.method = METHODS[row_data['method']]
 
-        if row_data['repeat'] == '1':
-            survey.repeat = Survey.Repeat.ONE
-        elif row_data['repeat'] == '2':
-            survey.repeat = Survey.Repeat.TWO
-
-        survey.save()
+        if row_data['repeat'] not in REPEATS:
+            raise ValueError(f"unknown repeat {row_data['repeat']}")
+        survey.repeat = REPEATS[row_data['repeat']]
 
         return survey
 
-    def import_visit_from_csv(self, filename):
-        with open(filename) as csvfile:
-            reader = csv.DictReader(csvfile)
+    def import_visit_from_csv(self, filename, options):
+        """
+        Import the visits, surveys and meteorological conditions of the file with the import pipeline (see
+        import_pipeline.run_import), with bulk queries.
+
+        Each row is a survey: the visit of its site and date is created if it does not exist. The dates, times, methods,
+        repeats and meteorological conditions of the rows are validated first (see validate_visit_survey_row), then the
+        sites and the unique constraints of the surveys (see prepare_visits). With --incremental, the surveys that
+        already exist (by visit, method and repeat) and their meteorological conditions are updated.
+        """
+
+        run_import(filename, options, validate_visit_survey_row,
+                   lambda rows: self.prepare_visits(rows, options['incremental']), write_visits,
+                   'import_visits_surveys',
+                   lambda row: ' '.join([row['sitename'], row['date'], row['method'], row['repeat']]))
+
+    def prepare_visits(self, rows, incremental=False):
+        """
+        Return list of the unsaved (site id, date, survey, meteorological conditions) of the rows, and list of the
+        RowError of the rows with an unknown site, or a survey that breaks one of the unique constraints of the surveys
+        (one survey of each method and repeat, and one survey at each start time, for each visit) with a previous row
+        or the database. The surveys of an incremental import update the surveys of the database with the same method
+        and repeat.
+
+        The sites and the visits and surveys of the sites are read once.
+        """
+
+        site_ids = dict(Site.objects.filter(
+            site_name__in={row['sitename'] for line_number, row in rows}).values_list('site_name', 'id'))
+        visit_ids = get_visit_ids(site_ids.values())
+
+        start_times = {}  # start time of the survey of each (visit id, method, repeat) in the database
+        start_time_keys = set()
+        for visit_ids_chunk in chunks(list(visit_ids.values())):
+            for visit_id, method, repeat, start_time in Survey.objects.filter(
+                    visit_id__in=visit_ids_chunk).values_list('visit_id', 'method', 'repeat', 'start_time'):
+                start_times[(visit_id, method, repeat)] = start_time
+                start_time_keys.add((visit_id, start_time))
+
+        survey_keys = set()  # (visit, method, repeat) of the surveys of the file
+        surveys = []  # (site id, date, survey, meteorological conditions) of each row
+        errors = []
+
+        for line_number, row in rows:
+            if row['sitename'] not in site_ids:
+                errors.append(RowError(line_number, 'sitename', f"Unknown site {row['sitename']}"))
+                continue
+
+            site_id = site_ids[row['sitename']]
+            date = parse_date(row['date'])
+
+            # new visits do not have an id yet: their surveys are compared by site and date
+            visit_key = visit_ids.get((site_id, date), (site_id, date))
+
+            survey_data = select_columns(row, ["start_time", "end_time", "method", "repeat"])
+            survey = self.import_survey_from_csv(survey_data, None)
+
+            survey_key = (visit_key, survey.method, survey.repeat)
+
+            if survey_key in survey_keys or (survey_key in start_times and not incremental):
+                errors.append(RowError(line_number, 'repeat', f"There is already a survey of {row['sitename']} on "
+                                                              f"{date} with method {survey.method} and repeat "
+                                                              f"{survey.repeat}"))
+                continue
+
+            if survey_key in start_times:  # the survey is updated, so its start time can change
+                start_time_keys.discard((visit_key, start_times.pop(survey_key)))
+
+            if (visit_key, survey.start_time) in start_time_keys:
+                errors.append(RowError(line_number, 'start_time', f"There is already a survey of {row['sitename']} "
+                                                                  f"on {date} at {survey.start_time}"))
+                continue
+
+            survey_keys.add(survey_key)
+            start_time_keys.add((visit_key, survey.start_time))
+
+            met_conditions_data = select_columns(row, ["start_cloud", "start_rain", "start_wind", "end_cloud",
+                                                       "end_rain", "end_wind", "notes"])
+            met_conditions = self.import_met_conditions_from_csv(met_conditions_data, None)
+
+            surveys.append((site_id, date, survey, met_conditions))
+
+        return surveys, errors
+
+
+def validate_visit_survey_row(row):
+    """Return list of (column, message) of the errors of a row that can be found without the database: the date, the
+    times, the method, the repeat and the ranges of the meteorological conditions."""
+
+    errors = []
+
+    for column, parse in (('date', parse_date_or_error), ('start_time', parse_time_or_error),
+                          ('end_time', parse_time_or_error)):
+        try:
+            parse(row[column])
+        except ValueError as error:
+            errors.append((column, str(error)))
+
+    if row['method'] not in METHODS:
+        errors.append(('method', f"unknown method {row['method']}"))
+
+    if row['repeat'] not in REPEATS:
+        errors.append(('repeat', f"unknown repeat {row['repeat']}"))
+
+    for field_name, column in MET_CONDITIONS_COLUMNS.items():
+        if row[column] != '':  # empty meteorological conditions are imported as null
+            clean_field(errors, MeteorologyConditions, field_name, row[column], column)
+
+    return errors
+
+
+def write_visits(surveys):
+    """Write the visits, surveys and meteorological conditions (see Command.prepare_visits) with bulk queries (see
+    import_pipeline.upsert): the visits that do not exist are created, and the surveys and meteorological conditions
+    are created or updated."""
+
+    visits = {(site_id, date): Visit(site_id=site_id, date=date) for site_id, date, survey, met_conditions in surveys}
+    visit_ids, created_visits, updated_visits = upsert(Visit, list(visits.values()), ['site', 'date'], [])
+
+    for site_id, date, survey, met_conditions in surveys:
+        survey.visit_id = visit_ids[(site_id, date)]
+
+    survey_ids, created_surveys, updated_surveys = upsert(
+        Survey, [survey for site_id, date, survey, met_conditions in surveys], ['visit', 'method', 'repeat'],
+        SURVEY_FIELDS)
+
+    for site_id, date, survey, met_conditions in surveys:
+        met_conditions.survey_id = survey_ids[(survey.visit_id, survey.method, survey.repeat)]
+
+    met_conditions_ids, created_met_conditions, updated_met_conditions = upsert(
+        MeteorologyConditions, [met_conditions for site_id, date, survey, met_conditions in surveys], ['survey'],
+        MET_CONDITIONS_FIELDS)
+
+    print(f"Imported {created_visits} visits and {created_surveys} surveys")
+    print(f"Updated {updated_surveys} surveys and {updated_met_conditions} meteorological conditions")
+
+
+def get_visit_ids(site_ids):
+    """Return dictionary of the id of the visit of each (site id, date) of the sites."""
+
+    visit_ids = {}
+
+    for site_ids_chunk in chunks(list(site_ids)):
+        for site_id, date, visit_id in Visit.objects.filter(site_id__in=site_ids_chunk).values_list('site_id', 'date',
+                                                                                                     'id'):
+            visit_ids[(site_id, date)] = visit_id
+
+    return visit_ids
+
+
+def chunks(values):
+    """Return generator of the chunks of the list of values to use in "IN" lookups (see IN_QUERY_CHUNK_SIZE)."""
+
+    for i in range(0, len(values), IN_QUERY_CHUNK_SIZE):
+        yield values[i:i + IN_QUERY_CHUNK_SIZE]
+
+
+def parse_date_or_error(value):
+    try:
+        date = parse_date(value)
+    except ValueError:  # well formatted, but not a valid date
+        date = None
+
+    if date is None:
+        raise ValueError(f"invalid date {value}")
+
+    return date
+
+
+def parse_time_or_error(value):
+    try:
+        time = parse_time(value)
+    except ValueError:  # well formatted, but not a valid time
+        time = None
+
+    if time is None:
+        raise ValueError(f"invalid time {value}")
 
-            for row in reader:
-                visit, created = Visit.objects.get_or_create(site=Site.objects.get(site_name=row['sitename']), date=row['date'])
+    return time
 
-                visit.save()
 
-                survey_data = select_columns(row, ["start_time", "end_time", "method", "repeat"])
-                survey = self.import_survey_from_csv(survey_data, visit)
+def string_or_none(string):
+    if string != '':
+        output = string
+    else:
+        output = None
 
-                met_conditions_data = select_columns(row, ["start_cloud", "start_rain", "start_wind", "end_cloud",
-                                                           "end_rain", "end_wind", "notes"])
-                self.import_met_conditions_from_csv(met_conditions_data, survey)
+    return output
 
 
 def select_columns(row, list_of_columns) -> dict:
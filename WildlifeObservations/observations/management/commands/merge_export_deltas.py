@@ -0,0 +1,32 @@
+import argparse
+
+from django.core.management.base import BaseCommand
+
+from ...exports import merge_delta_csv
+from .export_observations_csv import delta_observations
+from .export_site_metadata_csv import delta_site
+from .export_survey_metadata_csv import delta_survey
+from .export_vegetation_surveys_csv import delta_vegetation_survey
+
+DELTAS = {'observations': delta_observations,
+          'surveys': delta_survey,
+          'sites': delta_site,
+          'vegetation_surveys': delta_vegetation_survey}
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the CSV export of all of the rows of a dataset from a base export and the delta exports (with ' \
+           '--since or --delta) that have been made after it, in order.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=DELTAS.keys(), help='Data of the exports, as in the export_*_csv commands')
+        parser.add_argument('output_file', type=argparse.FileType('w'), help='Path to the file or - for stdout')
+        parser.add_argument('base_file', type=argparse.FileType('r'), help='Export of all of the rows')
+        parser.add_argument('delta_files', type=argparse.FileType('r'), nargs='+',
+                            help='Delta exports, from the oldest to the newest')
+
+    def handle(self, *args, **options):
+        number_rows = merge_delta_csv(options['output_file'], DELTAS[options['dataset']].key, options['base_file'],
+                                      options['delta_files'])
+
+        self.stderr.write(f"Merged {len(options['delta_files'])} deltas: {number_rows} rows")
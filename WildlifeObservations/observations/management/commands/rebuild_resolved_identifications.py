@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...resolved_identifications import rebuild_resolved_identifications
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the resolved (best) identification of every observation from all identifications.'
+
+    def handle(self, *args, **options):
+        number_resolved = rebuild_resolved_identifications()
+
+        print("Number of observations with a resolved identification:", number_resolved)
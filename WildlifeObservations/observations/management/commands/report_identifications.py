@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 
+from ...report_cache import clear_report_cache
 from ...reports import SpeciesReport
 
 
@@ -7,18 +8,27 @@ class Command(BaseCommand):
     help = 'Print reports about observations and identifications'
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument('--no_cache', action='store_true',
+                            help='Calculate the reports from the database without using or storing cached results')
+        parser.add_argument('--clear_cache', action='store_true',
+                            help='Delete all of the cached results of the reports before running them')
 
     def handle(self, *args, **options):
-        species_reports = SpeciesReport()
+        if options['clear_cache']:
+            clear_report_cache()
+
+        species_reports = SpeciesReport(use_cache=not options['no_cache'])
+
+        # all identifications are read once, and the reports are calculated from this snapshot
+        snapshot = species_reports.identification_snapshot()
 
         print("---------- Observations ----------")
 
-        counting_observations = species_reports.observations_count()
+        counting_observations = snapshot.observations_count()
 
         print("Total number of observations:", len(counting_observations))
 
-        counting_suborders = species_reports.observations_suborder()
+        counting_suborders = snapshot.observations_suborder()
 
         print("Caelifera:", len(counting_suborders['Caelifera']), "=",
               100 * (len(counting_suborders['Caelifera']) / len(counting_observations)).__round__(3), "%")
@@ -33,13 +43,13 @@ class Command(BaseCommand):
         print(
             "\nTotal number of observations with finalised identifications (yes, confirmed, cannot identify further, "
             "small nymphs hard to ID):",
-            species_reports.identified_observations_finalised_count())
+            snapshot.identified_observations_finalised_count())
 
-        counting_species_identified = species_reports.identified_observations_to_species()
+        counting_species_identified = snapshot.identified_observations_to_species()
 
         total_identifications_species_unique = species_reports.unique_observations_identified_to_species(counting_species_identified)
 
-        identifications_to_check = species_reports.get_species_from_specimen_label_confidence_set(counting_species_identified, 'Check')
+        identifications_to_check = snapshot.get_species_from_specimen_label_confidence_set(counting_species_identified, 'Check')
         list_identifications_to_check = sorted(identifications_to_check, key=lambda x: x[1])
 
         print("Total number of observations identified to species:", len(total_identifications_species_unique))
@@ -60,7 +70,7 @@ class Command(BaseCommand):
         print("Number of unique observations identified to species, identification MISSING CONFIRMATION:",
               len(counting_species_identified['NoConfirmation']))
 
-        counting_genus_identified = species_reports.identified_observations_to_genus_not_species()
+        counting_genus_identified = snapshot.identified_observations_to_genus_not_species()
 
         print("\nNumber of unique observations only identified to genus:", counting_genus_identified['Total'])
         print("\nNumber of unique observations only identified to genus, identification CONFIRMED:",
@@ -83,11 +93,11 @@ class Command(BaseCommand):
         print("\n---------- Number of each stage identified ----------")
 
         print("\nStages identified:")
-        for identification in species_reports.identifications_stage_count():
+        for identification in snapshot.identifications_stage_count():
             print(identification["stage"], identification["count"])
 
         print("\nStage with confidence:")
-        for identification in species_reports.identifications_stage_confidence_count():
+        for identification in snapshot.identifications_stage_confidence_count():
             if identification["stage"] == "Adult":
                 print(identification["stage"], identification["confidence"], identification["count"])
             elif identification["stage"] == "Nymph":
@@ -1,29 +1,56 @@
+import functools
+
 from django.core.management.base import BaseCommand
 
+from ...report_cache import clear_report_cache
+from ...report_runner import run_report_sections
 from ...reports import SpeciesReport
 
 
+def confirmed_species_section(species_reports, output):
+    print("\n---------- Number of each species identified ----------", file=output)
+
+    number_confirmed_species = species_reports.number_confirmed_species_observed()
+    print("\nTotal number of confirmed species observed: ", number_confirmed_species, file=output)
+
+
+def unconfirmed_species_number_section(species_reports, output):
+    number_unconfirmed_species = len(species_reports.unconfirmed_species_observed())
+    print("Total number of unconfirmed species observed: ", number_unconfirmed_species, file=output)
+
+
+def species_count_section(species_reports, output):
+    for row in species_reports.species_identified_count():
+        print(row["species_name"], row["count"], file=output)
+
+
+def unconfirmed_species_section(species_reports, output):
+    print("\n-Unconfirmed species-", file=output)
+    # TODO - remove the confirmed species from this list
+    for species in species_reports.unconfirmed_species_observed():
+        print(species, file=output)
+
+
 class Command(BaseCommand):
     help = 'Print reports about species'
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument('--no_cache', action='store_true',
+                            help='Calculate the reports from the database without using or storing cached results')
+        parser.add_argument('--clear_cache', action='store_true',
+                            help='Delete all of the cached results of the reports before running them')
+        parser.add_argument('--workers', type=int,
+                            help='Number of sections of the report run at the same time (default: one per section, up '
+                                 'to the number of CPUs)')
 
     def handle(self, *args, **options):
-        species_reports = SpeciesReport()
-
-        print("\n---------- Number of each species identified ----------")
-
-        number_confirmed_species = species_reports.number_confirmed_species_observed()
-        print("\nTotal number of confirmed species observed: ", number_confirmed_species)
+        if options['clear_cache']:
+            clear_report_cache()
 
-        number_unconfirmed_species = len(species_reports.unconfirmed_species_observed())
-        print("Total number of unconfirmed species observed: ", number_unconfirmed_species)
+        species_reports = SpeciesReport(use_cache=not options['no_cache'])
 
-        for row in species_reports.species_identified_count():
-            print(row["species_name"], row["count"])
+        sections = [confirmed_species_section, unconfirmed_species_number_section, species_count_section,
+                    unconfirmed_species_section]
 
-        print("\n-Unconfirmed species-")
-        # TODO - remove the confirmed species from this list
-        for species in species_reports.unconfirmed_species_observed():
-            print(species)
+        run_report_sections([functools.partial(section, species_reports) for section in sections],
+                            options['workers'])
@@ -1,10 +1,40 @@
 import datetime
+import functools
 
 from django.core.management.base import BaseCommand
 
+from ...report_cache import clear_report_cache
+from ...report_runner import run_report_sections
 from ...reports import SurveyReport
 
 
+def suborder_section(survey_reports, survey, survey_name, output):
+    print("\nSummary of suborders observed during this survey (from all identifications):", survey_name, file=output)
+    for suborder, observations in survey_reports.summarise_survey_suborder(survey).items():
+        print(suborder, len(observations), file=output)
+
+
+def taxa_section(survey_reports, survey, survey_name, output):
+    print("\nSummary of confirmed or finalised taxa during this survey:", survey_name, file=output)
+    for taxa, count in survey_reports.summarise_survey_confirmed_finalised_taxa(survey):
+        print(taxa, count, file=output)
+
+
+def observations_section(survey_reports, survey, survey_name, output):
+    print("\nObservations for this survey (number in brackets: number of "
+          "identifications for the observation):", survey_name, file=output)
+    print("Total:", len(survey_reports.list_survey_observations(survey)), file=output)
+    for observation_id_summary in survey_reports.list_observations_count_identifications(survey):
+        print(observation_id_summary['observation'], "(", observation_id_summary['count'], ")", file=output)
+
+
+def identifications_section(survey_reports, survey, survey_name, output):
+    print("\nList of identifications for this survey:", survey_name, file=output)
+    print("Total:", len(survey_reports.list_survey_identifications(survey)), file=output)
+    for row in survey_reports.list_survey_identifications(survey):
+        print(row, file=output)
+
+
 class Command(BaseCommand):
     help = 'Print summary reports about a specified survey'
 
@@ -14,28 +44,26 @@ class Command(BaseCommand):
         parser.add_argument('date', type=datetime.date.fromisoformat, help='Date of survey')
         parser.add_argument('method', type=str, help='Survey method')
         parser.add_argument('repeat', type=int, help='Survey method repeat')
+        parser.add_argument('--no_cache', action='store_true',
+                            help='Calculate the reports from the database without using or storing cached results')
+        parser.add_argument('--clear_cache', action='store_true',
+                            help='Delete all of the cached results of the reports before running them')
+        parser.add_argument('--workers', type=int,
+                            help='Number of sections of the report run at the same time (default: one per section, up '
+                                 'to the number of CPUs)')
 
     def handle(self, *args, **options):
-        survey_reports = SurveyReport()
+        if options['clear_cache']:
+            clear_report_cache()
+
+        survey_reports = SurveyReport(use_cache=not options['no_cache'])
 
         survey = survey_reports.get_survey_object(options['site_name'], options['date'], options['method'],
                                                   options['repeat'])
 
-        print("\nSummary of suborders observed during this survey (from all identifications):", survey)
-        for suborder, observations in survey_reports.summarise_survey_suborder(survey).items():
-            print(suborder, len(observations))
-
-        print("\nSummary of confirmed or finalised taxa during this survey:", survey)
-        for taxa, count in survey_reports.summarise_survey_confirmed_finalised_taxa(survey):
-            print(taxa, count)
+        survey_name = str(survey)
 
-        print("\nObservations for this survey (number in brackets: number of "
-              "identifications for the observation):", survey)
-        print("Total:", len(survey_reports.list_survey_observations(survey)))
-        for observation_id_summary in survey_reports.list_observations_count_identifications(survey):
-            print(observation_id_summary['observation'], "(", observation_id_summary['count'], ")")
+        sections = [functools.partial(section, survey_reports, survey, survey_name) for section in
+                    [suborder_section, taxa_section, observations_section, identifications_section]]
 
-        print("\nList of identifications for this survey:", survey)
-        print("Total:", len(survey_reports.list_survey_identifications(survey)))
-        for row in survey_reports.list_survey_identifications(survey):
-            print(row)
+        run_report_sections(sections, options['workers'])
@@ -1,28 +1,56 @@
+import functools
+
 from django.core.management.base import BaseCommand
 
+from ...report_cache import clear_report_cache
+from ...report_runner import run_report_sections
 from ...reports import VisitReport
 
 
+def sites_section(visit_reports, output):
+    print("\n------------ Sites visited ------------", file=output)
+
+    print("\nTotal number of sites in each area.", file=output)
+    for row in visit_reports.summarise_sites():
+        print(row['area'], row['count'], file=output)
+
+
+def visits_section(visit_reports, output):
+    print("\nTotal number of visits to each site.", file=output)
+    for row in visit_reports.summarise_visits():
+        print(row['site_name'], row["count"], file=output)
+
+
+def suborder_survey_section(visit_reports, unique_specimen_labels, output):
+    print("\nSummary of suborders observed during each survey.", file=output)
+    for row in visit_reports.summarise_suborder_survey(unique_specimen_labels):
+        print(row['survey'], 'Caelifera:', row['Caelifera'], 'Ensifera:', row['Ensifera'], 'Unknown:',
+              row['observations_not_identified'], file=output)
+
+
 class Command(BaseCommand):
     help = 'Print reports about visits and sites'
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument('--unique_specimen_labels', action='store_true',
+                            help='Count observations (unique specimen labels) of each suborder instead of '
+                                 'identifications')
+        parser.add_argument('--no_cache', action='store_true',
+                            help='Calculate the reports from the database without using or storing cached results')
+        parser.add_argument('--clear_cache', action='store_true',
+                            help='Delete all of the cached results of the reports before running them')
+        parser.add_argument('--workers', type=int,
+                            help='Number of sections of the report run at the same time (default: one per section, up '
+                                 'to the number of CPUs)')
 
     def handle(self, *args, **options):
-        visit_reports = VisitReport()
-
-        print("\n------------ Sites visited ------------")
-
-        print("\nTotal number of sites in each area.")
-        for row in visit_reports.summarise_sites():
-            print(row['area'], row['count'])
+        if options['clear_cache']:
+            clear_report_cache()
 
-        print("\nTotal number of visits to each site.")
-        for row in visit_reports.summarise_visits():
-            print(row['site_name'], row["count"])
+        visit_reports = VisitReport(use_cache=not options['no_cache'])
 
-        print("\nSummary of suborders observed during each survey.")
-        for row in visit_reports.summarise_suborder_survey():
-            print(row['survey'], 'Caelifera:', row['Caelifera'], 'Ensifera:', row['Ensifera'], 'Unknown:', row['observations_not_identified'])
+        sections = [functools.partial(sites_section, visit_reports),
+                    functools.partial(visits_section, visit_reports),
+                    functools.partial(suborder_survey_section, visit_reports, options['unique_specimen_labels'])]
 
+        run_report_sections(sections, options['workers'])
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.11 on 2026-10-18 16:22
+
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, Value, When
+import django.db.models.deletion
+import django.utils.timezone
+
+# Confidences from the most to the least certain, and the fields of the taxon of each rank from the lowest to the
+# highest, as in resolved_identifications when this migration was written. The app code is not imported so that this
+# migration does not change when it changes.
+CONFIDENCE_PRECEDENCE = ['Confirmed', 'Finalised', 'Check_in_museum', 'Review', 'Check', 'Redo', 'In_progress']
+TAXON_RANKS = [('Species', 'species__latin_name'),
+               ('Genus', 'genus__genus'),
+               ('Subfamily', 'subfamily__subfamily'),
+               ('Family', 'family__family'),
+               ('Suborder', 'suborder__suborder')]
+
+
+def populate_resolved_identifications(apps, schema_editor):
+    Identification = apps.get_model('observations', 'Identification')
+    ResolvedIdentification = apps.get_model('observations', 'ResolvedIdentification')
+
+    # identifications without a confidence have the lowest rank
+    rank = Case(*[When(confidence=confidence, then=Value(i)) for i, confidence in enumerate(CONFIDENCE_PRECEDENCE)],
+                default=Value(len(CONFIDENCE_PRECEDENCE)), output_field=IntegerField())
+
+    identifications = Identification.objects.annotate(rank=rank).order_by('observation_id', 'rank', 'id').values(
+        'id', 'observation_id', 'confidence', 'sex', 'stage', *[field for taxon_rank, field in TAXON_RANKS])
+
+    batch = []
+    previous_observation_id = None
+
+    for identification in identifications.iterator():
+        if identification['observation_id'] == previous_observation_id:  # only the best identification of each
+            # observation is resolved
+            continue
+
+        previous_observation_id = identification['observation_id']
+
+        taxon, taxon_rank = next(((identification[field], rank_name) for rank_name, field in TAXON_RANKS
+                                  if identification[field] is not None), (None, None))
+
+        batch.append(ResolvedIdentification(observation_id=identification['observation_id'],
+                                            identification_id=identification['id'],
+                                            confidence=identification['confidence'], taxon=taxon,
+                                            taxon_rank=taxon_rank, sex=identification['sex'],
+                                            stage=identification['stage']))
+
+        if len(batch) == 500:
+            ResolvedIdentification.objects.bulk_create(batch)
+            batch = []
+
+    ResolvedIdentification.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0019_auto_20220517_0931'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResolvedIdentification',
+            fields=[
+                ('observation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='observations.observation')),
+                ('confidence', models.CharField(blank=True, choices=[('In_progress', 'In progress'), ('Check', 'Check'), ('Check_in_museum', 'Check in museum'), ('Confirmed', 'Confirmed'), ('Redo', 'Redo'), ('Review', 'Review'), ('Finalised', 'Finalised')], db_index=True, max_length=30, null=True)),
+                ('taxon', models.CharField(blank=True, max_length=255, null=True)),
+                ('taxon_rank', models.CharField(blank=True, choices=[('Species', 'Species'), ('Genus', 'Genus'), ('Subfamily', 'Subfamily'), ('Family', 'Family'), ('Suborder', 'Suborder')], max_length=10, null=True)),
+                ('sex', models.CharField(blank=True, choices=[('Male', 'Male'), ('Female', 'Female'), ('Unknown', 'Unknown')], max_length=7, null=True)),
+                ('stage', models.CharField(blank=True, choices=[('Adult', 'Adult'), ('Nymph', 'Nymph'), ('Unknown', 'Unknown')], max_length=7, null=True)),
+                ('updated_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('identification', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='observations.identification')),
+            ],
+        ),
+        migrations.RunPython(populate_resolved_identifications, migrations.RunPython.noop),
+    ]
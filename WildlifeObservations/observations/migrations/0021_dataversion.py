@@ -0,0 +1,23 @@
+# Generated by Django 3.2.11 on 2026-10-18 16:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0020_resolvedidentification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, unique=True)),
+                ('version', models.IntegerField(default=0)),
+                ('updated_on', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
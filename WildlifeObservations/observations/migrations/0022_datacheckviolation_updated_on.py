@@ -0,0 +1,59 @@
+# Generated by Django 3.2.11 on 2026-10-18 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0021_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataCheckWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=20, unique=True)),
+                ('checked_until', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='identification',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='meteorologyconditions',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='observation',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='survey',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='DataCheckViolation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_check', models.CharField(max_length=100)),
+                ('result', models.TextField()),
+                ('opened_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('closed_on', models.DateTimeField(blank=True, null=True)),
+                ('observation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='observations.observation')),
+                ('survey', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='observations.survey')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='datacheckviolation',
+            index=models.Index(fields=['data_check', 'closed_on'], name='observation_data_ch_3540b0_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0023_exportwatermark_updated_on'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=50)),
+                ('file_hash', models.CharField(max_length=64)),
+                ('filename', models.CharField(max_length=1024)),
+                ('last_line', models.IntegerField(default=1)),
+                ('finished', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importcheckpoint',
+            constraint=models.UniqueConstraint(fields=('command', 'file_hash'), name='observations_importcheckpoint_command_file_hash_unique_relationships'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0024_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=50)),
+                ('key', models.CharField(max_length=255)),
+                ('row_hash', models.CharField(max_length=64)),
+                ('imported_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importedrow',
+            constraint=models.UniqueConstraint(fields=('command', 'key'), name='observations_importedrow_command_key_unique_relationships'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('observations', '0025_importedrow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importedrow',
+            name='identification',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='observations.identification'),
+        ),
+    ]
@@ -1,10 +1,58 @@
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import F, Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .utils import IN_QUERY_CHUNK_SIZE
+
+
+class DataVersion(models.Model):
+    # Version of the data of a model, increased whenever its rows change. It is used to invalidate cached reports.
+    model = models.CharField(max_length=100, unique=True)
+    version = models.IntegerField(default=0)
+    updated_on = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} ({})".format(self.model, self.version)
+
+    @classmethod
+    def bump(cls, *model_classes):
+        for model_class in model_classes:
+            # get_or_create() handles a concurrent creation of the row, and the version is increased in the database
+            cls.objects.get_or_create(model=model_class._meta.label)
+            cls.objects.filter(model=model_class._meta.label).update(version=F('version') + 1,
+                                                                     updated_on=timezone.now())
+
+    @classmethod
+    def versions(cls, model_classes):
+        labels = [model_class._meta.label for model_class in model_classes]
+        versions = dict(cls.objects.filter(model__in=labels).values_list('model', 'version'))
+
+        return tuple(versions.get(label, 0) for label in labels)
+
+
+class VersionedQuerySet(models.QuerySet):
+    # Updates and bulk creations do not send signals, so the data version of the model is increased here (bulk_update()
+    # uses update()). Updates do not call save() either, so the updated_on field of the rows is set here if the model has
+    # one (bulk_create() sets it).
+
+    def update(self, **kwargs):
+        if 'updated_on' not in kwargs and any(field.name == 'updated_on' for field in self.model._meta.concrete_fields):
+            kwargs['updated_on'] = timezone.now()
+
+        rows = super().update(**kwargs)
+        DataVersion.bump(self.model)
+
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        DataVersion.bump(self.model)
+
+        return objs
+
 
 class Source(models.Model):
     class PositionSource(models.TextChoices):
@@ -54,6 +102,9 @@ class Site(models.Model):
     notes = models.TextField(max_length=2048, default='', blank=True)
 
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to export only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return "{} ({}m)".format(self.site_name, self.altitude_band)
@@ -63,6 +114,9 @@ class Visit(models.Model):
     site = models.ForeignKey(Site, on_delete=models.PROTECT)
     date = models.DateField()
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to export only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     class Meta:
         constraints = [models.UniqueConstraint(
@@ -89,6 +143,9 @@ class Survey(models.Model):
     repeat = models.IntegerField(choices=Repeat.choices)
     observer = models.CharField(max_length=100)
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to check only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return "{} {} {}".format(self.visit, self.method, self.repeat)
@@ -113,6 +170,9 @@ class MeteorologyConditions(models.Model):
     rain_end = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0)])
     notes = models.TextField(max_length=2048, default='', blank=True)
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to check only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return "{}".format(self.survey)
@@ -149,6 +209,9 @@ class Observation(models.Model):
     status = models.CharField(max_length=10, choices=Status.choices)
     notes = models.TextField(max_length=1024, null=True, blank=True)
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to check only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return "{}".format(self.specimen_label)
@@ -251,7 +314,97 @@ class IdentificationGuide(models.Model):
         return "{} - {}".format(self.author, self.title)
 
 
+def touch_observations(observation_ids):
+    """Set the updated_on of the observations, when their identifications have been moved or deleted."""
+
+    observation_ids = list(observation_ids)
+
+    for i in range(0, len(observation_ids), IN_QUERY_CHUNK_SIZE):
+        Observation.objects.filter(id__in=observation_ids[i:i + IN_QUERY_CHUNK_SIZE]).update(updated_on=timezone.now())
+
+
+class IdentificationQuerySet(VersionedQuerySet):
+    # Updates and bulk creations do not call save() or send signals, so the resolved identifications of the observations
+    # that are affected are refreshed here.
+
+    def update(self, **kwargs):
+        from .resolved_identifications import refresh_resolved_identifications
+
+        with transaction.atomic(using=self.db):
+            observation_ids = set(self.values_list('observation_id', flat=True))
+            rows = super().update(**kwargs)
+
+            if 'observation' in kwargs:  # the identifications have been moved: the previous observations have changed
+                touch_observations(observation_ids)
+
+            if isinstance(kwargs.get('observation'), models.Model):
+                observation_ids.add(kwargs['observation'].pk)
+
+            refresh_resolved_identifications(observation_ids)
+
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .resolved_identifications import refresh_resolved_identifications
+
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            refresh_resolved_identifications([obj.observation_id for obj in objs])
+
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .resolved_identifications import refresh_resolved_identifications
+
+        with transaction.atomic(using=self.db):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)  # update() refreshes the previous observations
+
+            if 'observation' in fields:
+                refresh_resolved_identifications([obj.observation_id for obj in objs])
+
+        return rows
+
+
+# Confidence reasons that are allowed for each confidence of an identification. The check constraint of the
+# identifications is built from them (which also allows identifications without a confidence or a confidence reason),
+# and they are used to validate imports before writing them.
+CONFIDENCE_REASONS = {'Confirmed': ['Small_nymph_hard_to_ID', 'Cannot_determine_further', 'ID_certain'],
+                      'Check': ['ID_needs_confirmation'],
+                      'Check_in_museum': ['ID_needs_confirmation'],
+                      'In_progress': ['ID_incomplete'],
+                      'Review': ['ID_uncertain'],
+                      'Redo': ['ID_incorrect'],
+                      'Finalised': ['Cannot_split_further']}
+
+
+def confidence_reasons_check(confidence_reasons):
+    """Return Q of the combinations of confidence and confidence reason that are allowed, with one condition for each
+    list of reasons (and the confidences that have it), in the order of confidence_reasons."""
+
+    confidences_of_reasons = {}
+    for confidence, reasons in confidence_reasons.items():
+        confidences_of_reasons.setdefault(tuple(reasons), []).append(confidence)
+
+    check = Q()
+    for reasons, confidences in confidences_of_reasons.items():
+        if len(confidences) == 1:
+            confidence_condition = Q(confidence=confidences[0])
+        else:
+            confidence_condition = Q(confidence__in=tuple(confidences))
+
+        if len(reasons) == 1:
+            reason_condition = Q(confidence_reason=reasons[0])
+        else:
+            reason_condition = Q(confidence_reason__in=reasons)
+
+        check |= Q(confidence_condition & reason_condition)
+
+    return check
+
+
 class Identification(models.Model):
+    CONFIDENCE_REASONS = CONFIDENCE_REASONS
+
     class Sex(models.TextChoices):
         MALE = 'Male', _('Male')
         FEMALE = 'Female', _('Female')
@@ -297,6 +450,9 @@ class Identification(models.Model):
     notebook = models.CharField(max_length=10)
     comments = models.TextField(max_length=1000, null=True, blank=True)
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to check only the changed data
+
+    objects = IdentificationQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
         if self.species is not None:
@@ -323,21 +479,122 @@ class Identification(models.Model):
 
             # add constraints to ensure only allowed combinations of confidence and confidence reason
             models.CheckConstraint(name="%(app_label)s_%(class)s_check_confidence_reasons",
-                                   check=Q(Q(confidence='Confirmed') & Q(confidence_reason__in=(
-                                   'Small_nymph_hard_to_ID', 'Cannot_determine_further', 'ID_certain')))
-                                         | Q(Q(confidence__in=('Check', 'Check_in_museum')) &
-                                           Q(confidence_reason='ID_needs_confirmation'))
-                                         | Q(Q(confidence='In_progress') & Q(confidence_reason='ID_incomplete'))
-                                         | Q(Q(confidence='Review') & Q(confidence_reason='ID_uncertain'))
-                                         | Q(Q(confidence='Redo') & Q(confidence_reason='ID_incorrect'))
-                                         | Q(Q(confidence='Finalised') & Q(confidence_reason='Cannot_split_further'))
-                                   )]
+                                   check=confidence_reasons_check(CONFIDENCE_REASONS))]
+
+
+class ResolvedIdentification(models.Model):
+    # Denormalised "best" identification of each observation, maintained from the identifications by
+    # resolved_identifications.py. It should not be edited directly.
+    class TaxonRank(models.TextChoices):
+        SPECIES = 'Species', _('Species')
+        GENUS = 'Genus', _('Genus')
+        SUBFAMILY = 'Subfamily', _('Subfamily')
+        FAMILY = 'Family', _('Family')
+        SUBORDER = 'Suborder', _('Suborder')
+
+    observation = models.OneToOneField(Observation, on_delete=models.CASCADE, primary_key=True)
+    identification = models.OneToOneField(Identification, on_delete=models.CASCADE)
+    confidence = models.CharField(max_length=30, choices=Identification.Confidence.choices, null=True, blank=True,
+                                  db_index=True)
+    taxon = models.CharField(max_length=255, null=True, blank=True)
+    taxon_rank = models.CharField(max_length=10, choices=TaxonRank.choices, null=True, blank=True)
+    sex = models.CharField(max_length=7, choices=Identification.Sex.choices, null=True, blank=True)
+    stage = models.CharField(max_length=7, choices=Identification.Stage.choices, null=True, blank=True)
+    updated_on = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} - {} [{}]".format(self.observation, self.taxon, self.confidence)
+
+
+class DataCheckViolation(models.Model):
+    # Result of a data check (see data_integrity_checks.DATA_CHECKS) that is kept by the incremental data checks. It is
+    # closed when the data has been corrected. The violations of deleted observations and surveys are deleted with them.
+    data_check = models.CharField(max_length=100)
+    observation = models.ForeignKey(Observation, on_delete=models.CASCADE, null=True, blank=True)
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, null=True, blank=True)
+    result = models.TextField()  # as printed by the data check
+    opened_on = models.DateTimeField(default=timezone.now)
+    closed_on = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "{}: {}".format(self.data_check, self.result)
+
+    class Meta:
+        indexes = [models.Index(fields=['data_check', 'closed_on'])]
+
+
+class DataCheckWatermark(models.Model):
+    # Time of the start of the last incremental run of the data checks of a scope (identifications, observations or
+    # surveys). The next run only checks the data that has been updated after it.
+    scope = models.CharField(max_length=20, unique=True)
+    checked_until = models.DateTimeField()
+
+    def __str__(self):
+        return "{} ({})".format(self.scope, self.checked_until)
+
+
+class ExportWatermark(models.Model):
+    # Time of the start of the last export of a dataset (see exports.ExportDelta) with the watermark, and the keys of the
+    # rows that were exported, as lists of strings. The next delta export only exports the rows that have been updated
+    # after it, and tombstones for the keys that are no longer exported.
+    dataset = models.CharField(max_length=30, unique=True)
+    practice_sites = models.JSONField(default=list)  # site names, sorted: the deltas are for the same practice sites
+    exported_until = models.DateTimeField()
+    keys = models.JSONField(default=list)
+
+    def __str__(self):
+        return "{} ({})".format(self.dataset, self.exported_until)
+
+
+class ImportCheckpoint(models.Model):
+    # Progress of an import that commits the rows of a file in chunks (see import_pipeline.run_chunked_import): the last
+    # line of the file that has been committed. The file is identified by its SHA-256 checksum, so that an import is only
+    # resumed with the same file. The imports with --incremental save a finished checkpoint of each file that they
+    # import, so that the file is skipped if it is imported again without changes.
+    command = models.CharField(max_length=50)
+    file_hash = models.CharField(max_length=64)
+    filename = models.CharField(max_length=1024)  # as given in the first run of the import
+    last_line = models.IntegerField(default=1)  # line 1 is the header
+    finished = models.BooleanField(default=False)
+    created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{} {} (line {})".format(self.command, self.filename, self.last_line)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            name="%(app_label)s_%(class)s_command_file_hash_unique_relationships",
+            fields=['command', 'file_hash'])]
+
+
+class ImportedRow(models.Model):
+    # SHA-256 checksum of the values of the last version of each row that has been imported by an import command with
+    # --incremental (see import_pipeline.run_import), by the natural key of the row (e.g. the specimen label). The rows
+    # with the same checksum are skipped when they are imported again.
+    command = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    row_hash = models.CharField(max_length=64)
+    # identification written from the row by import_obs_ids, which is updated when the row changes
+    identification = models.ForeignKey(Identification, on_delete=models.SET_NULL, null=True, blank=True)
+    imported_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{} {}".format(self.command, self.key)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            name="%(app_label)s_%(class)s_command_key_unique_relationships",
+            fields=['command', 'key'])]
 
 
 class Plot(models.Model):
     visit = models.ForeignKey(Visit, on_delete=models.PROTECT)
     position = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)])
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to export only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return "{} ({}m)".format(self.visit, self.position)
@@ -362,6 +619,9 @@ class VegetationStructure(models.Model):
     density_05 = models.IntegerField(validators=[MinValueValidator(0)])
     notes = models.TextField(max_length=2048, default='', blank=True)
     created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True, db_index=True)  # used to export only the changed data
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return "{}".format(self.plot)
@@ -0,0 +1,74 @@
+import functools
+import hashlib
+
+from django.core.cache import caches
+from django.db import connection, models
+
+from .models import DataVersion, Identification, Observation, Site, Survey, Visit
+
+# Cache (see CACHES in the settings) where the results of the reports are stored.
+REPORT_CACHE_ALIAS = 'reports'
+
+# Models whose data is used by the reports: a cached result is only used if none of them has changed since.
+REPORT_DATA_MODELS = [Identification, Observation, Survey, Visit, Site]
+
+_MISSING = object()
+
+
+def key_part(value):
+    """Return a representation of an argument of a report method that is the same for equal values in any process:
+    model objects are represented by their primary key and sets and dictionaries are sorted."""
+
+    if isinstance(value, models.Model):
+        return value._meta.label, value.pk
+    elif isinstance(value, (set, frozenset)):
+        return sorted(repr(key_part(element)) for element in value)
+    elif isinstance(value, dict):
+        return sorted((repr(key_part(key)), key_part(element)) for key, element in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [key_part(element) for element in value]
+    else:
+        return repr(value)
+
+
+def report_cache_key(method, args, kwargs):
+    """Return the cache key of a call of a report method, from the database, the method, its arguments and the current
+    version of the data of REPORT_DATA_MODELS."""
+
+    versions = DataVersion.versions(REPORT_DATA_MODELS)
+    key = repr((str(connection.settings_dict['NAME']), method.__module__, method.__qualname__, key_part(args),
+                key_part(kwargs), versions))
+
+    return 'report:' + hashlib.sha1(key.encode()).hexdigest()
+
+
+def cached_report(method):
+    """Decorator for the methods of the report classes: the result is stored in the reports cache and returned by
+    later calls with the same arguments, until the data of REPORT_DATA_MODELS changes.
+
+    The cache is not used if the report object has use_cache set to False.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.use_cache:
+            return method(self, *args, **kwargs)
+
+        cache = caches[REPORT_CACHE_ALIAS]
+        key = report_cache_key(method, args, kwargs)
+
+        result = cache.get(key, _MISSING)
+
+        if result is _MISSING:
+            result = method(self, *args, **kwargs)
+            cache.set(key, result, timeout=None)
+
+        return result
+
+    return wrapper
+
+
+def clear_report_cache():
+    """Delete all of the cached results of the reports."""
+
+    caches[REPORT_CACHE_ALIAS].clear()
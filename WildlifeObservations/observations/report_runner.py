@@ -0,0 +1,50 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+
+def run_section(section):
+    """Run a section of a report: a function that writes its output to the stream that it gets as argument. Return the
+    output of the section as a string."""
+
+    output = io.StringIO()
+    section(output)
+
+    return output.getvalue()
+
+
+def run_section_in_thread(section):
+    """Run a section of a report (see run_section) in a thread of the pool. Django opens a database connection for each
+    thread, which is closed when the section has finished."""
+
+    try:
+        return run_section(section)
+    finally:
+        connections.close_all()
+
+
+def run_report_sections(sections, workers=None):
+    """Run the independent sections of a report at the same time, each in a thread with its own database connection,
+    and print their output in the order of the sections. The output of each section is printed as soon as it and the
+    sections before it have finished.
+
+    By default, there is one thread per section, up to the number of CPUs. With one worker, the sections are run one
+    after the other in the current thread.
+    """
+
+    if workers is None:
+        workers = min(len(sections), os.cpu_count() or 1)
+
+    if workers <= 1:
+        for section in sections:
+            print(run_section(section), end='')
+
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_section_in_thread, section) for section in sections]
+
+        for future in futures:
+            print(future.result(), end='')
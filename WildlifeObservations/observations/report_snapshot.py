@@ -0,0 +1,237 @@
+import collections
+from array import array
+
+from .models import Identification, Observation, TaxonomyGenus, TaxonomySpecies, TaxonomySuborder
+from .resolved_identifications import CONFIDENCE_PRECEDENCE
+
+# Confidence code (small integer) of each confidence, which is its rank in CONFIDENCE_PRECEDENCE: 0 is the most certain
+# and the last one is no confidence.
+CONFIDENCE_CODES = {confidence: rank for rank, (key, confidence) in enumerate(CONFIDENCE_PRECEDENCE)}
+
+# Confidences of the identifications counted as "finalised" in identified_observations_finalised_count
+FINALISED_CONFIDENCES = [Identification.Confidence.CONFIRMED, Identification.Confidence.FINALISED,
+                         Identification.Confidence.REVIEW]
+
+NONE = -1  # code of a missing taxon
+
+
+class IdentificationSnapshot:
+    """All of the identifications and observations, loaded once from the database into compact columns so that the
+    reports of report_identifications can be calculated in memory, without reading the tables again.
+
+    Each identification is a position in the columns, in the order of the identifications in the database:
+    - observations: position of the observation of the identification in specimen_labels
+    - species, genera, suborders: taxon of the identification, as the position of its name in species_names,
+      genus_names or suborder_names, or NONE
+    - confidences: code of the confidence (see CONFIDENCE_CODES)
+    - stages: position of the stage in stage_names
+
+    The columns use 4 bytes (taxa and observations) or 1 byte (confidence and stage) for each identification, which is
+    18 bytes per identification, plus one specimen label string (about 70 bytes) per observation and the taxon names.
+    For example, 100,000 identifications of 50,000 observations use about 6 MB, plus a dictionary of the observation
+    ids of a similar size while loading. The identifications are read with an iterator, so no model objects are kept
+    in memory.
+
+    The results of the methods are the same as those of the SpeciesReport methods with the same names.
+    """
+
+    def __init__(self):
+        self.specimen_labels = []
+        self.species_names = []
+        self.genus_names = []
+        self.suborder_names = []
+        self.stage_names = []
+
+        self.observations = array('i')
+        self.species = array('i')
+        self.genera = array('i')
+        self.suborders = array('i')
+        self.confidences = array('b')
+        self.stages = array('b')
+
+    @classmethod
+    def load(cls):
+        """Return a snapshot of the current identifications and observations (five queries)."""
+
+        snapshot = cls()
+
+        observation_positions = {}
+        for observation_id, specimen_label in Observation.objects.order_by('id').values_list('id', 'specimen_label'):
+            observation_positions[observation_id] = len(snapshot.specimen_labels)
+            snapshot.specimen_labels.append(specimen_label)
+
+        species_names = dict(TaxonomySpecies.objects.values_list('id', 'latin_name'))
+        genus_names = dict(TaxonomyGenus.objects.values_list('id', 'genus'))
+        suborder_names = dict(TaxonomySuborder.objects.values_list('id', 'suborder'))
+
+        species_codes = {}
+        genus_codes = {}
+        suborder_codes = {}
+        stage_codes = {}
+
+        identifications = Identification.objects.order_by('id').values_list(
+            'observation_id', 'species_id', 'genus_id', 'suborder_id', 'confidence', 'stage')
+
+        for observation_id, species_id, genus_id, suborder_id, confidence, stage in identifications.iterator():
+            snapshot.observations.append(observation_positions[observation_id])
+            snapshot.species.append(intern_taxon(species_codes, snapshot.species_names, species_id, species_names))
+            snapshot.genera.append(intern_taxon(genus_codes, snapshot.genus_names, genus_id, genus_names))
+            snapshot.suborders.append(intern_taxon(suborder_codes, snapshot.suborder_names, suborder_id,
+                                                   suborder_names))
+            snapshot.confidences.append(CONFIDENCE_CODES[confidence])
+            snapshot.stages.append(intern(stage_codes, snapshot.stage_names, stage, stage))
+
+        return snapshot
+
+    def __len__(self):
+        return len(self.observations)
+
+    def observations_count(self):
+        """Return set of individual observations made."""
+
+        return set(self.specimen_labels)
+
+    def observations_suborder(self):
+        """Return dictionary of the sets of observations of each suborder, using the first identification of each
+        observation (see SpeciesReport.observations_suborder)."""
+
+        observations_seen = set()
+
+        c = set()
+        e = set()
+        todo = set()
+
+        for i in range(len(self)):
+            observation = self.observations[i]
+
+            if observation in observations_seen:
+                continue
+
+            observations_seen.add(observation)
+
+            specimen_label = self.specimen_labels[observation]
+
+            if self.suborders[i] == NONE:
+                todo.add(specimen_label)
+            elif self.suborder_names[self.suborders[i]] == 'Caelifera':
+                c.add(specimen_label)
+            elif self.suborder_names[self.suborders[i]] == 'Ensifera':
+                e.add(specimen_label)
+            else:
+                assert False
+
+        return {'Caelifera': c, 'Ensifera': e, 'todo': todo}
+
+    def identified_observations_finalised_count(self):
+        """Return total number (integer) of individual (unique) observations that have a confirmed, finalised or review
+        identification."""
+
+        finalised_codes = {CONFIDENCE_CODES[confidence] for confidence in FINALISED_CONFIDENCES}
+
+        observations = {self.observations[i] for i in range(len(self)) if self.confidences[i] in finalised_codes}
+
+        return len(observations)
+
+    def resolve_observations_confidence(self, selected):
+        """Return dictionary of sets of the specimen labels of the observations of the selected identifications (a
+        function of the position of the identification), where each observation is placed in the set of the most
+        certain confidence of its identifications (see reports.resolve_observations_confidence)."""
+
+        best_codes = {}
+
+        for i in range(len(self)):
+            if not selected(i):
+                continue
+
+            observation = self.observations[i]
+            best_codes[observation] = min(best_codes.get(observation, self.confidences[i]), self.confidences[i])
+
+        resolved = {key: set() for key, confidence in CONFIDENCE_PRECEDENCE}
+
+        for observation in sorted(best_codes, key=lambda observation: self.specimen_labels[observation]):
+            resolved[CONFIDENCE_PRECEDENCE[best_codes[observation]][0]].add(self.specimen_labels[observation])
+
+        return resolved
+
+    def identified_observations_to_species(self):
+        """Return dictionary of individual observations identified to species, with details of the confidence of the
+        identification."""
+
+        return self.resolve_observations_confidence(lambda i: self.species[i] != NONE)
+
+    def identified_observations_to_genus_not_species(self):
+        """Return dictionary of observations that have been identified to genus, not species, with details of
+        confidence."""
+
+        resolved = self.resolve_observations_confidence(lambda i: self.genera[i] != NONE and self.species[i] == NONE)
+
+        total_unique_observations_genus = sum(len(specimen_labels) for specimen_labels in resolved.values())
+
+        return {'Total': total_unique_observations_genus, **resolved,
+                'MissingConfirmation': resolved['NoConfirmation']}
+
+    def get_species_from_specimen_label_confidence_set(self, dict_set_specimen_labels, confidence):
+        """Return set of (specimen label, species) of the identifications with the specified confidence, of the
+        observations in the set of this confidence in the dictionary.
+
+        The confidence should be as written in the Identification model."""
+
+        keys = {confidence: key for key, confidence in CONFIDENCE_PRECEDENCE}
+        set_specimen_labels = dict_set_specimen_labels[keys[confidence]]
+        code = CONFIDENCE_CODES[confidence]
+
+        unique_identifications = set()
+
+        for i in range(len(self)):
+            specimen_label = self.specimen_labels[self.observations[i]]
+
+            if self.confidences[i] == code and specimen_label in set_specimen_labels:
+                species = self.species_names[self.species[i]] if self.species[i] != NONE else None
+                unique_identifications.add((specimen_label, species))
+
+        return unique_identifications
+
+    def identifications_stage_count(self):
+        """Return list of dictionaries of count of identifications of each stage, ordered by stage."""
+
+        counter = collections.Counter(self.stage_names[stage] for stage in self.stages)
+
+        return [{"stage": stage, "count": counter[stage]} for stage in sorted(counter, key=none_first)
+                if stage is not None]
+
+    def identifications_stage_confidence_count(self):
+        """Return list of dictionaries of count of identifications of each stage, with each confidence level, ordered
+        by stage and confidence."""
+
+        counter = collections.Counter((self.stage_names[self.stages[i]], CONFIDENCE_PRECEDENCE[self.confidences[i]][1])
+                                      for i in range(len(self)))
+
+        return [{"stage": stage, "confidence": confidence, "count": counter[(stage, confidence)]}
+                for stage, confidence in sorted(counter, key=lambda key: (none_first(key[0]), none_first(key[1])))
+                if stage is not None]
+
+
+def intern_taxon(codes, names, taxon_id, names_by_id):
+    """Return the code (small integer) of a taxon, adding its name to the names if it has not been seen yet. A missing
+    taxon is coded as NONE."""
+
+    if taxon_id is None:
+        return NONE
+
+    return intern(codes, names, taxon_id, names_by_id[taxon_id])
+
+
+def intern(codes, names, value, name):
+    """Return the code (small integer) of a value, adding its name to the names if it has not been seen yet."""
+
+    if value not in codes:
+        codes[value] = len(names)
+        names.append(name)
+
+    return codes[value]
+
+
+def none_first(value):
+    """Sort key which places None before the other values, as the database does."""
+
+    return (value is not None, value or '')
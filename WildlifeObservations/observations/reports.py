@@ -1,14 +1,49 @@
 import collections
 
-from django.db.models import Count, Q
+from django.db.models import Count, Min, Q
 
 from .models import Identification, Observation, Visit, Site, Survey
+from .report_cache import cached_report
+from .report_snapshot import IdentificationSnapshot
+from .resolved_identifications import CONFIDENCE_PRECEDENCE, confidence_rank
+from .utils import IN_QUERY_CHUNK_SIZE
+
+
+def resolve_observations_confidence(identifications):
+    """Return dictionary of sets of the specimen labels of the observations of the identifications, where each
+    observation is placed in the set of the most certain confidence of its identifications. The keys of the dictionary
+    are those of CONFIDENCE_PRECEDENCE.
+
+    The ranking is done in the database with one query, whatever the number of identifications.
+
+    For example:
+    {'Confirmed': {'TOR08 20211005 H1 C001'}, 'Finalised': set(), 'CheckMuseum': set(), 'Review': set(),
+     'Check': {'TAV09 20211006 N1 C008'}, 'Redo': set(), 'InProgress': set(), 'NoConfirmation': set()}
+    """
+
+    resolved = {key: set() for key, confidence in CONFIDENCE_PRECEDENCE}
+
+    qs = identifications.order_by().values("observation__specimen_label").annotate(rank=Min(confidence_rank()))
+
+    for observation in qs:
+        key = CONFIDENCE_PRECEDENCE[observation["rank"]][0]
+        resolved[key].add(observation["observation__specimen_label"])
+
+    return resolved
 
 
 class SpeciesReport:
-    def __init__(self):
-        pass
+    def __init__(self, use_cache=True):
+        self.use_cache = use_cache
+
+    @cached_report
+    def identification_snapshot(self):
+        """Return a snapshot of all of the identifications and observations (see IdentificationSnapshot), from which
+        the reports of report_identifications are calculated in memory."""
 
+        return IdentificationSnapshot.load()
+
+    @cached_report
     def species_identified_count(self):
         """Returns list of dictionaries with species name and count
 
@@ -28,6 +63,7 @@ class SpeciesReport:
 
         return result
 
+    @cached_report
     def number_confirmed_species_observed(self):
         """Returns the number of confirmed species (integer) that have been recorded."""
 
@@ -35,6 +71,7 @@ class SpeciesReport:
 
         return qs
 
+    @cached_report
     def unconfirmed_species_observed(self):
         """Returns a set of all species that have been recorded. They have not necessarily been confirmed."""
 
@@ -42,6 +79,7 @@ class SpeciesReport:
 
         return qs
 
+    @cached_report
     def identified_observations_count(self):
         """Return total number (integer) of individual (unique) observations identified to taxonomic level of family,
         genus or species."""
@@ -57,6 +95,7 @@ class SpeciesReport:
 
         return distinct_observations_identified_count
 
+    @cached_report
     def identified_observations_finalised_count(self):
         """Return total number (integer) of individual (unique) observations identified to taxonomic level of family,
         genus or species, that are finalised."""
@@ -74,73 +113,20 @@ class SpeciesReport:
 
         return distinct_observations_finalised_identified_count
 
+    @cached_report
     def identified_observations_to_species(self):
         """Return dictionary of individual observations identified to species, with details of the confidence of the
         identification.
 
-        Observations with more than one identification should not be considered more than once, by adding them to a set
-        and checking this set before adding another identification for the same observation.
-
-        A hierarchy of "certainty" is used for the confidence level of the identification, which means that confirmed
-        identifications will be added to the set before those that are less certain, in cases where an observation has
-        multiple identifications with differing certainty.
+        Observations with more than one identification are only considered once: each observation is placed in the set
+        of the most "certain" confidence of its identifications to species (see resolve_observations_confidence).
 
         TODO: check that observations with multiple identifications that are confirmed, choose the same species / genus.
         """
 
         identified_to_species = Identification.objects.filter(species__isnull=False)
 
-        # specimen_labels = set()
-
-        # confidence order of hierarchy
-        all_confirmed = set()
-        all_finalised = set()
-        all_check_in_museum = set()
-        all_review = set()
-        all_check = set()
-        all_redo = set()
-        all_in_progress = set()
-        all_missing_confirmation = set()
-
-        for identification in identified_to_species:
-            identification: Identification
-
-            # if identification.observation.specimen_label in specimen_labels:  # only consider a specimen label if it
-            #     # has not already been added to the set. This avoids identifications being considered more than once.
-            #     continue
-            #
-            # specimen_labels.add(identification.observation.specimen_label)  # add the specimen labels to the set
-
-            # the confidences are added in order of concreteness.
-            if identification.confidence == Identification.Confidence.CONFIRMED:
-                all_confirmed.add(identification.observation.specimen_label)  # identifications that are confirmed
-            elif identification.confidence == Identification.Confidence.FINALISED:
-                    all_finalised.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.CHECK_IN_MUSEUM:
-                all_check_in_museum.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.REVIEW:
-                all_review.add(identification.observation.specimen_label)  # identifications that are for review
-            elif identification.confidence == Identification.Confidence.CHECK:
-                all_check.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.REDO:
-                all_redo.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.IN_PROGRESS:
-                all_in_progress.add(identification.observation.specimen_label)
-            elif identification.confidence is None:
-                all_missing_confirmation.add(identification.observation.specimen_label)
-            else:
-                assert False
-
-        finalised = all_finalised - all_confirmed
-        check_in_museum = all_check_in_museum - all_confirmed  # intentionally leaving out those that cannot be identified further
-        review = all_review - all_check_in_museum - all_finalised - all_confirmed
-        check = all_check - all_check_in_museum - all_review - all_finalised - all_confirmed
-        redo = all_redo - all_check - all_check_in_museum - all_review - all_finalised - all_confirmed
-        in_progress = all_in_progress - all_redo - all_check - all_check_in_museum - all_review - all_finalised - all_confirmed
-
-        return {'Confirmed': all_confirmed, 'Finalised': finalised,
-                'Review': review, 'Check': check, 'CheckMuseum': check_in_museum, 'Redo': redo,
-                'InProgress': in_progress, 'NoConfirmation': all_missing_confirmation}
+        return resolve_observations_confidence(identified_to_species)
 
     def get_species_from_specimen_label_confidence_set(self, dict_set_specimen_labels, confidence):
         """Get a set containing specimen labels and get the species to which each has been identified with a specified
@@ -151,15 +137,38 @@ class SpeciesReport:
 
         The confidence should be as written in the Identification model."""
 
-        set_specimen_labels = dict_set_specimen_labels[confidence]
+        return self.get_species_from_specimen_label_confidence_sets(dict_set_specimen_labels, [confidence])[confidence]
+
+    @cached_report
+    def get_species_from_specimen_label_confidence_sets(self, dict_set_specimen_labels, confidences):
+        """Return dictionary of sets of (specimen label, species) for each of the specified confidences, as
+        get_species_from_specimen_label_confidence_set does for one confidence.
+
+        All of the specimen labels are looked up together, in chunks of IN_QUERY_CHUNK_SIZE, so the number of queries
+        does not depend on the number of observations in each set.
+
+        The confidences should be as written in the Identification model."""
 
-        unique_identifications = set()
+        keys = {confidence: key for key, confidence in CONFIDENCE_PRECEDENCE}
 
-        for label in set_specimen_labels:
-            identifications = Identification.objects.filter(observation__specimen_label=label).filter(
-                confidence__exact=confidence)
-            unique_identifications.update(
-                identifications.values_list("observation__specimen_label", "species__latin_name"))
+        labels_confidences = collections.defaultdict(set)  # confidences to look up for each specimen label
+        for confidence in confidences:
+            for label in dict_set_specimen_labels[keys[confidence]]:
+                labels_confidences[label].add(confidence)
+
+        unique_identifications = {confidence: set() for confidence in confidences}
+
+        labels = list(labels_confidences)
+
+        for i in range(0, len(labels), IN_QUERY_CHUNK_SIZE):
+            identifications = Identification.objects.filter(
+                observation__specimen_label__in=labels[i:i + IN_QUERY_CHUNK_SIZE]).filter(
+                confidence__in=confidences).values_list("observation__specimen_label", "species__latin_name",
+                                                        "confidence")
+
+            for label, species, confidence in identifications:
+                if confidence in labels_confidences[label]:
+                    unique_identifications[confidence].add((label, species))
 
         return unique_identifications
 
@@ -174,60 +183,21 @@ class SpeciesReport:
 
         return unique_observations_from_identifications
 
+    @cached_report
     def identified_observations_to_genus_not_species(self):
         """Return dictionary of observations that have been identified to genus, not species, with details of
         confidence."""
 
         identified_to_genus = Identification.objects.filter(genus__isnull=False).filter(species__isnull=True)
 
-        total_unique_observations_genus = len(
-            set(identified_to_genus.values_list("observation__specimen_label", flat=True)))
-
-        specimen_labels = set()
+        resolved = resolve_observations_confidence(identified_to_genus)
 
-        finalised = set()
-        confirmed = set()
-        in_progress = set()
-        redo = set()
-        review = set()
-        check = set()
-        check_in_museum = set()
-        missing_confirmation = set()
+        total_unique_observations_genus = sum(len(specimen_labels) for specimen_labels in resolved.values())
 
-        for identification in identified_to_genus:
-            identification: Identification
-
-            if identification.observation.specimen_label in specimen_labels:  # only consider a specimen label if it
-                # has not already been added to the set
-                continue
-
-            specimen_labels.add(identification.observation.specimen_label)  # add the specimen labels to the set
-
-            # the confidences are added in order of concreteness.
-            if identification.confidence == Identification.Confidence.CONFIRMED:
-                confirmed.add(identification.observation.specimen_label)  # identifications that are confirmed
-            elif identification.confidence == Identification.Confidence.FINALISED:
-                finalised.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.REVIEW:
-                review.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.CHECK_IN_MUSEUM:
-                check_in_museum.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.CHECK:
-                check.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.REDO:
-                redo.add(identification.observation.specimen_label)
-            elif identification.confidence == Identification.Confidence.IN_PROGRESS:
-                in_progress.add(identification.observation.specimen_label)
-            elif identification.confidence is None:
-                missing_confirmation.add(identification.observation.specimen_label)
-            else:
-                assert False
-
-        return {'Total': total_unique_observations_genus, 'Confirmed': confirmed, 'Finalised': finalised,
-                'NoConfirmation': missing_confirmation, 'Review': review,'Check': check,
-                'CheckMuseum': check_in_museum, 'Redo': redo, 'InProgress': in_progress,
-                'MissingConfirmation': missing_confirmation}
+        return {'Total': total_unique_observations_genus, **resolved,
+                'MissingConfirmation': resolved['NoConfirmation']}
 
+    @cached_report
     def observations_count(self):
         """Return set of individual observations made."""
 
@@ -241,6 +211,7 @@ class SpeciesReport:
 
         return observations
 
+    @cached_report
     def observations_suborder(self):
         """Return list of dictionaries of total numbers of observations of each suborder that have been made.
         Account for the possibility of multiple identifications of each observation.
@@ -281,6 +252,7 @@ class SpeciesReport:
 
         return {'Caelifera': c, 'Ensifera': e, 'todo': todo}
 
+    @cached_report
     def identifications_stage_count(self):
         """Return list of dictionaries of count of identifications of each stage, with each confidence level.
 
@@ -298,6 +270,7 @@ class SpeciesReport:
 
         return result
 
+    @cached_report
     def identifications_stage_confidence_count(self):
         """Return list of dictionaries of count of identifications of each stage, with each confidence level.
 
@@ -319,9 +292,10 @@ class SpeciesReport:
 
 
 class VisitReport:
-    def __init__(self):
-        pass
+    def __init__(self, use_cache=True):
+        self.use_cache = use_cache
 
+    @cached_report
     def summarise_sites(self):
         """Return a list of dictionaries of the number of sites within each study area.
 
@@ -338,6 +312,7 @@ class VisitReport:
 
         return result
 
+    @cached_report
     def summarise_visits(self):
         """Return a list of dictionaries of the number of visits to each site.
 
@@ -354,39 +329,47 @@ class VisitReport:
 
         return result
 
-    def summarise_suborder_survey(self):
-        """Return a list of dictionaries of the number of each suborder on each visit to each site.
+    @cached_report
+    def summarise_suborder_survey(self, unique_specimen_labels=False):
+        """Return a list of dictionaries of the number of each suborder on each visit to each site, ordered by date and
+        site name.
+
+        By default, all identifications of Caelifera and Ensifera are counted. If unique_specimen_labels is True, the
+        observations (unique specimen labels) identified as each suborder are counted instead.
+
+        The whole summary is calculated by the database in one query.
 
         For example:
         [{'survey': 'TOR03 20210719 N1', 'Caelifera':7, 'Ensifera':2, 'Unknown':2},
         {'survey': 'TOR05 20210719 H1', 'Caelifera':17, 'Ensifera':5, 'Unknown':5}]"""
 
-        # qs = Identification.objects.values("observation__survey").annotate(total=Count("suborder"))
+        if unique_specimen_labels:
+            counted = 'observation'
+        else:
+            counted = 'observation__identification'
+
+        qs = Survey.objects.values('id', 'visit__site__site_name', 'visit__site__altitude_band', 'visit__date',
+                                   'method', 'repeat').annotate(
+            caelifera=Count(counted, distinct=True,
+                            filter=Q(observation__identification__suborder__suborder='Caelifera')),
+            ensifera=Count(counted, distinct=True,
+                           filter=Q(observation__identification__suborder__suborder='Ensifera')),
+            not_identified=Count('observation', distinct=True,
+                                 filter=Q(observation__identification__isnull=True))).order_by(
+            'visit__date', 'visit__site__site_name', 'id')
 
         result = []
 
-        for survey in Survey.objects.all().order_by('visit__date', 'visit__site__site_name'):
+        for survey in qs:
             row = {}
 
-            # TODO count these identifications of Caelifera and Ensifera for unique observation specimen labels.
-            row['survey'] = str(survey)
-            row['Caelifera'] = Identification.objects.filter(observation__survey=survey).filter(
-                suborder__suborder='Caelifera').count()  # all identifications of Caelifera
-            row['Ensifera'] = Identification.objects.filter(observation__survey=survey).filter(
-                suborder__suborder='Ensifera').count()  # all identifications of Ensifera
-
-            # row['todo'] = Observation.objects.filter(survey=survey).count() - survey.count()
-            # row['todo'] = Identification.objects.filter(observation__survey=survey) -
-
-            all_observation_db_ids_for_this_survey = set(
-                Observation.objects.filter(survey=survey).values_list('id', flat=True))
-            all_observation_db_ids_for_this_survey_identified = set(
-                Identification.objects.filter(observation__survey=survey).values_list('observation__id', flat=True))
-
-            observations_not_identified_db_ids = \
-                all_observation_db_ids_for_this_survey - all_observation_db_ids_for_this_survey_identified
-
-            row['observations_not_identified'] = len(observations_not_identified_db_ids)
+            # same format as str(survey), without loading the visit and the site of each survey
+            row['survey'] = "{} ({}m) {} {} {}".format(survey['visit__site__site_name'],
+                                                       survey['visit__site__altitude_band'], survey['visit__date'],
+                                                       survey['method'], survey['repeat'])
+            row['Caelifera'] = survey['caelifera']
+            row['Ensifera'] = survey['ensifera']
+            row['observations_not_identified'] = survey['not_identified']
 
             result.append(row)
 
@@ -394,8 +377,8 @@ class VisitReport:
 
 
 class SurveyReport:
-    def __init__(self):
-        pass
+    def __init__(self, use_cache=True):
+        self.use_cache = use_cache
 
     def get_survey_object(self, site_name, date, method, repeat):
         """
@@ -408,6 +391,7 @@ class SurveyReport:
 
         return survey_object
 
+    @cached_report
     def summarise_survey_suborder(self, survey):
         """
         Summarise the numbers of each suborder observed for the specified survey. This query will consider all
@@ -460,6 +444,7 @@ class SurveyReport:
 
         return identifications
 
+    @cached_report
     def list_observations_count_identifications(self, survey):
         """
         Get all observations for a particular survey and count all identifications that each observation has. All
@@ -484,6 +469,7 @@ class SurveyReport:
 
         return identifications_for_survey
 
+    @cached_report
     def summarise_survey_confirmed_finalised_taxa(self, survey):
         """
         Summarise the confirmed or finalised taxa observed during a specific survey.
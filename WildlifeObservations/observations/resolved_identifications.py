@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import Identification, ResolvedIdentification
+from .utils import IN_QUERY_CHUNK_SIZE
+
+# Hierarchy of "certainty" of the confidence of an identification, from the most to the least certain. Each entry is the
+# key used in the report dictionaries and the confidence as written in the Identification model.
+CONFIDENCE_PRECEDENCE = [('Confirmed', Identification.Confidence.CONFIRMED),
+                         ('Finalised', Identification.Confidence.FINALISED),
+                         ('CheckMuseum', Identification.Confidence.CHECK_IN_MUSEUM),
+                         ('Review', Identification.Confidence.REVIEW),
+                         ('Check', Identification.Confidence.CHECK),
+                         ('Redo', Identification.Confidence.REDO),
+                         ('InProgress', Identification.Confidence.IN_PROGRESS),
+                         ('NoConfirmation', None)]
+
+# Taxonomic levels of an identification, from the lowest to the highest, with the field that holds the name of the taxon.
+TAXON_RANKS = [(ResolvedIdentification.TaxonRank.SPECIES, 'species__latin_name'),
+               (ResolvedIdentification.TaxonRank.GENUS, 'genus__genus'),
+               (ResolvedIdentification.TaxonRank.SUBFAMILY, 'subfamily__subfamily'),
+               (ResolvedIdentification.TaxonRank.FAMILY, 'family__family'),
+               (ResolvedIdentification.TaxonRank.SUBORDER, 'suborder__suborder')]
+
+
+def confidence_rank():
+    """Return an expression that ranks the confidence of an identification according to CONFIDENCE_PRECEDENCE, where 0
+    is the most certain. Identifications without a confidence have the lowest rank."""
+
+    whens = [When(confidence=confidence, then=Value(rank))
+             for rank, (key, confidence) in enumerate(CONFIDENCE_PRECEDENCE) if confidence is not None]
+
+    return Case(*whens, default=Value(len(CONFIDENCE_PRECEDENCE) - 1), output_field=IntegerField())
+
+
+def resolved_identifications(identifications):
+    """Return a generator of ResolvedIdentification objects (not saved), one for each observation of the
+    identifications.
+
+    The identification of each observation that is selected is the one with the most certain confidence (see
+    CONFIDENCE_PRECEDENCE). If several identifications have the same confidence, the first one that was entered is
+    selected.
+
+    The identifications are read with one query and are not kept in memory.
+    """
+
+    qs = identifications.annotate(rank=confidence_rank()).order_by('observation_id', 'rank', 'id').values(
+        'id', 'observation_id', 'confidence', 'sex', 'stage', *[field for rank, field in TAXON_RANKS])
+
+    previous_observation_id = None
+
+    for identification in qs.iterator():
+        if identification['observation_id'] == previous_observation_id:  # only the first (best) identification of
+            # each observation is selected
+            continue
+
+        previous_observation_id = identification['observation_id']
+
+        taxon = None
+        taxon_rank = None
+
+        for rank, field in TAXON_RANKS:
+            if identification[field] is not None:
+                taxon = identification[field]
+                taxon_rank = rank
+                break
+
+        yield ResolvedIdentification(observation_id=identification['observation_id'],
+                                     identification_id=identification['id'],
+                                     confidence=identification['confidence'],
+                                     taxon=taxon, taxon_rank=taxon_rank,
+                                     sex=identification['sex'], stage=identification['stage'])
+
+
+def bulk_create_resolved_identifications(identifications, batch_size=IN_QUERY_CHUNK_SIZE):
+    """Resolve the identifications (see resolved_identifications) and save the results in batches.
+
+    Return the number of observations that have been resolved.
+    """
+
+    batch = []
+    count = 0
+
+    for resolved_identification in resolved_identifications(identifications):
+        batch.append(resolved_identification)
+
+        if len(batch) == batch_size:
+            ResolvedIdentification.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+
+    ResolvedIdentification.objects.bulk_create(batch)
+    count += len(batch)
+
+    return count
+
+
+def refresh_resolved_identifications(observation_ids):
+    """Update the resolved identifications of the specified observations, from their current identifications.
+
+    Observations that no longer have any identifications will not have a resolved identification.
+    """
+
+    observation_ids = list(set(observation_ids))
+
+    with transaction.atomic():
+        for i in range(0, len(observation_ids), IN_QUERY_CHUNK_SIZE):
+            observation_ids_chunk = observation_ids[i:i + IN_QUERY_CHUNK_SIZE]
+
+            ResolvedIdentification.objects.filter(observation_id__in=observation_ids_chunk).delete()
+            bulk_create_resolved_identifications(
+                Identification.objects.filter(observation_id__in=observation_ids_chunk))
+
+
+def rebuild_resolved_identifications():
+    """Delete all of the resolved identifications and resolve them again from all identifications.
+
+    Return the number of observations that have been resolved.
+    """
+
+    with transaction.atomic():
+        ResolvedIdentification.objects.all().delete()
+
+        return bulk_create_resolved_identifications(Identification.objects.all())
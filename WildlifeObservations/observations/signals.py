@@ -0,0 +1,74 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import DataVersion, Identification, MeteorologyConditions, Observation, ResolvedIdentification, Site, \
+    Survey, Visit, touch_observations
+from .resolved_identifications import refresh_resolved_identifications
+
+
+@receiver(post_init, sender=Identification)
+def identification_loaded(sender, instance, **kwargs):
+    """Keep the observation of an identification when it is loaded, to know if it changes when it is saved."""
+
+    instance._loaded_observation_id = instance.__dict__.get('observation_id')
+
+
+@receiver(post_save, sender=Identification)
+def identification_saved(sender, instance, raw, **kwargs):
+    """Refresh the resolved identification of the observation of an identification that has been saved. The previous
+    observation is refreshed as well if the identification has been moved to another observation, and it is marked as
+    updated so that it is checked again by the incremental data checks."""
+
+    if raw:  # loading fixtures: the observations might not exist yet, use rebuild_resolved_identifications afterwards
+        return
+
+    observation_ids = {instance.observation_id}
+
+    # the observation that the identification is resolved for, in case the identification has been moved and
+    # _loaded_observation_id is not up to date (e.g. after refresh_from_db(), which does not send post_init)
+    observation_ids.update(ResolvedIdentification.objects.filter(identification_id=instance.pk).values_list(
+        'observation_id', flat=True))
+
+    if instance._loaded_observation_id is not None:
+        observation_ids.add(instance._loaded_observation_id)
+
+        if instance._loaded_observation_id != instance.observation_id:
+            touch_observations([instance._loaded_observation_id])
+
+    refresh_resolved_identifications(observation_ids)
+
+    instance._loaded_observation_id = instance.observation_id
+
+
+@receiver(post_delete, sender=Identification)
+def identification_deleted(sender, instance, **kwargs):
+    """Refresh the resolved identification of the observation of an identification that has been deleted, and mark the
+    observation as updated so that it is checked again by the incremental data checks."""
+
+    refresh_resolved_identifications([instance.observation_id])
+    touch_observations([instance.observation_id])
+
+
+@receiver(post_delete, sender=MeteorologyConditions)
+def meteorology_conditions_deleted(sender, instance, **kwargs):
+    """Mark the survey of meteorological conditions that have been deleted as updated, so that it is checked again by
+    the incremental data checks."""
+
+    Survey.objects.filter(pk=instance.survey_id).update(updated_on=timezone.now())
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_save, sender=Visit)
+@receiver(post_save, sender=Survey)
+@receiver(post_save, sender=Observation)
+@receiver(post_save, sender=Identification)
+@receiver(post_delete, sender=Site)
+@receiver(post_delete, sender=Visit)
+@receiver(post_delete, sender=Survey)
+@receiver(post_delete, sender=Observation)
+@receiver(post_delete, sender=Identification)
+def data_changed(sender, **kwargs):
+    """Increase the data version of a model when one of its rows has been saved or deleted."""
+
+    DataVersion.bump(sender)
@@ -1,3 +1,856 @@
+import contextlib
+import csv
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 
-# Create your tests here.
+from .data_check_runner import DataCheckRun, run_data_checks
+from .data_integrity_checks import CONSISTENCY_RULES, DATA_CHECKS, IDENTIFICATIONS, OBSERVATIONS, TAXONOMY_FIELDS, \
+    IdentificationDataChecks
+from .exports import merge_delta_csv
+from .import_pipeline import read_rows, validate_rows
+from .management.commands import export_observations_csv, import_obs_ids, import_taxonomy, import_visits_surveys
+from .models import DataCheckViolation, DataVersion, Identification, IdentificationGuide, ImportCheckpoint, \
+    ImportedRow, MeteorologyConditions, Observation, ResolvedIdentification, Site, Source, Survey, TaxonomyClass, \
+    TaxonomyFamily, TaxonomyGenus, TaxonomyOrder, TaxonomySpecies, TaxonomySubfamily, TaxonomySuborder, Visit
+from .report_snapshot import IdentificationSnapshot
+from .reports import SpeciesReport
+from .utils import QueryCounter
+
+
+def create_taxonomy():
+    """Return dictionary of the taxa of a small taxonomy: one suborder and family, two subfamilies with one genus each
+    and one species of each genus."""
+
+    taxclass = TaxonomyClass.objects.create(taxclass='Insecta')
+    order = TaxonomyOrder.objects.create(order='Orthoptera', taxclass=taxclass)
+    suborder = TaxonomySuborder.objects.create(suborder='Caelifera', order=order)
+    family = TaxonomyFamily.objects.create(family='Acrididae', suborder=suborder)
+    subfamily_1 = TaxonomySubfamily.objects.create(subfamily='Gomphocerinae', family=family)
+    subfamily_2 = TaxonomySubfamily.objects.create(subfamily='Oedipodinae', family=family)
+    genus_1 = TaxonomyGenus.objects.create(genus='Chorthippus', subfamily=subfamily_1)
+    genus_2 = TaxonomyGenus.objects.create(genus='Oedipoda', subfamily=subfamily_2)
+    species_1 = TaxonomySpecies.objects.create(latin_name='Chorthippus parallelus', genus=genus_1)
+    species_2 = TaxonomySpecies.objects.create(latin_name='Oedipoda caerulescens', genus=genus_2)
+
+    return {'suborder': suborder, 'family': family, 'subfamily_1': subfamily_1, 'subfamily_2': subfamily_2,
+            'genus_1': genus_1, 'genus_2': genus_2, 'species_1': species_1, 'species_2': species_2}
+
+
+def create_site(site_name='TAV01'):
+    source, created = Source.objects.get_or_create(name=Source.PositionSource.GPS)
+
+    return Site.objects.create(area='Tavascan', site_name=site_name, altitude_band=1000,
+                               latitude_start=42.6, latitude_start_source=source,
+                               longitude_start=1.2, longitude_start_source=source,
+                               altitude_start=1000, altitude_start_source=source,
+                               latitude_end=42.7, latitude_end_source=source,
+                               longitude_end=1.3, longitude_end_source=source,
+                               altitude_end=1010, altitude_end_source=source,
+                               transect_length=100, transect_length_source=source)
+
+
+def create_survey(site, date=datetime.date(2021, 8, 12), method=Survey.Method.HAND, repeat=Survey.Repeat.ONE):
+    visit, created = Visit.objects.get_or_create(site=site, date=date)
+
+    return Survey.objects.create(visit=visit, start_time=datetime.time(10, repeat), end_time=datetime.time(11, repeat),
+                                 method=method, repeat=repeat, observer='Jen Thomas')
+
+
+def create_observation(survey, specimen_label):
+    return Observation.objects.create(specimen_label=specimen_label, survey=survey,
+                                      status=Observation.Status.SPECIMEN)
+
+
+def run_quietly(function, *args, **kwargs):
+    """Return the result of the function, without printing its output."""
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def write_import_file(path, rows):
+    """Write a file of observations and identifications to import with import_obs_ids, with a row for each dictionary
+    of rows (the columns that are not in a row are empty)."""
+
+    columns = ['specimen_id', 'length_mm'] + import_obs_ids.IDENTIFICATION_COLUMNS + \
+        [import_obs_ids.CONFIDENCE_REASON_COLUMN]
+
+    with open(path, 'w', newline='') as file:
+        csv_writer = csv.DictWriter(file, columns, restval='')
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+
+
+def write_visits_file(path, rows):
+    """Write a file of surveys to import with import_visits_surveys, with a row for each dictionary of rows (the
+    columns that are not in a row are empty)."""
+
+    columns = ['sitename', 'date', 'start_time', 'end_time', 'method', 'repeat'] + \
+        list(import_visits_surveys.MET_CONDITIONS_COLUMNS.values()) + ['notes']
+
+    with open(path, 'w', newline='') as file:
+        csv_writer = csv.DictWriter(file, columns, restval='')
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+
+
+def get_data_check(name):
+    return next(data_check for data_check in DATA_CHECKS if data_check.name == name)
+
+
+class ObservationsTestCase(TestCase):
+    """Test case with a taxonomy, a guide and a survey of a site (see create_taxonomy and create_survey)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.taxa = create_taxonomy()
+        cls.guide = IdentificationGuide.objects.create(title='Grasshoppers', author='Sardet, Roesti and Braud')
+        cls.site = create_site()
+        cls.survey = create_survey(cls.site)
+
+    def create_identification(self, observation, species, confidence=None, **kwargs):
+        if confidence is not None:
+            kwargs.setdefault('confidence_reason', Identification.CONFIDENCE_REASONS[confidence][0])
+
+        return Identification.objects.create(observation=observation, species=species, confidence=confidence,
+                                             notebook='1', **kwargs)
+
+
+class ResolvedIdentificationTests(ObservationsTestCase):
+    def setUp(self):
+        self.observation = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+
+    def get_resolved(self):
+        return ResolvedIdentification.objects.get(observation=self.observation)
+
+    def test_saved_identification_is_resolved(self):
+        identification = self.create_identification(self.observation, self.taxa['species_1'],
+                                                    Identification.Confidence.CHECK)
+
+        resolved = self.get_resolved()
+        self.assertEqual(resolved.identification, identification)
+        self.assertEqual(resolved.taxon, 'Chorthippus parallelus')
+        self.assertEqual(resolved.taxon_rank, ResolvedIdentification.TaxonRank.SPECIES)
+
+    def test_most_certain_identification_is_resolved(self):
+        self.create_identification(self.observation, self.taxa['species_1'], Identification.Confidence.CHECK)
+        confirmed = self.create_identification(self.observation, self.taxa['species_2'],
+                                               Identification.Confidence.CONFIRMED)
+
+        self.assertEqual(self.get_resolved().identification, confirmed)
+
+        confirmed.delete()
+
+        self.assertEqual(self.get_resolved().taxon, 'Chorthippus parallelus')
+
+    def test_queryset_update_refreshes_resolved_identification(self):
+        identification = self.create_identification(self.observation, self.taxa['species_1'],
+                                                    Identification.Confidence.CHECK)
+
+        Identification.objects.filter(pk=identification.pk).update(
+            confidence=Identification.Confidence.REVIEW, confidence_reason=Identification.ConfidenceReason.ID_UNCERTAIN)
+
+        self.assertEqual(self.get_resolved().confidence, Identification.Confidence.REVIEW)
+
+    def test_bulk_create_refreshes_resolved_identification(self):
+        Identification.objects.bulk_create([Identification(observation=self.observation, genus=self.taxa['genus_2'],
+                                                           notebook='1')])
+
+        resolved = self.get_resolved()
+        self.assertEqual(resolved.taxon, 'Oedipoda')
+        self.assertEqual(resolved.taxon_rank, ResolvedIdentification.TaxonRank.GENUS)
+
+    def test_moved_identification_refreshes_both_observations(self):
+        other_observation = create_observation(self.survey, 'TAV01 20210812 H1 C002')
+        identification = self.create_identification(self.observation, self.taxa['species_1'])
+
+        Identification.objects.filter(pk=identification.pk).update(observation=other_observation)
+
+        self.assertFalse(ResolvedIdentification.objects.filter(observation=self.observation).exists())
+        self.assertEqual(ResolvedIdentification.objects.get(observation=other_observation).identification,
+                         identification)
+
+        identification.refresh_from_db()
+        identification.observation = self.observation
+        identification.save()
+
+        self.assertEqual(self.get_resolved().identification, identification)
+        self.assertFalse(ResolvedIdentification.objects.filter(observation=other_observation).exists())
+
+
+class DataVersionTests(TestCase):
+    def test_bump_creates_and_increases_version(self):
+        self.assertEqual(DataVersion.versions([Site]), (0,))
+
+        DataVersion.bump(Site)
+        DataVersion.bump(Site)
+
+        self.assertEqual(DataVersion.versions([Site]), (2,))
+
+
+class DataCheckRunTests(ObservationsTestCase):
+    def test_shared_data_is_read_once(self):
+        observation = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+        self.create_identification(observation, self.taxa['species_1'], Identification.Confidence.CHECK)
+
+        run = DataCheckRun()
+        without_sex = run.evaluate(get_data_check('identifications_without_sex'))
+        without_stage = run.evaluate(get_data_check('identifications_without_stage'))
+
+        self.assertEqual([result['specimen_label'] for result in without_sex], ['TAV01 20210812 H1 C001'])
+        self.assertEqual([result['specimen_label'] for result in without_stage], ['TAV01 20210812 H1 C001'])
+        self.assertEqual(run.query_counts['identifications_without_sex'], 1)
+        self.assertEqual(run.query_counts['identifications_without_stage'], 0)
+
+    def test_fail_on_error(self):
+        observation = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+        self.create_identification(observation, self.taxa['species_1'], Identification.Confidence.CONFIRMED)
+        self.create_identification(observation, self.taxa['species_2'], Identification.Confidence.CONFIRMED)
+
+        options = {'stream': False, 'timings': False, 'fail_on_error': True, 'incremental': False, 'rescan': False}
+
+        with self.assertRaisesRegex(CommandError, 'confirmed_different_taxonomy'):
+            run_quietly(run_data_checks, [IDENTIFICATIONS], options)
+
+
+class IncrementalDataCheckTests(ObservationsTestCase):
+    options = {'stream': False, 'timings': False, 'fail_on_error': False, 'incremental': True, 'rescan': False}
+
+    def setUp(self):
+        self.observation_1 = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+        self.observation_2 = create_observation(self.survey, 'TAV01 20210812 H1 C002')
+
+    def run_data_checks(self, **options):
+        run_quietly(run_data_checks, [OBSERVATIONS], {**self.options, **options})
+
+    def get_violations(self, **kwargs):
+        return DataCheckViolation.objects.filter(data_check='observations_without_suborder', **kwargs)
+
+    def test_violations_are_opened_and_closed(self):
+        self.run_data_checks()
+
+        self.assertEqual(sorted(self.get_violations(closed_on__isnull=True).values_list('result', flat=True)),
+                         ['TAV01 20210812 H1 C001', 'TAV01 20210812 H1 C002'])
+
+        self.create_identification(self.observation_1, self.taxa['species_1'])
+        self.run_data_checks()
+
+        self.assertEqual(self.get_violations(closed_on__isnull=False).get().observation, self.observation_1)
+        self.assertEqual(self.get_violations(closed_on__isnull=True).get().observation, self.observation_2)
+
+    def test_unchanged_observations_are_not_checked_again(self):
+        self.run_data_checks()
+
+        # Deleting the violation without changing the observation: an incremental run does not find it again
+        self.get_violations(observation=self.observation_2).delete()
+        self.run_data_checks()
+
+        self.assertFalse(self.get_violations(observation=self.observation_2).exists())
+
+        self.run_data_checks(rescan=True)
+
+        self.assertTrue(self.get_violations(observation=self.observation_2, closed_on__isnull=True).exists())
+
+    def test_deleted_identification_reopens_violation(self):
+        identification = self.create_identification(self.observation_1, self.taxa['species_1'])
+        self.run_data_checks()
+
+        self.assertFalse(self.get_violations(observation=self.observation_1).exists())
+
+        identification.delete()
+        self.run_data_checks()
+
+        self.assertTrue(self.get_violations(observation=self.observation_1, closed_on__isnull=True).exists())
+
+
+class DeltaExportTests(ObservationsTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.identifications = {}
+        for number, species in [(1, 'species_1'), (2, 'species_2'), (3, 'species_1')]:
+            observation = create_observation(self.survey, f'TAV01 20210812 H1 C00{number}')
+            self.identifications[number] = self.create_identification(observation, self.taxa[species],
+                                                                      Identification.Confidence.CONFIRMED)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, file_name, delta=False, watermark=False):
+        path = os.path.join(self.directory.name, file_name)
+
+        self.stats = io.StringIO()
+
+        with open(path, 'w') as output_file:
+            export_observations_csv.Command(stderr=self.stats).handle(
+                output_file=output_file, practice_sites=[], since=None, delta=delta, watermark=watermark)
+
+        return path
+
+    def read_rows(self, path):
+        with open(path) as file:
+            return sorted(tuple(row.items()) for row in csv.DictReader(file))
+
+    def test_merged_deltas_are_the_full_export(self):
+        base = self.export('base.csv', watermark=True)
+
+        # Changed, no longer exported and new observations
+        identification = self.identifications[1]
+        identification.species = self.taxa['species_2']
+        identification.save()
+
+        Identification.objects.filter(pk=self.identifications[2].pk).update(
+            confidence=Identification.Confidence.REVIEW, confidence_reason=Identification.ConfidenceReason.ID_UNCERTAIN)
+
+        observation = create_observation(self.survey, 'TAV01 20210812 H1 C004')
+        self.create_identification(observation, self.taxa['species_2'], Identification.Confidence.FINALISED)
+        self.create_identification(observation, self.taxa['species_1'], Identification.Confidence.FINALISED)
+
+        delta_1 = self.export('delta_1.csv', delta=True)
+        self.assertIn(': 3 rows and 1 tombstones', self.stats.getvalue())
+
+        self.identifications[3].delete()
+
+        delta_2 = self.export('delta_2.csv', delta=True)
+        self.assertIn(': 0 rows and 1 tombstones', self.stats.getvalue())
+
+        merged = os.path.join(self.directory.name, 'merged.csv')
+        with open(merged, 'w') as output_file, open(base) as base_file, open(delta_1) as delta_1_file, \
+                open(delta_2) as delta_2_file:
+            merge_delta_csv(output_file, export_observations_csv.delta_observations.key, base_file,
+                            [delta_1_file, delta_2_file])
+
+        full = self.export('full.csv')
+
+        self.assertEqual(self.read_rows(merged), self.read_rows(full))
+        self.assertEqual([dict(row)['specimen_label'] for row in self.read_rows(full)],
+                         ['TAV01 20210812 H1 C001', 'TAV01 20210812 H1 C004', 'TAV01 20210812 H1 C004'])
+
+
+class ImportObservationsTestCase(ObservationsTestCase):
+    """Test case with a directory for the files to import with import_obs_ids."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'observations.csv')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def import_observations(self, **options):
+        options = {'filename': self.path, 'bulk': False, 'batch_size': import_obs_ids.BATCH_SIZE, 'chunk_size': None,
+                   'resume': False, 'workers': 1, 'error_report': None, 'incremental': False, **options}
+
+        run_quietly(import_obs_ids.Command().handle, **options)
+
+    def get_imported_data(self):
+        """Return the observations, identifications and resolved identifications, without their ids and times."""
+
+        observations = list(Observation.objects.order_by('specimen_label').values(
+            'specimen_label', 'survey', 'length_head_abdomen', 'status'))
+        identifications = list(Identification.objects.order_by('observation__specimen_label', 'id').values(
+            'observation__specimen_label', 'species', 'genus', 'subfamily', 'family', 'suborder',
+            'identification_guide', 'identification_notes', 'sex', 'stage', 'confidence', 'confidence_reason',
+            'notebook', 'date_of_identification', 'comments'))
+        resolved_identifications = list(ResolvedIdentification.objects.order_by('observation__specimen_label').values(
+            'observation__specimen_label', 'identification__species', 'confidence', 'taxon', 'taxon_rank'))
+
+        return observations, identifications, resolved_identifications
+
+
+class BulkImportTests(ImportObservationsTestCase):
+    def test_bulk_import_is_the_row_by_row_import(self):
+        write_import_file(self.path, [
+            {'specimen_id': 'TAV01 20210812 H1 C001', 'length_mm': '21.5', 'species': 'Chorthippus parallelus',
+             'sure': 'yes', 'sex': 'male', 'stage': 'adult', 'guide': 'Sardet et al', 'notebook': '1',
+             'id_date': '2022-03-04', 'confidence_reason': 'ID_certain'},
+            {'specimen_id': 'TAV01 20210812 H1 C002', 'genus': 'Oedipoda', 'id_notes': 'wings damaged',
+             'notebook': '1'},
+            {'specimen_id': 'TAV01 20210812 H1 C003', 'family': 'Acrididae', 'sure': 'check', 'stage': 'nymph',
+             'notebook': '2', 'comments': 'small'},
+            {'specimen_id': 'TAV01 20210812 H1 C004', 'suborder': 'Caelifera', 'sure': 'not finished',
+             'notebook': '2'},
+            {'specimen_id': 'TAV01 20210812 H1 C005', 'species': 'Oedipoda caerulescens', 'sex': 'female',
+             'notebook': '2'}])
+
+        with transaction.atomic():
+            self.import_observations()
+            row_by_row = self.get_imported_data()
+            transaction.set_rollback(True)
+
+        self.assertFalse(Observation.objects.exists())
+
+        self.import_observations(bulk=True, batch_size=2)
+
+        self.assertEqual(len(row_by_row[1]), 5)
+        self.assertEqual(self.get_imported_data(), row_by_row)
+
+
+class ImportTaxonomyTests(ObservationsTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'taxonomy.csv')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def import_taxonomy(self, rows):
+        with open(self.path, 'w', newline='') as file:
+            csv_writer = csv.writer(file)
+            csv_writer.writerow(['suborder', 'family', 'subfamily', 'genus', 'species', 'catalan', 'english',
+                                 'spanish'])
+            csv_writer.writerows(rows)
+
+        run_quietly(import_taxonomy.Command().handle, filename=self.path, dry_run=False, workers=1,
+                    error_report=None, incremental=False)
+
+    def test_moved_genus_updates_identifications(self):
+        observation_1 = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+        observation_2 = create_observation(self.survey, 'TAV01 20210812 H1 C002')
+        species_identification = self.create_identification(observation_1, self.taxa['species_1'],
+                                                            Identification.Confidence.CONFIRMED)
+        genus_identification = self.create_identification(observation_2, None, genus=self.taxa['genus_1'])
+        other_identification = self.create_identification(observation_2, self.taxa['species_2'])
+        resolved_on = ResolvedIdentification.objects.get(observation=observation_1).updated_on
+
+        # Chorthippus is moved from Gomphocerinae to Oedipodinae
+        self.import_taxonomy([['Caelifera', 'Acrididae', 'Oedipodinae', 'Chorthippus', 'Chorthippus parallelus', '', '',
+                               ''],
+                              ['Caelifera', 'Acrididae', 'Oedipodinae', 'Oedipoda', 'Oedipoda caerulescens', '', '',
+                               '']])
+
+        self.assertEqual(TaxonomyGenus.objects.get(genus='Chorthippus').subfamily, self.taxa['subfamily_2'])
+
+        for identification in [species_identification, genus_identification, other_identification]:
+            identification.refresh_from_db()
+            self.assertEqual(identification.subfamily, self.taxa['subfamily_2'])
+            self.assertEqual(identification.family, self.taxa['family'])
+
+        self.assertEqual(species_identification.genus, self.taxa['genus_1'])
+        self.assertGreater(ResolvedIdentification.objects.get(observation=observation_1).updated_on, resolved_on)
+
+
+class ConfidenceReasonsTests(ObservationsTestCase):
+    def test_check_constraint_is_the_confidence_reasons(self):
+        observation = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+
+        for confidence in Identification.Confidence.values:
+            for confidence_reason in Identification.ConfidenceReason.values:
+                with self.subTest(confidence=confidence, confidence_reason=confidence_reason):
+                    try:
+                        with transaction.atomic():
+                            Identification.objects.create(observation=observation, confidence=confidence,
+                                                          confidence_reason=confidence_reason, notebook='1')
+                            transaction.set_rollback(True)
+                        allowed = True
+                    except IntegrityError:
+                        allowed = False
+
+                    self.assertEqual(allowed, confidence_reason in Identification.CONFIDENCE_REASONS[confidence])
+
+
+class ImportPipelineTests(ImportObservationsTestCase):
+    def test_validation_errors_of_all_rows(self):
+        write_import_file(self.path, [
+            {'specimen_id': 'TAV01 20210812 X1 C001', 'notebook': '1'},
+            {'specimen_id': 'TAV01 20210812 H1 C002', 'sure': 'yes', 'notebook': '1',
+             'confidence_reason': 'ID_uncertain'},
+            {'specimen_id': 'TAV01 20210812 H1 C003', 'sure': 'maybe', 'id_date': '2022-13-01', 'notebook': '1'}])
+
+        errors = validate_rows(read_rows(self.path), import_obs_ids.validate_observation_row, chunk_size=2)
+
+        self.assertEqual([(error.line_number, error.column) for error in errors],
+                         [(2, 'specimen_id'), (3, 'confidence_reason'), (4, 'sure'), (4, 'id_date')])
+
+    def test_empty_meteorological_conditions_are_valid(self):
+        write_visits_file(self.path, [
+            {'sitename': 'TAV01', 'date': '2021-08-13', 'start_time': '10:00', 'end_time': '10:30', 'method': 'net',
+             'repeat': '1'},
+            {'sitename': 'TAV01', 'date': '2021-08-13', 'start_time': '11:00', 'end_time': '11:30', 'method': 'net',
+             'repeat': '2', 'start_cloud': '9', 'start_wind': 'strong'}])
+
+        errors = validate_rows(read_rows(self.path), import_visits_surveys.validate_visit_survey_row)
+
+        self.assertEqual([(error.line_number, error.column) for error in errors],
+                         [(3, 'start_cloud'), (3, 'start_wind')])
+
+    def test_nothing_is_imported_with_errors(self):
+        write_import_file(self.path, [
+            {'specimen_id': 'TAV01 20210812 H1 C001', 'species': 'Chorthippus parallelus', 'notebook': '1'},
+            {'specimen_id': 'TAV01 20210812 H1 C002', 'species': 'Chorthippus unknown', 'notebook': '1'},
+            {'specimen_id': 'TAV01 20210812 H2 C003', 'notebook': '1'}])
+
+        with self.assertRaisesRegex(CommandError, '2 errors') as context:
+            self.import_observations(bulk=True)
+
+        self.assertIn('Line 3: species', str(context.exception))
+        self.assertIn('Line 4: specimen_id', str(context.exception))
+        self.assertFalse(Observation.objects.exists())
+
+
+class ImportInterrupted(Exception):
+    pass
+
+
+class ChunkedImportTests(ImportObservationsTestCase):
+    def setUp(self):
+        super().setUp()
+
+        write_import_file(self.path, [{'specimen_id': f'TAV01 20210812 H1 C00{number}',
+                                       'species': 'Chorthippus parallelus', 'notebook': '1'} for number in range(1, 6)])
+
+    def test_interrupted_import_is_resumed(self):
+        write_observations = import_obs_ids.write_observations
+
+        def interrupted_write(objects, batch_size):
+            if Observation.objects.exists():
+                raise ImportInterrupted()
+
+            write_observations(objects, batch_size)
+
+        with mock.patch.object(import_obs_ids, 'write_observations', interrupted_write):
+            with self.assertRaises(ImportInterrupted):
+                self.import_observations(chunk_size=2)
+
+        # The first chunk has been committed
+        self.assertEqual(Observation.objects.count(), 2)
+        checkpoint = ImportCheckpoint.objects.get(command='import_obs_ids')
+        self.assertEqual((checkpoint.last_line, checkpoint.finished), (3, False))
+
+        with self.assertRaisesRegex(CommandError, 'use --resume'):
+            self.import_observations(chunk_size=2)
+
+        self.import_observations(chunk_size=2, resume=True)
+
+        self.assertEqual(list(Observation.objects.order_by('specimen_label').values_list('specimen_label', flat=True)),
+                         [f'TAV01 20210812 H1 C00{number}' for number in range(1, 6)])
+        self.assertEqual(Identification.objects.count(), 5)
+        self.assertTrue(ImportCheckpoint.objects.get(command='import_obs_ids').finished)
+
+        with self.assertRaisesRegex(CommandError, 'has already been imported'):
+            self.import_observations(chunk_size=2, resume=True)
+
+
+class IncrementalImportTests(ImportObservationsTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.rows = [{'specimen_id': f'TAV01 20210812 H1 C00{number}', 'species': 'Chorthippus parallelus',
+                      'sure': 'check', 'guide': 'Sardet et al', 'notebook': '1', 'id_date': '2022-03-04'}
+                     for number in range(1, 4)]
+
+        write_import_file(self.path, self.rows)
+        self.import_observations(incremental=True)
+
+    def get_identifications(self, specimen_label):
+        return Identification.objects.filter(observation__specimen_label=specimen_label)
+
+    def test_unchanged_file_and_rows_are_skipped(self):
+        updated_on = dict(Identification.objects.values_list('id', 'updated_on'))
+
+        self.import_observations(incremental=True)
+
+        self.rows[1]['sex'] = 'female'
+        write_import_file(self.path, self.rows)
+        self.import_observations(incremental=True)
+
+        changed = {identification_id for identification_id, time in Identification.objects.values_list(
+            'id', 'updated_on') if time != updated_on[identification_id]}
+        self.assertEqual(changed, {self.get_identifications('TAV01 20210812 H1 C002').get().id})
+        self.assertEqual(self.get_identifications('TAV01 20210812 H1 C002').get().sex, Identification.Sex.FEMALE)
+        self.assertEqual(Identification.objects.count(), 3)
+
+    def test_species_correction_updates_identification(self):
+        identification = self.get_identifications('TAV01 20210812 H1 C001').get()
+
+        self.rows[0]['species'] = 'Oedipoda caerulescens'
+        write_import_file(self.path, self.rows)
+        self.import_observations(incremental=True)
+
+        corrected = self.get_identifications('TAV01 20210812 H1 C001').get()
+        self.assertEqual(corrected.id, identification.id)
+        self.assertEqual(corrected.species, self.taxa['species_2'])
+        self.assertEqual(corrected.subfamily, self.taxa['subfamily_2'])
+        self.assertEqual(ResolvedIdentification.objects.get(observation=corrected.observation).taxon,
+                         'Oedipoda caerulescens')
+        self.assertEqual(ImportedRow.objects.get(command='import_obs_ids', key='TAV01 20210812 H1 C001').identification,
+                         corrected)
+
+    def test_correction_to_another_identification_is_an_error(self):
+        observation = Observation.objects.get(specimen_label='TAV01 20210812 H1 C001')
+        self.create_identification(observation, self.taxa['species_2'], identification_guide=self.guide,
+                                   date_of_identification=datetime.date(2022, 3, 4))
+
+        self.rows[0]['species'] = 'Oedipoda caerulescens'
+        write_import_file(self.path, self.rows)
+
+        with self.assertRaisesRegex(CommandError, 'Line 2: species: The observation already has another'):
+            self.import_observations(incremental=True)
+
+        self.assertEqual(self.get_identifications('TAV01 20210812 H1 C001').filter(
+            species=self.taxa['species_1']).count(), 1)
+
+
+class ImportVisitsSurveysTests(ObservationsTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'surveys.csv')
+        create_site('TAV02')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def import_surveys(self, rows):
+        """Import the rows and return the number of queries."""
+
+        write_visits_file(self.path, rows)
+
+        with QueryCounter() as queries:
+            run_quietly(import_visits_surveys.Command().handle, filename=self.path, workers=1, error_report=None,
+                        incremental=False)
+
+        return queries.count
+
+    def test_empty_meteorological_conditions_are_null(self):
+        self.import_surveys([{'sitename': 'TAV01', 'date': '2021-08-13', 'start_time': '10:00', 'end_time': '10:30',
+                              'method': 'net', 'repeat': '1', 'notes': 'no data'}])
+
+        met_conditions = MeteorologyConditions.objects.get(survey__visit__date=datetime.date(2021, 8, 13))
+        self.assertEqual([getattr(met_conditions, field) for field in import_visits_surveys.MET_CONDITIONS_COLUMNS],
+                         [None] * 6)
+        self.assertEqual(met_conditions.notes, 'no data')
+
+    def test_number_of_queries_does_not_depend_on_the_rows(self):
+        surveys = [(10, 'net', '1'), (11, 'net', '2'), (12, 'hand', '1')]
+        rows = [{'sitename': site_name, 'date': f'2021-08-{day}', 'start_time': f'{hour}:00', 'end_time': f'{hour}:30',
+                 'method': method, 'repeat': repeat, 'start_cloud': '2', 'start_rain': '0', 'start_wind': '1',
+                 'end_cloud': '3', 'end_rain': '0', 'end_wind': '1'}
+                for site_name in ['TAV01', 'TAV02'] for day in [13, 14] for hour, method, repeat in surveys]
+
+        with transaction.atomic():
+            one_row_queries = self.import_surveys(rows[:1])
+            transaction.set_rollback(True)
+
+        queries = self.import_surveys(rows)
+
+        self.assertEqual(Survey.objects.count(), len(rows) + 1)
+        self.assertEqual(MeteorologyConditions.objects.count(), len(rows))
+        self.assertEqual(queries, one_row_queries)
+
+
+class ExportObservationsTests(ObservationsTestCase):
+    def create_observations(self, numbers):
+        """Create observations with a confirmed identification, and one with two finalised identifications."""
+
+        for number in numbers[:-1]:
+            observation = create_observation(self.survey, f'TAV01 20210812 H1 C{number:03}')
+            self.create_identification(observation, self.taxa['species_1'], Identification.Confidence.CONFIRMED,
+                                       sex=Identification.Sex.MALE, stage=Identification.Stage.ADULT)
+
+        observation = create_observation(self.survey, f'TAV01 20210812 H1 C{numbers[-1]:03}')
+        for species in [self.taxa['species_1'], self.taxa['species_2']]:
+            self.create_identification(observation, species, Identification.Confidence.FINALISED)
+
+    def export(self):
+        """Return the CSV text of the export and its number of queries."""
+
+        output_file = io.StringIO()
+
+        with QueryCounter() as queries:
+            export_observations_csv.export_csv(output_file, [], io.StringIO())
+
+        return output_file.getvalue(), queries.count
+
+    def test_rows_and_number_of_queries_do_not_change_with_more_observations(self):
+        self.create_observations([1, 2, 3])
+        text, number_queries = self.export()
+
+        self.create_observations([101, 102, 103, 104])
+        new_text, new_number_queries = self.export()
+
+        original_lines = [line for line in new_text.splitlines(keepends=True) if ' C10' not in line]
+        self.assertEqual(''.join(original_lines), text)
+        self.assertEqual(len(new_text.splitlines()), len(text.splitlines()) + 5)
+        self.assertEqual(new_number_queries, number_queries)
+
+    def test_stats_are_not_written_to_the_output_file(self):
+        self.create_observations([1, 2])
+        output_file = io.StringIO()
+        stderr = io.StringIO()
+
+        export_observations_csv.Command(stderr=stderr).handle(output_file=output_file, practice_sites=[], since=None,
+                                                              delta=False, watermark=False)
+
+        output_file.seek(0)
+        self.assertEqual([row['specimen_label'] for row in csv.DictReader(output_file)],
+                         ['TAV01 20210812 H1 C001', 'TAV01 20210812 H1 C002', 'TAV01 20210812 H1 C002'])
+        self.assertIn('Exported 3 rows', stderr.getvalue())
+
+
+class IdentificationSnapshotTests(ObservationsTestCase):
+    def setUp(self):
+        ensifera = TaxonomySuborder.objects.create(suborder='Ensifera', order=self.taxa['suborder'].order)
+        Confidence = Identification.Confidence
+        Stage = Identification.Stage
+
+        # (taxon, confidence, stage) of the identifications of each observation: the taxon is a species, a genus or a
+        # suborder
+        identifications = {
+            'C001': [('species_1', Confidence.CONFIRMED, Stage.ADULT), ('species_2', Confidence.CHECK, Stage.ADULT)],
+            'C002': [('species_2', Confidence.FINALISED, Stage.NYMPH),
+                     ('species_1', Confidence.FINALISED, Stage.NYMPH)],
+            'C003': [('species_1', Confidence.CHECK, Stage.ADULT)],
+            'C004': [('species_2', Confidence.CHECK_IN_MUSEUM, None), ('species_2', Confidence.REDO, Stage.UNKNOWN)],
+            'C005': [('species_1', Confidence.REVIEW, Stage.NYMPH), ('genus_1', Confidence.CHECK, Stage.NYMPH)],
+            'C006': [('genus_1', Confidence.IN_PROGRESS, Stage.ADULT)],
+            'C007': [('genus_2', None, None), ('genus_2', Confidence.CHECK_IN_MUSEUM, Stage.ADULT)],
+            'C008': [(ensifera, Confidence.CHECK, Stage.ADULT)],
+            'C009': [(None, Confidence.CHECK, Stage.NYMPH)],
+            'C010': [],
+        }
+
+        for number, taxa in identifications.items():
+            observation = create_observation(self.survey, f'TAV01 20210812 H1 {number}')
+
+            for taxon, confidence, stage in taxa:
+                species = None
+                if isinstance(taxon, TaxonomySuborder):
+                    taxa_kwargs = {'suborder': taxon}
+                elif taxon is None:
+                    taxa_kwargs = {}
+                elif taxon.startswith('species'):
+                    species = self.taxa[taxon]
+                    taxa_kwargs = {'genus': species.genus, 'suborder': self.taxa['suborder']}
+                else:
+                    taxa_kwargs = {'genus': self.taxa[taxon], 'suborder': self.taxa['suborder']}
+
+                self.create_identification(observation, species, confidence, stage=stage, **taxa_kwargs)
+
+    def test_reports_are_those_of_the_species_report(self):
+        with self.assertNumQueries(5):
+            snapshot = IdentificationSnapshot.load()
+
+        report = SpeciesReport(use_cache=False)
+
+        for metric in ['observations_count', 'observations_suborder', 'identified_observations_finalised_count',
+                       'identified_observations_to_species', 'identified_observations_to_genus_not_species',
+                       'identifications_stage_count', 'identifications_stage_confidence_count']:
+            with self.subTest(metric=metric):
+                self.assertEqual(getattr(snapshot, metric)(), getattr(report, metric)())
+
+        identified_to_species = report.identified_observations_to_species()
+
+        for confidence in [Identification.Confidence.CHECK, Identification.Confidence.CHECK_IN_MUSEUM]:
+            with self.subTest(confidence=confidence):
+                labels = snapshot.get_species_from_specimen_label_confidence_set(identified_to_species, confidence)
+
+                self.assertTrue(labels)
+                self.assertEqual(labels, report.get_species_from_specimen_label_confidence_set(identified_to_species,
+                                                                                              confidence))
+
+
+class FinalisedConfirmedConsistencyTests(ObservationsTestCase):
+    def setUp(self):
+        genus_1 = self.taxa['genus_1']
+        suborder = self.taxa['suborder']
+
+        # Values of each field of CONSISTENCY_RULES in two identifications which only differ by this field: the taxa
+        # have the same higher taxa (which are set from them when the identification is saved)
+        self.values = {'sex': (Identification.Sex.MALE, Identification.Sex.FEMALE),
+                       'stage': (Identification.Stage.ADULT, Identification.Stage.NYMPH),
+                       'species': (self.taxa['species_1'],
+                                   TaxonomySpecies.objects.create(latin_name='Chorthippus biguttulus', genus=genus_1)),
+                       'genus': (genus_1, TaxonomyGenus.objects.create(genus='Omocestus',
+                                                                       subfamily=self.taxa['subfamily_1'])),
+                       'subfamily': (self.taxa['subfamily_1'], self.taxa['subfamily_2']),
+                       'family': (self.taxa['family'], TaxonomyFamily.objects.create(family='Pamphagidae',
+                                                                                     suborder=suborder)),
+                       'suborder': (suborder, TaxonomySuborder.objects.create(suborder='Ensifera',
+                                                                              order=suborder.order))}
+
+    def identify(self, specimen_label, confidence, **kwargs):
+        """Create an identification of an observation (created if needed). It is an adult male of species_1, unless
+        another sex, stage or taxon is given in kwargs."""
+
+        observation, created = Observation.objects.get_or_create(specimen_label=specimen_label, survey=self.survey,
+                                                                 status=Observation.Status.SPECIMEN)
+
+        taxa = {field: kwargs.pop(field) for field in TAXONOMY_FIELDS if field in kwargs}
+        taxa = taxa or {'species': self.taxa['species_1']}
+
+        return self.create_identification(observation, taxa.pop('species', None), confidence,
+                                          **{'sex': Identification.Sex.MALE, 'stage': Identification.Stage.ADULT,
+                                             **taxa, **kwargs})
+
+    def test_each_rule_is_checked(self):
+        Confidence = Identification.Confidence
+
+        expected = {}
+        for number, (rule, confidences) in enumerate(CONSISTENCY_RULES, start=1):
+            specimen_label = f'TAV01 20210812 H1 C{number:03}'
+            value, other_value = self.values[rule]
+
+            self.identify(specimen_label, Confidence.CONFIRMED, **{rule: value})
+            self.identify(specimen_label, Confidence.CONFIRMED, **{rule: other_value})
+            expected[rule] = {specimen_label}
+
+        self.identify('TAV01 20210812 H1 C101', Confidence.FINALISED)
+        expected['finalised_number'] = {'TAV01 20210812 H1 C101'}
+
+        # Consistent observations: confirmed identifications that are the same, and finalised identifications of
+        # different taxa with the same sex and stage
+        self.identify('TAV01 20210812 H1 C102', Confidence.CONFIRMED)
+        self.identify('TAV01 20210812 H1 C102', Confidence.CONFIRMED)
+        self.identify('TAV01 20210812 H1 C103', Confidence.FINALISED)
+        self.identify('TAV01 20210812 H1 C103', Confidence.FINALISED, species=self.taxa['species_2'])
+
+        self.assertEqual(IdentificationDataChecks().check_finalised_confirmed_consistency(), expected)
+
+        run = DataCheckRun()
+        for name, rule in [('finalised_confirmed_different_sex', 'sex'),
+                           ('finalised_confirmed_different_stage', 'stage'),
+                           ('observations_with_one_finalised_identification', 'finalised_number')]:
+            self.assertEqual(set(run.evaluate(get_data_check(name))), expected[rule])
+
+        self.assertEqual(run.evaluate(get_data_check('confirmed_different_taxonomy')),
+                         [{'specimen_label': specimen_label, 'field': field}
+                          for field in TAXONOMY_FIELDS for specimen_label in expected[field]])
+
+
+class MissingDataCheckTests(ObservationsTestCase):
+    def evaluate(self, name):
+        return list(DataCheckRun().evaluate(get_data_check(name)))
+
+    def test_surveys_without_met_conditions(self):
+        create_survey(self.site, repeat=Survey.Repeat.TWO)
+        MeteorologyConditions.objects.create(survey=self.survey, cloud_coverage_start=2)
+
+        self.assertEqual(self.evaluate('surveys_without_met_conditions'),
+                         [('TAV01', datetime.date(2021, 8, 12), Survey.Method.HAND, Survey.Repeat.TWO)])
+
+    def test_observations_without_identification_or_suborder(self):
+        observation_1 = create_observation(self.survey, 'TAV01 20210812 H1 C001')
+        self.create_identification(observation_1, self.taxa['species_1'], Identification.Confidence.CONFIRMED)
+
+        # Only one of the identifications has a suborder
+        observation_2 = create_observation(self.survey, 'TAV01 20210812 H1 C002')
+        self.create_identification(observation_2, None, Identification.Confidence.CHECK)
+        self.create_identification(observation_2, self.taxa['species_2'], Identification.Confidence.CHECK)
+
+        observation_3 = create_observation(self.survey, 'TAV01 20210812 H1 C003')
+        self.create_identification(observation_3, None, Identification.Confidence.CHECK)
+
+        create_observation(self.survey, 'TAV01 20210812 H1 C004')
+
+        self.assertEqual(self.evaluate('observations_without_suborder'),
+                         ['TAV01 20210812 H1 C003', 'TAV01 20210812 H1 C004'])
+        self.assertEqual(self.evaluate('observations_without_identification'), ['TAV01 20210812 H1 C004'])
+        self.assertEqual(self.evaluate('observations_without_confirmed_or_finalised_identification'),
+                         ['TAV01 20210812 H1 C002', 'TAV01 20210812 H1 C003'])
@@ -1,5 +1,46 @@
+import hashlib
+
+from django.db import connection
+
+# Maximum number of values in each "IN" lookup, to stay below the limit of query parameters in SQLite.
+IN_QUERY_CHUNK_SIZE = 500
+
+
 def field_or_empty_string(model, field_name):
     if model is None:
         return ''
     else:
-        return getattr(model, field_name)
\ No newline at end of file
+        return getattr(model, field_name)
+
+
+def get_file_checksum(path):
+    """Return the SHA-256 checksum of a file, as a hexadecimal string."""
+
+    checksum = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            checksum.update(block)
+
+    return checksum.hexdigest()
+
+
+class QueryCounter:
+    """Context manager that counts the queries run on the database connection while it is active (see
+    connection.execute_wrapper), unlike django.test.utils.CaptureQueriesContext it does not keep the queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.wrapper.__exit__(exc_type, exc_value, traceback)